@@ -8,6 +8,10 @@
 
 export const API_BASE_URL = 'http://10.0.2.2:8000/api';
 
+// WebSocket chat channel (needs the backend running under ASGI); messages
+// are sent to ${API_BASE_URL}/chat/ whenever the socket is not available
+export const WS_CHAT_URL = API_BASE_URL.replace(/^http/, 'ws').replace(/\/api$/, '/ws/chat/');
+
 // Alternatively, use environment-specific configuration:
 // const BASE_URL_DEV = 'http://10.0.2.2:8000/api';
 // const BASE_URL_PROD = 'https://api.astrotamil.com/api';
@@ -17,7 +17,7 @@ import AsyncStorage from '@react-native-async-storage/async-storage';
 import Icon from 'react-native-vector-icons/MaterialIcons';
 
 // API Configuration
-import { API_BASE_URL } from '../config';
+import { API_BASE_URL, WS_CHAT_URL } from '../config';
 
 interface Message {
   id: string;
@@ -34,6 +34,23 @@ interface HumanHandoffData {
 
 type LanguageCode = 'en' | 'ta';
 
+// How long to wait for an answer over the socket before retrying over REST
+const SOCKET_REPLY_TIMEOUT_MS = 15000;
+
+// The socket could not deliver the message; send it to /chat/ instead
+class SocketUnavailableError extends Error {}
+
+// While the socket is still answering a message, or has answered but not
+// yet saved it (up to CHAT_WS_FLUSH_SECONDS, 5 s), /chat/ answers 409 for its key
+const REST_CONFLICT_RETRIES = 8;
+const REST_CONFLICT_DELAY_MS = 1000;
+
+interface PendingReply {
+  resolve: (data: any) => void;
+  reject: (error: any) => void;
+  timer: ReturnType<typeof setTimeout>;
+}
+
 interface LanguageStrings {
   greeting: string;
   placeholder: string;
@@ -104,12 +121,117 @@ const ChatScreen: React.FC = () => {
   const [isLoadingHistory, setIsLoadingHistory] = useState(false);
   
   const flatListRef = useRef<FlatList>(null);
+  const socketRef = useRef<WebSocket | null>(null);
+  const pendingRepliesRef = useRef<Map<string, PendingReply>>(new Map());
   const strings = LANGUAGE_STRINGS[language];
 
   useEffect(() => {
     initializeSession();
   }, []);
 
+  // One chat socket per session and language; closed when either changes
+  useEffect(() => {
+    if (!sessionId) return;
+    openSocket(sessionId, language);
+    return () => closeSocket();
+  }, [sessionId, language]);
+
+  const failPendingReplies = () => {
+    pendingRepliesRef.current.forEach(pending => {
+      clearTimeout(pending.timer);
+      pending.reject(new SocketUnavailableError('Chat socket closed'));
+    });
+    pendingRepliesRef.current.clear();
+  };
+
+  const openSocket = (sid: string, lang: LanguageCode) => {
+    const url = `${WS_CHAT_URL}?session_id=${encodeURIComponent(sid)}&language=${lang}`;
+    let socket: WebSocket;
+    try {
+      socket = new WebSocket(url);
+    } catch (error) {
+      console.log('Chat socket unavailable, using REST:', error);
+      return;
+    }
+    socketRef.current = socket;
+
+    socket.onmessage = event => {
+      let data: any;
+      try {
+        data = JSON.parse(event.data);
+      } catch {
+        return;
+      }
+      const pending = pendingRepliesRef.current.get(data.request_id);
+      if (!pending) return;
+      pendingRepliesRef.current.delete(data.request_id);
+      clearTimeout(pending.timer);
+      if (data.error) {
+        // Same shape as an axios error, for the error handling in sendMessage
+        pending.reject({ response: { status: data.status, data } });
+      } else {
+        pending.resolve(data);
+      }
+    };
+
+    socket.onclose = () => {
+      if (socketRef.current === socket) {
+        socketRef.current = null;
+      }
+      failPendingReplies();
+    };
+  };
+
+  const closeSocket = () => {
+    const socket = socketRef.current;
+    socketRef.current = null;
+    failPendingReplies();
+    socket?.close();
+  };
+
+  const sendOverSocket = (message: string, idempotencyKey: string): Promise<any> => {
+    const socket = socketRef.current;
+    if (!socket || socket.readyState !== WebSocket.OPEN) {
+      if (!socket && sessionId) {
+        // Try to reconnect for the next message
+        openSocket(sessionId, language);
+      }
+      return Promise.reject(new SocketUnavailableError('Chat socket not open'));
+    }
+
+    const requestId = `${Date.now()}_${Math.random().toString(36).substr(2, 9)}`;
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        pendingRepliesRef.current.delete(requestId);
+        reject(new SocketUnavailableError('Chat socket timed out'));
+        // A stuck socket is replaced on the next message
+        closeSocket();
+      }, SOCKET_REPLY_TIMEOUT_MS);
+      pendingRepliesRef.current.set(requestId, { resolve, reject, timer });
+      socket.send(JSON.stringify({ message, request_id: requestId, idempotency_key: idempotencyKey }));
+    });
+  };
+
+  // The same key as the socket attempt, so a message the socket already
+  // answered is replayed instead of being answered twice
+  const sendOverRest = async (message: string, idempotencyKey: string) => {
+    for (let attempt = 0; ; attempt++) {
+      try {
+        const response = await axios.post(`${API_BASE_URL}/chat/`, {
+          session_id: sessionId,
+          message: message,
+          language: language,
+        }, {
+          headers: { 'Idempotency-Key': idempotencyKey },
+        });
+        return response.data;
+      } catch (error: any) {
+        if (error?.response?.status !== 409 || attempt >= REST_CONFLICT_RETRIES) throw error;
+        await new Promise(resolve => setTimeout(resolve, REST_CONFLICT_DELAY_MS));
+      }
+    }
+  };
+
   const initializeSession = async () => {
     try {
       let storedSession = await AsyncStorage.getItem('session_id');
@@ -257,22 +379,25 @@ const ChatScreen: React.FC = () => {
       if (!sessionId) {
         await initializeSession();
       }
-      const response = await axios.post(`${API_BASE_URL}/chat/`, {
-        session_id: sessionId,
-        message: message,
-        language: language,
-      });
+      const idempotencyKey = `msg_${Date.now()}_${Math.random().toString(36).substr(2, 9)}`;
+      let data: any;
+      try {
+        data = await sendOverSocket(message, idempotencyKey);
+      } catch (error) {
+        if (!(error instanceof SocketUnavailableError)) throw error;
+        data = await sendOverRest(message, idempotencyKey);
+      }
 
       const aiMessage: Message = {
         id: (Date.now() + 1).toString(),
-        text: response.data.ai_response,
+        text: data.ai_response,
         isUser: false,
         timestamp: new Date(),
       };
 
       setMessages(prev => [...prev, aiMessage]);
 
-      if (response.data.response_type === 'collect_human_details') {
+      if (data.response_type === 'collect_human_details') {
         setTimeout(() => {
           setShowHumanForm(true);
         }, 500);
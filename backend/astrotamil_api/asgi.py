@@ -0,0 +1,18 @@
+import os
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'astrotamil_api.settings')
+# Set up Django before anything imports models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+
+from chatbot.routing import websocket_urlpatterns  # noqa: E402
+
+# HTTP is served as under WSGI; WebSockets carry the chat channel
+# (chatbot/consumers.py). Mobile clients send no Origin header, and the
+# socket, like /api/chat/, needs no credentials, so origins are not checked.
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': URLRouter(websocket_urlpatterns),
+})
@@ -0,0 +1,112 @@
+"""
+Database routing for an optional read replica.
+
+All queries go to ``default`` unless code opts in with ``use_replica()``,
+which is done for read-only paths that tolerate replication lag:
+conversation history, admin changelists and FAQ index loading. Writes
+always go to ``default``.
+
+Read-your-writes: after a chat write, mark_session_written(session_id)
+keeps that session's replica reads on the primary for
+DATABASE_REPLICA_STICKY_SECONDS. The marks live in the cache named by
+SESSION_CACHE_BACKEND, or else the default cache. A local-memory cache
+only holds the marks of its own worker, so session-scoped reads
+(``use_replica(session_id=...)``) stay on the primary unless that cache is
+shared by all workers (e.g. Redis or a database cache).
+"""
+
+import contextvars
+import hashlib
+from contextlib import contextmanager
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+
+REPLICA_ALIAS = 'replica'
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+def replica_configured() -> bool:
+    return REPLICA_ALIAS in connections.settings
+
+
+def _sticky_cache():
+    return caches[getattr(settings, 'SESSION_CACHE_BACKEND', '') or 'default']
+
+
+def sticky_marks_shared() -> bool:
+    """Whether a session's read-your-writes mark is seen by every worker"""
+    return not isinstance(_sticky_cache(), (LocMemCache, DummyCache))
+
+
+def _sticky_key(session_id: str) -> str:
+    return 'replica-sticky:' + hashlib.md5(session_id.encode('utf-8')).hexdigest()
+
+
+def mark_session_written(session_id: str):
+    """Send this session's replica reads to the primary until the replica has caught up."""
+    if replica_configured():
+        timeout = getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 5)
+        _sticky_cache().set(_sticky_key(session_id), True, timeout)
+
+
+def session_is_sticky(session_id: Optional[str]) -> bool:
+    return bool(session_id) and _sticky_cache().get(_sticky_key(session_id), False)
+
+
+@contextmanager
+def use_replica(session_id: Optional[str] = None):
+    """
+    Route reads inside the block to the replica, if one is configured and
+    ``session_id`` has not written recently.
+    """
+    enabled = replica_configured()
+    if enabled and session_id:
+        # Another worker may have taken the write; without shared marks the
+        # session could miss its own messages on a lagging replica
+        enabled = sticky_marks_shared() and not session_is_sticky(session_id)
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    """Reads inside use_replica() go to the replica; everything else to default"""
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica receives its schema through replication
+        return db != REPLICA_ALIAS
+
+
+class ReplicaChangeListMixin:
+    """ModelAdmin mixin that reads changelist pages from the replica"""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            # Bulk actions read and write the primary
+            return super().changelist_view(request, extra_context)
+        with use_replica():
+            response = super().changelist_view(request, extra_context)
+            # TemplateResponse runs the queries when it is rendered
+            if hasattr(response, 'render'):
+                response.render()
+        return response
@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -15,6 +16,8 @@ ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', 'localhost,127.0.0.1,10.0.2.2').split
 
 # Application definition
 INSTALLED_APPS = [
+    # ASGI runserver, so the WebSocket chat works in development
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -35,6 +38,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    # No-op unless PROFILING_ENABLED=True
+    'chatbot.middleware.ProfilingMiddleware',
+    # brotli/gzip for large /api/ JSON responses
+    'chatbot.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +70,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'astrotamil_api.wsgi.application'
+# WebSocket chat (ws/chat/) needs an ASGI server, e.g. uvicorn or daphne
+ASGI_APPLICATION = 'astrotamil_api.asgi.application'
 
 # Database
 # By default use SQLite for easy local development. To use Postgres in
@@ -81,14 +90,80 @@ if os.getenv('POSTGRES_NAME'):
             'PORT': os.getenv('POSTGRES_PORT', '5432'),
         }
     }
+    if os.getenv('POSTGRES_REPLICA_HOST'):
+        DATABASES['replica'] = dict(
+            DATABASES['default'],
+            HOST=os.getenv('POSTGRES_REPLICA_HOST'),
+            PORT=os.getenv('POSTGRES_REPLICA_PORT', DATABASES['default']['PORT']),
+        )
 else:
     # SQLite is fine for development and CI runs where Postgres is not available
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+            # Overridable so benchmarks can point a server at a throwaway file
+            'NAME': os.getenv('SQLITE_PATH', os.path.join(BASE_DIR, 'db.sqlite3')),
         }
     }
+    # A second SQLite file standing in for a read replica when trying out
+    # replica routing locally (e.g. a periodic copy of db.sqlite3)
+    if os.getenv('SQLITE_REPLICA_NAME'):
+        DATABASES['replica'] = dict(DATABASES['default'], NAME=os.getenv('SQLITE_REPLICA_NAME'))
+
+# Horizontal sharding of chat data (astrotamil_api/sharding.py): with
+# DATABASE_SHARD_COUNT > 0, conversations, messages and handoff requests
+# are spread over the aliases shard_0 .. shard_<N-1> by a hash of
+# session_id, while FAQs, rollups and admin data stay on 'default'. With
+# SQLite each shard is a file in SQLITE_SHARD_DIR (db_shard_0.sqlite3, ...);
+# with Postgres each is a database <POSTGRES_NAME>_shard_<i> on the matching
+# host of POSTGRES_SHARD_HOSTS (comma separated, defaults to POSTGRES_HOST).
+# After adding shards, run `manage.py migrate --database shard_<i>` for each
+# new one and then `manage.py rebalance_shards`.
+DATABASE_SHARD_COUNT = int(os.getenv('DATABASE_SHARD_COUNT', '0'))
+DATABASE_SHARDS = [f'shard_{i}' for i in range(DATABASE_SHARD_COUNT)]
+_shard_hosts = [host for host in os.getenv('POSTGRES_SHARD_HOSTS', '').split(',') if host]
+for _index, _alias in enumerate(DATABASE_SHARDS):
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        DATABASES[_alias] = dict(
+            DATABASES['default'],
+            NAME=os.path.join(os.getenv('SQLITE_SHARD_DIR', BASE_DIR), f'db_{_alias}.sqlite3'),
+        )
+    else:
+        DATABASES[_alias] = dict(
+            DATABASES['default'],
+            NAME=f"{DATABASES['default']['NAME']}_{_alias}",
+            HOST=_shard_hosts[_index % len(_shard_hosts)] if _shard_hosts else DATABASES['default']['HOST'],
+        )
+
+# Opt-in tuning for serving production traffic from SQLite on one box
+# (chatbot/sqlite_tuning.py): WAL, busy timeout, synchronous=NORMAL, mmap
+# and page cache on every connection, and one writer thread per process for
+# chat-turn writes. Only SQLite databases are affected; writes to PostgreSQL
+# (including PostgreSQL shards) always run inline.
+SQLITE_TUNING = os.getenv('SQLITE_TUNING', 'False') == 'True'
+SQLITE_SINGLE_WRITER = os.getenv('SQLITE_SINGLE_WRITER', str(SQLITE_TUNING)) == 'True'
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+# Negative values are KiB, positive values pages
+SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', '-65536'))
+SQLITE_WRITER_MAX_BATCH = int(os.getenv('SQLITE_WRITER_MAX_BATCH', '64'))
+
+# Persistent connections, checked before reuse, instead of reconnecting on
+# every request (put PgBouncer in front of Postgres for real pooling)
+for _database in DATABASES.values():
+    _database['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+    _database['CONN_HEALTH_CHECKS'] = os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+
+# Read-only paths (conversation history, admin changelists, FAQ index
+# loading) use the 'replica' alias when configured; the test database for
+# the replica mirrors 'default'. A session's reads stay on the primary for
+# this many seconds after it writes. Those marks must be seen by every
+# worker: conversation history only reads from the replica when
+# SESSION_CACHE_BACKEND (or the default cache) is not local memory.
+if 'replica' in DATABASES:
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+DATABASE_ROUTERS = ['astrotamil_api.sharding.ShardRouter', 'astrotamil_api.routers.ReplicaRouter']
+DATABASE_REPLICA_STICKY_SECONDS = int(os.getenv('DATABASE_REPLICA_STICKY_SECONDS', '5'))
 
 # CORS settings
 # Read from environment or use defaults for development
@@ -96,6 +171,14 @@ cors_origins = os.getenv('CORS_ALLOWED_ORIGINS', 'http://localhost:8081,http://1
 CORS_ALLOWED_ORIGINS = [origin.strip() for origin in cors_origins.split(',')]
 
 CORS_ALLOW_ALL_ORIGINS = DEBUG
+# The app sends Idempotency-Key with chat POSTs (chatbot/idempotency.py)
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+
+# Reverse proxies in front of the app (1 behind the DigitalOcean load
+# balancer). Client IPs for throttling come from REMOTE_ADDR and the
+# X-Forwarded-For entries these proxies appended; 0 ignores the header,
+# which clients can otherwise fill with any address.
+NUM_PROXIES = int(os.getenv('NUM_PROXIES', '0'))
 
 # REST Framework settings
 REST_FRAMEWORK = {
@@ -106,8 +189,116 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
+    # orjson instead of the json module (chatbot/renderers.py, chatbot/parsers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'chatbot.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'chatbot.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'NUM_PROXIES': NUM_PROXIES,
 }
 
+# Maximum number of messages accepted by /api/chat/batch/
+CHAT_BATCH_MAX_ITEMS = int(os.getenv('CHAT_BATCH_MAX_ITEMS', '50'))
+
+# WebSocket chat writes a connection's messages in batches of up to this
+# many, or once the oldest unwritten one is this many seconds old
+CHAT_WS_FLUSH_MESSAGES = int(os.getenv('CHAT_WS_FLUSH_MESSAGES', '20'))
+CHAT_WS_FLUSH_SECONDS = float(os.getenv('CHAT_WS_FLUSH_SECONDS', '5.0'))
+
+# Out-of-process matcher (chatbot/matcher_service.py): with the Unix socket
+# of a running `manage.py matcher_service` set, workers send FAQ matching to
+# it instead of building the FAQ index themselves. A call that fails or
+# takes longer than MATCHER_SERVICE_TIMEOUT seconds is matched in-process,
+# and the service is not tried again for MATCHER_SERVICE_RETRY_SECONDS.
+MATCHER_SERVICE_SOCKET = os.getenv('MATCHER_SERVICE_SOCKET', '')
+MATCHER_SERVICE_TIMEOUT = float(os.getenv('MATCHER_SERVICE_TIMEOUT', '1.0'))
+MATCHER_SERVICE_RETRY_SECONDS = float(os.getenv('MATCHER_SERVICE_RETRY_SECONDS', '5.0'))
+
+# Batch scoring (chatbot/ai_matcher.py): for an FAQ corpus of at least
+# MATCHER_PARALLEL_MIN_FAQS entries, rapidfuzz bounds every FAQ's score in
+# C++ on MATCHER_SCORING_WORKERS threads (the GIL is released), and only
+# FAQs that can still win are scored in Python. Matches are the same as
+# with serial scoring.
+MATCHER_SCORING_WORKERS = int(os.getenv('MATCHER_SCORING_WORKERS', '1'))
+MATCHER_PARALLEL_MIN_FAQS = int(os.getenv('MATCHER_PARALLEL_MIN_FAQS', '100'))
+
+# FAQ search (/api/faq/search/ and the admin search box, faq/search.py):
+# results per page by default and at most (?page_size=)
+FAQ_SEARCH_PAGE_SIZE = int(os.getenv('FAQ_SEARCH_PAGE_SIZE', '20'))
+FAQ_SEARCH_MAX_PAGE_SIZE = int(os.getenv('FAQ_SEARCH_MAX_PAGE_SIZE', '100'))
+
+# Admission control for the chat endpoints (chatbot/admission.py): chat turns
+# processed at once per process, how many may wait and for how long, and
+# token buckets per session and per client IP (requests/second, burst;
+# a rate of 0 disables the bucket). The session bucket only stops scripted
+# floods: retries of a 409 Idempotency-Key reply take tokens too, so a person
+# sending quick follow-ups must never drain it. Without NUM_PROXIES every
+# client behind the load balancer shares its address, so the IP bucket
+# defaults to off until the proxies are configured.
+CHAT_MAX_CONCURRENT = int(os.getenv('CHAT_MAX_CONCURRENT', '4'))
+CHAT_MAX_QUEUE = int(os.getenv('CHAT_MAX_QUEUE', '16'))
+CHAT_QUEUE_TIMEOUT = float(os.getenv('CHAT_QUEUE_TIMEOUT', '2.0'))
+CHAT_SESSION_RATE = float(os.getenv('CHAT_SESSION_RATE', '3.0'))
+CHAT_SESSION_BURST = float(os.getenv('CHAT_SESSION_BURST', '30'))
+CHAT_IP_RATE = float(os.getenv('CHAT_IP_RATE', '10.0' if NUM_PROXIES else '0'))
+CHAT_IP_BURST = float(os.getenv('CHAT_IP_BURST', '100'))
+
+# Analytics rollups (chatbot/analytics.py): each worker counts responses in
+# memory and adds them to the rollup tables at most this often (seconds),
+# after a response is sent
+ANALYTICS_FLUSH_SECONDS = float(os.getenv('ANALYTICS_FLUSH_SECONDS', '10.0'))
+
+# Session lookup cache (chatbot/session_cache.py). SESSION_CACHE_BACKEND is
+# the alias of a cache in CACHES shared by all workers; empty keeps a
+# bounded LRU in each process.
+SESSION_CACHE_BACKEND = os.getenv('SESSION_CACHE_BACKEND', '')
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv('SESSION_CACHE_MAX_ENTRIES', '10000'))
+SESSION_CACHE_TIMEOUT = int(os.getenv('SESSION_CACHE_TIMEOUT', '3600'))
+# Write Conversation.last_active at most once per this many seconds per session
+LAST_ACTIVE_WRITE_INTERVAL = int(os.getenv('LAST_ACTIVE_WRITE_INTERVAL', '60'))
+
+# Idempotency-Key replay for /api/chat/ and the handoff POST
+# (chatbot/idempotency.py). Keys live in the idempotency_records table,
+# shared by all workers; IDEMPOTENCY_BACKEND may name a cache in CACHES
+# shared by all workers (e.g. Redis) to keep them there instead.
+IDEMPOTENCY_BACKEND = os.getenv('IDEMPOTENCY_BACKEND', '')
+# Seconds a completed response is replayed for its key
+IDEMPOTENCY_TIMEOUT = int(os.getenv('IDEMPOTENCY_TIMEOUT', '86400'))
+
+# Metrics (/metrics)
+# With several gunicorn workers, point METRICS_MULTIPROC_DIR at a directory
+# shared by all workers (emptied on each deploy) so scrapes see every worker.
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '1.0'))
+# Bearer token required to scrape /metrics; without one the endpoint is
+# only served when DEBUG is on (404 otherwise)
+METRICS_AUTH_TOKEN = os.getenv('METRICS_AUTH_TOKEN', '')
+
+# Request profiling (chatbot.middleware.ProfilingMiddleware)
+# When enabled, API responses carry a Server-Timing header, and sampled
+# requests (or those sending X-Profile-Request: <PROFILING_TOKEN>) are run
+# under cProfile with their profile and SQL log written to PROFILING_DIR.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0.01'))
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')
+PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', '200'))
+
+# Response compression (chatbot.middleware.CompressionMiddleware): JSON
+# responses under the path prefix of at least RESPONSE_COMPRESSION_MIN_BYTES,
+# and all streamed ones, are sent brotli- or gzip-compressed to clients
+# that accept it. Brotli quality 4 / gzip level 6 trade ratio for CPU.
+RESPONSE_COMPRESSION_ENABLED = os.getenv('RESPONSE_COMPRESSION_ENABLED', 'True') == 'True'
+RESPONSE_COMPRESSION_PATH_PREFIX = os.getenv('RESPONSE_COMPRESSION_PATH_PREFIX', '/api/')
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+RESPONSE_COMPRESSION_GZIP_LEVEL = int(os.getenv('RESPONSE_COMPRESSION_GZIP_LEVEL', '6'))
+RESPONSE_COMPRESSION_BROTLI_QUALITY = int(os.getenv('RESPONSE_COMPRESSION_BROTLI_QUALITY', '4'))
+
 # Internationalization
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'UTC'
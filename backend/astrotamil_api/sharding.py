@@ -0,0 +1,274 @@
+"""
+Horizontal sharding of chat data by session.
+
+With DATABASE_SHARDS set (see settings), Conversation, Message and
+HumanHandoffRequest rows live on the shard aliases, one shard per session
+picked by a jump consistent hash of session_id; FAQs, rollups, users and
+everything else stay on ``default``. Adding a shard moves about 1/N of
+the sessions (``python manage.py rebalance_shards`` moves their rows).
+
+Code that touches a session's chat data runs inside use_shard(session_id);
+queries of related rows follow the instance they start from. Chat queries
+outside use_shard() go to ``default``, which holds whatever has not been
+rebalanced yet. Admin changelists fan out over all shards (ShardedAdminMixin).
+"""
+
+import contextvars
+import hashlib
+from contextlib import contextmanager
+from typing import List, Optional
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+from django.db.models.expressions import OrderBy
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils.functional import cached_property
+
+SHARDED_MODELS = frozenset({'chatbot.conversation', 'chatbot.message', 'chatbot.humanhandoffrequest'})
+
+_current_shard = contextvars.ContextVar('current_shard', default=None)
+
+
+def shard_aliases() -> List[str]:
+    return getattr(settings, 'DATABASE_SHARDS', [])
+
+
+def chat_aliases() -> List[str]:
+    """Every alias that can hold chat data: default (not yet rebalanced rows) and the shards"""
+    return [DEFAULT_DB_ALIAS] + [alias for alias in shard_aliases() if alias != DEFAULT_DB_ALIAS]
+
+
+def is_sharded(model) -> bool:
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Lamping & Veach's jump consistent hash of a 64-bit key into [0, buckets)"""
+    bucket, j = -1, 0
+    while j < buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(session_id: str) -> str:
+    """The alias holding ``session_id``'s chat data"""
+    shards = shard_aliases()
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    key = int.from_bytes(hashlib.blake2b(session_id.encode('utf-8'), digest_size=8).digest(), 'big')
+    return shards[jump_hash(key, len(shards))]
+
+
+def current_shard() -> Optional[str]:
+    """The shard selected by the enclosing use_shard(), if sharding is on"""
+    return _current_shard.get()
+
+
+@contextmanager
+def use_shard(session_id: str):
+    """Route chat queries inside the block to ``session_id``'s shard."""
+    token = _current_shard.set(shard_for(session_id) if shard_aliases() else None)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+
+class ShardRouter:
+    """
+    Sharded models go to the shard of the enclosing use_shard() or of the
+    instance a query starts from. Other models are left to the next router,
+    except lookups from a sharded row (e.g. ``message.matched_faq``), which
+    go to default instead of following the row to its shard.
+    """
+
+    def _db_for(self, model, hints):
+        if not shard_aliases():
+            return None
+        instance = hints.get('instance')
+        if not is_sharded(model):
+            if instance is not None and is_sharded(type(instance)) and instance._state.db != DEFAULT_DB_ALIAS:
+                return DEFAULT_DB_ALIAS
+            return None
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return _current_shard.get()
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Rows on different shards cannot refer to each other
+        databases = {obj1._state.db, obj2._state.db}
+        if is_sharded(type(obj1)) and is_sharded(type(obj2)) and databases <= set(shard_aliases()):
+            return len(databases) == 1
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards only hold the sharded tables
+        if db in shard_aliases():
+            return model_name is not None and f"{app_label}.{model_name}" in SHARDED_MODELS
+        return None
+
+
+@receiver(post_delete, sender='faq.FAQ')
+def _unlink_deleted_faq(sender, instance, **kwargs):
+    # SET_NULL only reaches messages on the FAQ's own database
+    from chatbot.models import Message
+
+    for alias in shard_aliases():
+        if alias != instance._state.db:
+            Message.objects.using(alias).filter(matched_faq_id=instance.pk).update(matched_faq=None)
+
+
+def _ordering_keys(queryset):
+    """(field path, descending) pairs of the queryset's ORDER BY, for merging shard results"""
+    keys = []
+    for item in queryset.query.order_by or queryset.model._meta.ordering:
+        if isinstance(item, str):
+            keys.append((item.lstrip('-'), item.startswith('-')))
+        elif isinstance(item, OrderBy) and isinstance(item.expression, F):
+            keys.append((item.expression.name, item.descending))
+    return keys
+
+
+def _ordering_value(obj, path):
+    for name in path.split('__'):
+        if obj is None:
+            break
+        obj = obj.pk if name == 'pk' else getattr(obj, name, None)
+    # NULLs first, as SQLite sorts them
+    return (obj is not None, obj)
+
+
+class FanOutPaginator(Paginator):
+    """
+    Paginates a queryset over every chat alias: counts add up, and a page
+    is merged from the first rows of each alias in the queryset's order.
+    """
+
+    def __init__(self, object_list, per_page, aliases, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.aliases = aliases
+
+    @cached_property
+    def count(self):
+        return sum(self.object_list.using(alias).count() for alias in self.aliases)
+
+    def rows(self, bottom, top):
+        rows = []
+        for alias in self.aliases:
+            rows.extend(self.object_list.using(alias)[:top])
+        # Stable sorts, last key first, give the combined ORDER BY
+        for path, descending in reversed(_ordering_keys(self.object_list)):
+            rows.sort(key=lambda obj: _ordering_value(obj, path), reverse=descending)
+        return rows[bottom:top]
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        return self._get_page(self.rows(bottom, top), number, self)
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Narrows a changelist to one shard; lists the rows per shard"""
+
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        manager = model_admin.model._default_manager
+        return [
+            (alias, f"{alias} ({manager.using(alias).count()})")
+            for alias in chat_aliases()
+        ]
+
+    def queryset(self, request, queryset):
+        # ShardedAdminMixin.get_queryset() has already applied it
+        return None
+
+
+class ShardedChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        if not isinstance(self.paginator, FanOutPaginator):
+            return
+        if self.model_admin.show_full_result_count:
+            self.full_result_count = sum(
+                self.root_queryset.using(alias).count() for alias in self.paginator.aliases
+            )
+        if (self.show_all and self.can_show_all) or not self.multi_page:
+            # ChangeList lists the (default alias) queryset itself here
+            self.result_list = self.paginator.rows(0, self.result_count)
+
+
+class ShardedAdminMixin:
+    """
+    ModelAdmin mixin for sharded models. The changelist lists all shards
+    unless narrowed to one with the shard filter; actions need a shard to
+    be selected. Change and delete pages find the object on its shard.
+    """
+
+    def selected_shard(self, request) -> Optional[str]:
+        alias = request.GET.get(ShardListFilter.parameter_name)
+        return alias if alias in chat_aliases() else None
+
+    def fan_out(self, request) -> bool:
+        return bool(shard_aliases()) and self.selected_shard(request) is None
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if shard_aliases():
+            list_filter = (ShardListFilter,) + tuple(list_filter)
+        return list_filter
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        alias = self.selected_shard(request)
+        if shard_aliases() and alias:
+            queryset = queryset.using(alias)
+        return queryset
+
+    def get_changelist(self, request, **kwargs):
+        return ShardedChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if self.fan_out(request):
+            return FanOutPaginator(queryset, per_page, chat_aliases(), orphans=orphans,
+                                   allow_empty_first_page=allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_actions(self, request):
+        if self.fan_out(request):
+            return {}
+        return super().get_actions(request)
+
+    def get_object(self, request, object_id, from_field=None):
+        if not shard_aliases() or self.selected_shard(request):
+            return super().get_object(request, object_id, from_field)
+        queryset = self.get_queryset(request)
+        model = queryset.model
+        field = model._meta.pk if from_field is None else model._meta.get_field(from_field)
+        try:
+            object_id = field.to_python(object_id)
+        except (ValidationError, ValueError):
+            return None
+        for alias in chat_aliases():
+            obj = queryset.using(alias).filter(**{field.name: object_id}).first()
+            if obj is not None:
+                return obj
+        return None
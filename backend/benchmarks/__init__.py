@@ -0,0 +1,25 @@
+"""
+Reproducible benchmarks for the FAQ matcher and chat API.
+
+Run from the backend directory, e.g.::
+
+    python -m benchmarks.run --sizes 1000 10000 --output bench.json
+
+Benchmarks run against a throwaway test database, never db.sqlite3.
+"""
+
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAQ_JSON_PATH = os.path.join(BACKEND_DIR, 'astrologer_faqs_complete.json')
+
+
+def setup_django():
+    """Configure Django the same way the scripts in backend/scripts do."""
+    import django
+
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'astrotamil_api.settings')
+    django.setup()
@@ -0,0 +1,122 @@
+"""
+Benchmark response compression of /api/conversation-history/.
+
+Builds conversations of several lengths in a throwaway database, fetches
+each history uncompressed, gzip- and brotli-compressed (regular and
+streamed) through Django's test client, and reports the bytes on the wire,
+the share saved and the CPU time compression added per request.
+
+    python -m benchmarks.compression --lengths 10 100 1000 --output compression.json
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from . import setup_django
+from .harness import environment_info, temporary_database
+
+ENCODINGS = ('identity', 'gzip', 'br')
+
+
+def create_conversation(session_id, length):
+    from chatbot.models import Conversation, Message
+
+    conversation = Conversation.objects.create(session_id=session_id)
+    Message.objects.bulk_create(
+        Message(
+            conversation=conversation,
+            content=(
+                f"Question {i}: what does my birth chart say about my career this year?"
+                if i % 2 == 0 else
+                f"Answer {i}: Your birth chart (ஜாதகம்) shows the planets at the moment you "
+                f"were born. Book a reading to learn what it says about your career."
+            ),
+            is_user=i % 2 == 0,
+        )
+        for i in range(length)
+    )
+
+
+def fetch(client, url, params, encoding):
+    response = client.get(url, params, HTTP_ACCEPT_ENCODING=encoding)
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
+
+
+def bench_history(client, session_id, encoding, stream, repeat):
+    from django.urls import reverse
+
+    url = reverse('conversation_history')
+    params = {'session_id': session_id}
+    if stream:
+        params['stream'] = '1'
+
+    fetch(client, url, params, encoding)
+    cpu_seconds = []
+    for _ in range(repeat):
+        started = time.process_time()
+        body = fetch(client, url, params, encoding)
+        cpu_seconds.append(time.process_time() - started)
+    return len(body), min(cpu_seconds)
+
+
+def run(lengths, repeat):
+    from django.test import Client, override_settings
+
+    results = {
+        'environment': environment_info(),
+        'config': {'lengths': lengths, 'repeat': repeat},
+        'runs': [],
+    }
+    client = Client()
+    with temporary_database(), override_settings(CHAT_IP_RATE=0):
+        for length in lengths:
+            session_id = f"bench-{length}"
+            create_conversation(session_id, length)
+            for stream in (False, True):
+                identity_bytes, identity_cpu = bench_history(client, session_id, 'identity', stream, repeat)
+                for encoding in ENCODINGS:
+                    size, cpu = bench_history(client, session_id, encoding, stream, repeat)
+                    report = {
+                        'messages': length,
+                        'stream': stream,
+                        'encoding': encoding,
+                        'bytes': size,
+                        'saved_pct': round(100 * (1 - size / identity_bytes), 1),
+                        'request_cpu_ms': round(1000 * cpu, 3),
+                        'compression_cpu_ms': round(1000 * max(cpu - identity_cpu, 0.0), 3),
+                    }
+                    results['runs'].append(report)
+                    print(
+                        f"{length} messages{' (stream)' if stream else ''} {encoding}: "
+                        f"{size} bytes ({report['saved_pct']}% saved), "
+                        f"+{report['compression_cpu_ms']} ms CPU",
+                        file=sys.stderr,
+                    )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark conversation history compression.')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Messages per conversation')
+    parser.add_argument('--repeat', type=int, default=20, help='Requests per measurement (fastest is kept)')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    results = run(sorted(args.lengths), args.repeat)
+
+    report = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+FAQ and query corpora for benchmarks.
+
+The real corpus is the 181 FAQs in astrologer_faqs_complete.json. Larger
+corpora are built from it by wrapping each question in deterministic
+phrasing variants, so a given (size, seed) always yields the same FAQs.
+"""
+
+import json
+import random
+from typing import Dict, List, Optional
+
+from . import FAQ_JSON_PATH
+
+QUESTION_PREFIXES = [
+    '', 'Can you tell me', 'I want to know', 'Please explain', 'Quick question',
+    'As a new astrologer', 'As a senior astrologer', 'For Tamil consultations',
+    'Regarding my profile', 'On the mobile app',
+]
+
+QUESTION_SUFFIXES = [
+    '', 'on AstroTamil', 'for weekend sessions', 'during festival season',
+    'for video consultations', 'for chat consultations', 'in my region',
+    'after onboarding', 'for repeat customers', 'for premium members',
+]
+
+OFF_TOPIC_QUERIES = [
+    'What is the weather like today?',
+    'Tell me about pizza and cooking recipes',
+    'Who won the cricket match yesterday?',
+    'How do I reset my router?',
+    'Recommend a good movie',
+]
+
+
+def parse_keywords(raw) -> List[str]:
+    """Normalise keywords the same way scripts/import_faqs.py does."""
+    if isinstance(raw, str):
+        return [k.strip() for k in raw.split(',') if k.strip()]
+    if isinstance(raw, list):
+        return raw
+    return []
+
+
+def load_faqs(path: str = FAQ_JSON_PATH) -> List[Dict]:
+    """Load FAQ records with keywords as lists."""
+    with open(path, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    return [
+        {
+            'question': r['question'],
+            'answer': r.get('answer', ''),
+            'keywords': parse_keywords(r.get('keywords', '')),
+            'category': r.get('category', ''),
+        }
+        for r in records
+    ]
+
+
+def scale_faqs(faqs: List[Dict], size: int, seed: int = 42) -> List[Dict]:
+    """
+    Return ``size`` FAQs: the originals first, then synthetic variants.
+
+    Variants keep the original answer, keywords and category and rephrase
+    the question with a prefix/suffix pair, numbered so they stay distinct.
+    """
+    rng = random.Random(seed)
+    scaled = [dict(faq) for faq in faqs[:size]]
+    variant = 0
+    while len(scaled) < size:
+        base = faqs[variant % len(faqs)]
+        prefix = rng.choice(QUESTION_PREFIXES)
+        suffix = rng.choice(QUESTION_SUFFIXES)
+        question = base['question'].rstrip('?')
+        if prefix:
+            question = f"{prefix}, {question[0].lower()}{question[1:]}"
+        if suffix:
+            question = f"{question} {suffix}"
+        scaled.append({
+            'question': f"{question}? (v{variant // len(faqs) + 1})",
+            'answer': base['answer'],
+            'keywords': base['keywords'],
+            'category': base['category'],
+        })
+        variant += 1
+    return scaled
+
+
+def perturb_query(question: str, rng: random.Random) -> str:
+    """Drop, swap and misspell words the way real users type."""
+    words = question.rstrip('?').split()
+    kept = [w for w in words if rng.random() > 0.2] or words
+    if len(kept) > 3 and rng.random() < 0.3:
+        i = rng.randrange(len(kept) - 1)
+        kept[i], kept[i + 1] = kept[i + 1], kept[i]
+    if rng.random() < 0.3:
+        i = rng.randrange(len(kept))
+        word = kept[i]
+        if len(word) > 4:
+            j = rng.randrange(1, len(word) - 1)
+            kept[i] = word[:j] + word[j + 1:]
+    return ' '.join(kept)
+
+
+def build_queries(faqs: List[Dict], count: int, seed: int = 42,
+                  path: Optional[str] = None) -> List[str]:
+    """
+    Return ``count`` benchmark queries.
+
+    With ``path``, queries are read from a file (one per line) and cycled.
+    Otherwise the mix is roughly 30% exact questions, 60% perturbed
+    questions and 10% off-topic queries that should hand off to a human.
+    """
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = [line.strip() for line in f if line.strip()]
+        return [lines[i % len(lines)] for i in range(count)]
+
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.1:
+            queries.append(rng.choice(OFF_TOPIC_QUERIES))
+        elif roll < 0.4:
+            queries.append(rng.choice(faqs)['question'])
+        else:
+            queries.append(perturb_query(rng.choice(faqs)['question'], rng))
+    return queries
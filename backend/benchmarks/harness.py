@@ -0,0 +1,101 @@
+"""
+Shared helpers for benchmarks: a throwaway database, FAQ loading and
+latency/memory reporting.
+"""
+
+import platform
+import resource
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+from . import BACKEND_DIR
+
+
+@contextmanager
+def temporary_database(verbosity: int = 0):
+    """Create Django's test database for the duration of the block."""
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+
+
+def load_faqs_into_db(records: List[Dict], batch_size: int = 2000) -> int:
+    """Replace the FAQ table with ``records`` and return the new row count."""
+    from faq.models import FAQ
+
+    FAQ.objects.all().delete()
+    FAQ.objects.bulk_create(
+        (FAQ(**record) for record in records),
+        batch_size=batch_size,
+    )
+    return FAQ.objects.count()
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarize_latencies(latencies: List[float], elapsed: float) -> Dict:
+    """Latency percentiles in milliseconds plus throughput in requests/second."""
+    ordered = sorted(latencies)
+    return {
+        'count': len(ordered),
+        'mean_ms': round(1000 * sum(ordered) / max(len(ordered), 1), 3),
+        'p50_ms': round(1000 * percentile(ordered, 50), 3),
+        'p95_ms': round(1000 * percentile(ordered, 95), 3),
+        'p99_ms': round(1000 * percentile(ordered, 99), 3),
+        'max_ms': round(1000 * (ordered[-1] if ordered else 0), 3),
+        'throughput_rps': round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / divisor, 1)
+
+
+def current_rss_mb():
+    """Current resident set size in MB (Linux only, None elsewhere)."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return round(pages * resource.getpagesize() / (1024 * 1024), 1)
+
+
+def environment_info() -> Dict:
+    """Versions and revision needed to compare results across runs."""
+    import django
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'git_commit': commit,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
@@ -0,0 +1,139 @@
+"""
+Benchmark Message inserts with random (uuid4) versus time-ordered (uuid7)
+primary keys.
+
+Inserts the same rows into the messages table of a throwaway database
+once per id scheme, in small transactions as the chat endpoint does, and
+reports insert throughput (overall and for the last batches, when the
+primary key index is largest) and the resulting storage size. Runs on
+whatever database the settings select: SQLite by default, Postgres when
+POSTGRES_NAME is set. Django's SQLite test database lives in memory; pass
+--sqlite-file to measure an on-disk database instead.
+
+    python -m benchmarks.inserts --rows 200000 --output inserts.json
+    python -m benchmarks.inserts --sqlite-file /tmp/inserts.sqlite3
+"""
+
+import argparse
+import json
+import sys
+import time
+import uuid
+
+from . import setup_django
+from .harness import environment_info, temporary_database
+
+ID_SCHEMES = ('uuid4', 'uuid7')
+
+
+def id_factory(scheme):
+    from chatbot.ids import uuid7
+
+    return {'uuid4': uuid.uuid4, 'uuid7': uuid7}[scheme]
+
+
+def storage_size_mb(connection):
+    """Size of the messages table and its indexes (Postgres), or of the database file (SQLite)."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT pg_total_relation_size('messages')")
+            size = cursor.fetchone()[0]
+        else:
+            cursor.execute('PRAGMA page_count')
+            pages = cursor.fetchone()[0]
+            cursor.execute('PRAGMA page_size')
+            size = pages * cursor.fetchone()[0]
+    return round(size / (1024 * 1024), 2)
+
+
+def vacuum(connection):
+    """Return the space of the previous run so both schemes start from the same file."""
+    with connection.cursor() as cursor:
+        cursor.execute('VACUUM' if connection.vendor == 'sqlite' else 'VACUUM FULL messages')
+
+
+def bench_inserts(connection, scheme, rows, batch_size, tail_batches=20):
+    from django.db import transaction
+    from chatbot.models import Conversation, Message
+
+    Message.objects.all().delete()
+    Conversation.objects.all().delete()
+    vacuum(connection)
+    new_id = id_factory(scheme)
+    conversations = [Conversation.objects.create(id=new_id(), session_id=f"{scheme}-{i}") for i in range(100)]
+
+    batch_seconds = []
+    started = time.perf_counter()
+    for offset in range(0, rows, batch_size):
+        batch = [
+            Message(
+                id=new_id(),
+                conversation=conversations[n % len(conversations)],
+                content=f"Benchmark message {n}",
+                is_user=n % 2 == 0,
+            )
+            for n in range(offset, min(offset + batch_size, rows))
+        ]
+        t0 = time.perf_counter()
+        with transaction.atomic():
+            Message.objects.bulk_create(batch)
+        batch_seconds.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+
+    tail = batch_seconds[-tail_batches:]
+    tail_rows = min(rows, len(tail) * batch_size)
+    return {
+        'scheme': scheme,
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(rows / elapsed, 1),
+        'tail_rows_per_second': round(tail_rows / sum(tail), 1),
+        'storage_mb': storage_size_mb(connection),
+    }
+
+
+def run(rows, batch_size, schemes=ID_SCHEMES, sqlite_file=None):
+    from django.db import connection as default_connection
+
+    results = {
+        'environment': environment_info(),
+        'config': {'rows': rows, 'batch_size': batch_size, 'sqlite_file': sqlite_file},
+        'runs': [],
+    }
+    if sqlite_file and default_connection.vendor == 'sqlite':
+        default_connection.settings_dict['TEST']['NAME'] = sqlite_file
+    with temporary_database() as connection:
+        results['config']['database'] = connection.vendor
+        for scheme in schemes:
+            report = bench_inserts(connection, scheme, rows, batch_size)
+            results['runs'].append(report)
+            print(
+                f"{scheme}: {report['rows_per_second']} rows/s "
+                f"(last batches {report['tail_rows_per_second']} rows/s), {report['storage_mb']} MB",
+                file=sys.stderr,
+            )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Message inserts with uuid4 and uuid7 ids.')
+    parser.add_argument('--rows', type=int, default=200000, help='Messages inserted per id scheme')
+    parser.add_argument('--batch-size', type=int, default=50, help='Messages per transaction')
+    parser.add_argument('--schemes', nargs='+', choices=ID_SCHEMES, default=list(ID_SCHEMES))
+    parser.add_argument('--sqlite-file', help='Use this file as the SQLite test database')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    results = run(args.rows, args.batch_size, args.schemes, sqlite_file=args.sqlite_file)
+
+    report = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
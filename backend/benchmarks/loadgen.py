@@ -0,0 +1,336 @@
+"""
+Closed-loop HTTP load generator that behaves like the mobile app.
+
+Drives a running server (runserver, gunicorn, daphne) with --concurrency
+simulated users. Each user repeatedly opens a session the way the app
+does: it loads the conversation history, chats for a few turns with a
+think time between messages, and now and then asks for a human agent
+through /api/request-human/. A user waits for each response before its
+next request, so throughput is what the server sustains at that
+concurrency, which is what gunicorn worker counts are sized against.
+
+    python -m benchmarks.loadgen --url http://127.0.0.1:8000 --concurrency 50 --duration 120
+    python -m benchmarks.loadgen --url http://droplet:8000 --concurrency 10 50 100 --output load.json
+
+Reports, per scenario (history, chat, handoff): latency percentiles and a
+histogram, status codes, error rate and DB queries. DB query counts come
+from the Server-Timing header, so the server needs PROFILING_ENABLED=True;
+without it they are reported as null. Failed requests count towards latency
+and error rate but not DB queries. Every user comes from this one IP
+and sessions send a message every --think-time seconds on average, so run
+a server that has NUM_PROXIES set with CHAT_IP_RATE=0 (and any server with
+CHAT_SESSION_RATE=0 for think times under half a second) or the run
+measures the throttles instead of the workers.
+
+Uses only the standard library: a minimal HTTP/1.1 client on asyncio
+streams, keeping one connection per user open while the server allows it.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import ssl
+import sys
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from .harness import summarize_latencies
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'eval_queries.json')
+
+SCENARIOS = ('history', 'chat', 'handoff')
+# Statuses that are a correct answer, not an error: a new session has no history yet
+EXPECTED_STATUSES = {
+    'history': {200, 404},
+    'chat': {200},
+    'handoff': {200},
+}
+# Histogram bucket upper bounds in milliseconds; the last bucket is everything slower
+HISTOGRAM_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_DB_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+class HTTPConnection:
+    """One keep-alive HTTP/1.1 connection on asyncio streams"""
+
+    def __init__(self, url: str, timeout: float):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.host_header = parts.netloc
+        self.timeout = timeout
+        self._reader = self._writer = None
+
+    async def close(self):
+        if self._writer is not None:
+            writer, self._reader, self._writer = self._writer, None, None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, ConnectionError):
+                pass
+
+    async def request(self, method: str, path: str, body: Optional[Dict] = None) -> Tuple[int, Dict, bytes]:
+        """(status, headers, body); reconnects once if a kept-open connection went stale."""
+        reused = self._writer is not None
+        try:
+            return await asyncio.wait_for(self._request(method, path, body), self.timeout)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            await self.close()
+            if not reused:
+                raise
+            return await asyncio.wait_for(self._request(method, path, body), self.timeout)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _request(self, method, path, body):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+
+        payload = b'' if body is None else json.dumps(body).encode()
+        head = [f'{method} {path} HTTP/1.1', f'Host: {self.host_header}',
+                'Accept: application/json', f'Content-Length: {len(payload)}']
+        if body is not None:
+            head.append('Content-Type: application/json')
+        self._writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + payload)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError('server closed the connection')
+        version, status = status_line.split(None, 2)[:2]
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            content = await self._read_chunked()
+        elif 'content-length' in headers:
+            content = await self._reader.readexactly(int(headers['content-length']))
+        else:
+            content = await self._reader.read()
+            headers['connection'] = 'close'
+
+        if headers.get('connection', '').lower() == 'close' or version == b'HTTP/1.0':
+            await self.close()
+        return int(status), headers, content
+
+    async def _read_chunked(self) -> bytes:
+        chunks = []
+        while True:
+            size = int((await self._reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # Trailers end with a blank line
+                while (await self._reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(await self._reader.readexactly(size))
+            await self._reader.readexactly(2)
+
+
+class ScenarioStats:
+    """Latencies, statuses and DB queries for one scenario"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses = Counter()
+        self.errors = 0
+        self.db_queries = 0
+        self.db_reported = 0
+
+    def record(self, scenario: str, latency: float, status, headers: Optional[Dict] = None):
+        self.latencies.append(latency)
+        self.statuses[str(status)] += 1
+        if status not in EXPECTED_STATUSES[scenario]:
+            self.errors += 1
+        match = _DB_QUERIES.search((headers or {}).get('server-timing', ''))
+        if match:
+            self.db_queries += int(match.group(1))
+            self.db_reported += 1
+
+    def report(self, elapsed: float) -> Dict:
+        report = summarize_latencies(self.latencies, elapsed)
+        count = len(self.latencies)
+        histogram = Counter()
+        for latency in self.latencies:
+            ms = 1000 * latency
+            bound = next((b for b in HISTOGRAM_BOUNDS_MS if ms <= b), None)
+            histogram[f'le_{bound}ms' if bound else f'gt_{HISTOGRAM_BOUNDS_MS[-1]}ms'] += 1
+        report.update({
+            'histogram': {
+                key: histogram[key]
+                for key in [f'le_{b}ms' for b in HISTOGRAM_BOUNDS_MS] + [f'gt_{HISTOGRAM_BOUNDS_MS[-1]}ms']
+            },
+            'statuses': dict(sorted(self.statuses.items())),
+            'errors': self.errors,
+            'error_rate': round(self.errors / count, 4) if count else 0.0,
+            # Counted from responses with a Server-Timing header (none when
+            # the server does not profile, none for failed requests)
+            'db_queries': self.db_queries if self.db_reported or not count else None,
+            'db_queries_per_request': round(self.db_queries / self.db_reported, 2) if self.db_reported else None,
+        })
+        return report
+
+
+class LoadRun:
+    """Simulated users sharing one set of per-scenario stats"""
+
+    def __init__(self, url: str, queries: List[str], args):
+        self.url = url.rstrip('/')
+        self.queries = queries
+        self.args = args
+        self.stats = {scenario: ScenarioStats() for scenario in SCENARIOS}
+        self.sessions = 0
+        self.deadline = 0.0
+
+    def think(self, rng: random.Random) -> float:
+        """Exponentially distributed pause, as between a person's messages"""
+        return rng.expovariate(1 / self.args.think_time) if self.args.think_time > 0 else 0.0
+
+    async def timed(self, connection: HTTPConnection, scenario: str, method: str, path: str, body=None):
+        started = time.perf_counter()
+        try:
+            status, headers, content = await connection.request(method, path, body)
+        except asyncio.TimeoutError:
+            self.stats[scenario].record(scenario, time.perf_counter() - started, 'timeout')
+            return None
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            self.stats[scenario].record(scenario, time.perf_counter() - started, 'connection_error')
+            return None
+        self.stats[scenario].record(scenario, time.perf_counter() - started, status, headers)
+        return status
+
+    async def user(self, number: int):
+        rng = random.Random(self.args.seed * 100003 + number)
+        connection = HTTPConnection(self.url, self.args.timeout)
+        # Sessions this user has had; a returning user reopens one of them
+        past_sessions: List[str] = []
+        await asyncio.sleep(self.args.ramp_up * number / max(self.args.concurrency, 1))
+        try:
+            while time.monotonic() < self.deadline:
+                if past_sessions and rng.random() < self.args.returning:
+                    session_id = rng.choice(past_sessions)
+                else:
+                    session_id = f'load_{uuid.uuid4().hex}'
+                    past_sessions.append(session_id)
+                await self.session(connection, session_id, rng)
+                self.sessions += 1
+        finally:
+            await connection.close()
+
+    async def session(self, connection: HTTPConnection, session_id: str, rng: random.Random):
+        """History on open, a few chat turns, sometimes a handoff request"""
+        query = urlencode({'session_id': session_id, 'limit': self.args.history_limit})
+        await self.timed(connection, 'history', 'GET', f'/api/conversation-history/?{query}')
+
+        chatted = False
+        for _ in range(rng.randint(1, self.args.max_turns)):
+            await asyncio.sleep(self.think(rng))
+            if time.monotonic() >= self.deadline:
+                return
+            status = await self.timed(connection, 'chat', 'POST', '/api/chat/', {
+                'session_id': session_id,
+                'message': rng.choice(self.queries),
+                'language': 'en',
+            })
+            chatted = chatted or status == 200
+
+        if chatted and rng.random() < self.args.handoff_rate:
+            await asyncio.sleep(self.think(rng))
+            await self.timed(connection, 'handoff', 'POST', '/api/request-human/', {
+                'session_id': session_id,
+                'name': 'Load Test',
+                'phone': f'+9190000{rng.randrange(100000):05d}',
+                'problem_summary': 'Load test handoff request',
+            })
+        # Pause before the app is opened again
+        await asyncio.sleep(self.think(rng))
+
+    async def run(self) -> Dict:
+        started = time.perf_counter()
+        self.deadline = time.monotonic() + self.args.duration
+        await asyncio.gather(*(self.user(number) for number in range(self.args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+        scenarios = {scenario: stats.report(elapsed) for scenario, stats in self.stats.items()}
+        requests = sum(report['count'] for report in scenarios.values())
+        errors = sum(report['errors'] for report in scenarios.values())
+        db_totals = [report['db_queries'] for report in scenarios.values()]
+        return {
+            'concurrency': self.args.concurrency,
+            'elapsed_s': round(elapsed, 2),
+            'sessions': self.sessions,
+            'requests': requests,
+            'throughput_rps': round(requests / elapsed, 2) if elapsed else 0.0,
+            'error_rate': round(errors / requests, 4) if requests else 0.0,
+            'db_queries': None if None in db_totals else sum(db_totals),
+            'scenarios': scenarios,
+        }
+
+
+def load_queries(path: str) -> List[str]:
+    """Chat messages to send: the queries of a labeled set like eval_queries.json"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [item['query'] for item in json.load(f)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Closed-loop load test of a running server with simulated app users.')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server base URL')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10],
+                        help='Simulated users; several values run one after another')
+    parser.add_argument('--duration', type=float, default=60.0, help='Seconds per concurrency level')
+    parser.add_argument('--ramp-up', type=float, default=5.0, help='Seconds over which users start')
+    parser.add_argument('--think-time', type=float, default=2.0,
+                        help='Mean seconds between a user\'s requests (0 for none)')
+    parser.add_argument('--max-turns', type=int, default=4, help='Most chat messages per session')
+    parser.add_argument('--handoff-rate', type=float, default=0.05,
+                        help='Fraction of sessions that end with a human agent request')
+    parser.add_argument('--returning', type=float, default=0.3,
+                        help='Fraction of sessions that reopen an earlier conversation')
+    parser.add_argument('--history-limit', type=int, default=50, help='Messages requested on open')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Seconds before a request counts as failed')
+    parser.add_argument('--queries', default=DEFAULT_DATASET, help='Labeled queries JSON to draw messages from')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    queries = load_queries(args.queries)
+    results = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'concurrency')},
+        'runs': [],
+    }
+    for concurrency in args.concurrency:
+        args.concurrency = concurrency
+        report = asyncio.run(LoadRun(args.url, queries, args).run())
+        results['runs'].append(report)
+        chat = report['scenarios']['chat']
+        print(
+            f"{concurrency} users: {report['throughput_rps']} requests/s, errors {report['error_rate']}, "
+            f"chat p50/p95 {chat['p50_ms']}/{chat['p95_ms']} ms, DB queries {report['db_queries']}",
+            file=sys.stderr,
+        )
+
+    report = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark batch FAQ scoring (rapidfuzz bounds on 1 to N threads) against
+serial scoring.
+
+For each corpus size, builds the FAQ index in memory (no database rows)
+and replays the query corpus through FAQMatcher.find_top_matches, first
+serially (workers 0 in the report: per-FAQ bounds and fuzzywuzzy in
+Python) and then batch scored with 1 up to N rapidfuzz threads, reporting
+latency, throughput, FAQs fully scored per query and the speed-up over
+serial scoring. Every run must return the same matches as serial scoring,
+otherwise the run fails.
+
+    python -m benchmarks.parallel --sizes 10000 100000 --workers 1 2 4 8 --output parallel.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from . import setup_django
+from .corpus import build_queries, load_faqs, scale_faqs
+from .harness import environment_info, summarize_latencies
+
+
+def build_index(matcher, records):
+    from chatbot.ai_matcher import FAQIndex
+    from faq.models import FAQ
+
+    return FAQIndex.build(matcher, [FAQ(**record) for record in records])
+
+
+def bench_workers(matcher, index, queries, workers):
+    """Time find_top_matches for every query with ``workers`` rapidfuzz threads (0: serial)."""
+    matcher.scoring_workers = max(workers, 1)
+    # Batch scoring for any corpus, or never
+    matcher.parallel_min_faqs = 0 if workers else len(index) + 1
+    matcher.find_top_matches(queries[0], index=index)
+
+    latencies = []
+    results = []
+    scored = 0
+    started = time.perf_counter()
+    for query in queries:
+        t0 = time.perf_counter()
+        matches = matcher.find_top_matches(query, index=index)
+        latencies.append(time.perf_counter() - t0)
+        scored += matcher.last_match_stats['scored']
+        results.append([(match['faq'].question, match['score']) for match in matches])
+    elapsed = time.perf_counter() - started
+    report = summarize_latencies(latencies, elapsed)
+    report['scored_per_query'] = round(scored / len(queries), 1)
+    return report, results
+
+
+def run(sizes, worker_counts, query_count, seed=42):
+    from chatbot.ai_matcher import FAQMatcher
+
+    base_faqs = load_faqs()
+    queries = build_queries(base_faqs, query_count, seed=seed)
+    results = {
+        'environment': dict(environment_info(), cpu_count=os.cpu_count()),
+        'config': {'sizes': sizes, 'workers': worker_counts, 'queries': query_count, 'seed': seed},
+        'runs': [],
+    }
+
+    matcher = FAQMatcher(service_socket='')
+    for size in sizes:
+        index = build_index(matcher, scale_faqs(base_faqs, size, seed=seed))
+        serial_rps = serial_results = None
+        for workers in worker_counts:
+            report, matches = bench_workers(matcher, index, queries, workers)
+            if serial_results is None:
+                serial_rps, serial_results = report['throughput_rps'], matches
+            elif matches != serial_results:
+                raise SystemExit(f"{workers} workers returned different matches than serial scoring at {size} FAQs")
+            report.update({
+                'faqs': size,
+                'workers': workers,
+                'speedup': round(report['throughput_rps'] / serial_rps, 2) if serial_rps else None,
+            })
+            results['runs'].append(report)
+            print(
+                f"{size} FAQs, {workers} workers: p50 {report['p50_ms']} ms, "
+                f"{report['throughput_rps']} queries/s ({report['speedup']}x), "
+                f"{report['scored_per_query']} FAQs scored per query",
+                file=sys.stderr,
+            )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark batch FAQ scoring against serial scoring.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000],
+                        help='FAQ corpus sizes to benchmark')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}),
+                        help='rapidfuzz thread counts (serial scoring is always run first)')
+    parser.add_argument('--queries', type=int, default=50, help='Queries replayed per run')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    results = run(sorted(args.sizes), [0] + sorted(set(args.workers) - {0}), args.queries, seed=args.seed)
+
+    report = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
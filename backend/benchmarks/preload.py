@@ -0,0 +1,242 @@
+"""
+Benchmark gunicorn with and without the preloaded, frozen master
+(gunicorn.conf.py, GUNICORN_PRELOAD).
+
+Builds a throwaway SQLite database with the FAQ corpus (scaled to --faqs),
+then for each mode starts gunicorn with --workers sync workers on it and
+reports:
+
+* boot_s: from starting gunicorn to every worker accepting requests
+* first_request: latency of one /api/chat/ request per worker sent right
+  after boot, i.e. what the first user of each worker waits for
+* steady_request: latency of the requests after that
+* memory: RSS, PSS and USS (private memory) of the master and workers
+  from /proc/<pid>/smaps_rollup; total PSS is what the server really costs
+
+    python -m benchmarks.preload --workers 4 --faqs 181 10000 --output preload.json
+
+Linux only (memory comes from /proc).
+"""
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from . import BACKEND_DIR, setup_django
+from .corpus import build_queries, load_faqs, scale_faqs
+from .harness import environment_info, load_faqs_into_db, summarize_latencies
+
+MODES = (('per_worker', 'False'), ('preload', 'True'))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(path, records):
+    """Migrate a new SQLite file at ``path`` and load ``records`` into it."""
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connections
+
+    settings.DATABASES['default']['NAME'] = path
+    connections.close_all()
+    call_command('migrate', verbosity=0)
+    count = load_faqs_into_db(records)
+    connections.close_all()
+    return count
+
+
+def worker_pids(master_pid):
+    try:
+        with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+            return [int(pid) for pid in f.read().split()]
+    except OSError:
+        return []
+
+
+def memory_mb(pid):
+    """RSS, PSS and USS of a process in MB, from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            parts = rest.split()
+            if len(parts) == 2 and parts[1] == 'kB':
+                fields[name] = int(parts[0])
+    return {
+        'rss_mb': round(fields.get('Rss', 0) / 1024, 1),
+        'pss_mb': round(fields.get('Pss', 0) / 1024, 1),
+        'uss_mb': round((fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024, 1),
+    }
+
+
+def post_chat(port, message, session_id, timeout=60.0) -> float:
+    """POST one message to /api/chat/; returns the latency in seconds."""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    body = json.dumps({'session_id': session_id, 'message': message})
+    started = time.perf_counter()
+    try:
+        connection.request('POST', '/api/chat/', body, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise RuntimeError(f'/api/chat/ answered {response.status}')
+    return time.perf_counter() - started
+
+
+def concurrent_chats(port, messages, prefix):
+    """Send every message at once from its own thread; returns latencies."""
+    latencies = [None] * len(messages)
+    errors = []
+
+    def send(i):
+        try:
+            latencies[i] = post_chat(port, messages[i], f'{prefix}_{i}')
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(len(messages))]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError(f'{len(errors)} chat requests failed: {errors[0]}')
+    return latencies, time.perf_counter() - started
+
+
+def wait_for_workers(process, port, workers, timeout=120.0):
+    """Wait until gunicorn listens and has forked all workers."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {process.returncode}')
+        if len(worker_pids(process.pid)) >= workers:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                return
+            except OSError:
+                pass
+        time.sleep(0.02)
+    raise RuntimeError('gunicorn did not start in time')
+
+
+def bench_mode(env, workers, queries, rounds):
+    port = free_port()
+    command = [
+        sys.executable, '-m', 'gunicorn', 'astrotamil_api.wsgi:application',
+        '--config', os.path.join(BACKEND_DIR, 'gunicorn.conf.py'),
+        '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--log-level', 'warning',
+    ]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+    try:
+        wait_for_workers(process, port, workers)
+        boot_s = time.perf_counter() - started
+
+        first, first_elapsed = concurrent_chats(port, queries[:workers], 'first')
+        steady, steady_elapsed = [], 0.0
+        for i in range(rounds):
+            batch = queries[(i + 1) * workers:(i + 2) * workers] or queries[:workers]
+            latencies, elapsed = concurrent_chats(port, batch, f'steady{i}')
+            steady.extend(latencies)
+            steady_elapsed += elapsed
+
+        pids = worker_pids(process.pid)
+        worker_memory = [memory_mb(pid) for pid in pids]
+        master_memory = memory_mb(process.pid)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def total(key):
+        return round(master_memory[key] + sum(m[key] for m in worker_memory), 1)
+
+    def mean(key):
+        return round(sum(m[key] for m in worker_memory) / len(worker_memory), 1)
+
+    return {
+        'boot_s': round(boot_s, 3),
+        'first_request': summarize_latencies(first, first_elapsed),
+        'steady_request': summarize_latencies(steady, steady_elapsed),
+        'memory': {
+            'master': master_memory,
+            'worker_mean': {key: mean(key) for key in ('rss_mb', 'pss_mb', 'uss_mb')},
+            'total_pss_mb': total('pss_mb'),
+            'total_rss_mb': total('rss_mb'),
+        },
+    }
+
+
+def run(sizes, workers, rounds, seed=42):
+    base_faqs = load_faqs()
+    queries = build_queries(base_faqs, workers * (rounds + 1), seed=seed)
+    results = {
+        'environment': dict(environment_info(), cpu_count=os.cpu_count()),
+        'config': {'faqs': sizes, 'workers': workers, 'rounds': rounds, 'seed': seed},
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = os.path.join(directory, f'preload_{size}.sqlite3')
+            count = prepare_database(path, scale_faqs(base_faqs, size, seed=seed))
+            env = dict(
+                os.environ, SQLITE_PATH=path, DATABASE_SHARD_COUNT='0', MATCHER_SERVICE_SOCKET='',
+                DEBUG='False', SECURE_SSL_REDIRECT='False', CHAT_IP_RATE='0', CHAT_SESSION_RATE='0',
+            )
+            env.pop('POSTGRES_NAME', None)
+            for mode, preload in MODES:
+                report = bench_mode(dict(env, GUNICORN_PRELOAD=preload), workers, queries, rounds)
+                report.update({'faqs': count, 'mode': mode})
+                results['runs'].append(report)
+                print(
+                    f"{count} FAQs, {mode}: boot {report['boot_s']} s, first request p50/max "
+                    f"{report['first_request']['p50_ms']}/{report['first_request']['max_ms']} ms, "
+                    f"steady p50 {report['steady_request']['p50_ms']} ms, worker RSS/PSS/USS "
+                    f"{report['memory']['worker_mean']['rss_mb']}/{report['memory']['worker_mean']['pss_mb']}/"
+                    f"{report['memory']['worker_mean']['uss_mb']} MB, total PSS {report['memory']['total_pss_mb']} MB",
+                    file=sys.stderr,
+                )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark gunicorn with and without a preloaded master.')
+    parser.add_argument('--faqs', type=int, nargs='+', default=[181, 10000], help='FAQ corpus sizes')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn sync workers')
+    parser.add_argument('--rounds', type=int, default=5, help='Rounds of one request per worker after the first')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    results = run(sorted(args.faqs), args.workers, args.rounds, seed=args.seed)
+
+    report = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Matching-quality regression harness.
+
+Runs a matcher engine over the labeled evaluation set (paraphrases of the
+181 FAQs in astrologer_faqs_complete.json, labeled queries from the chat
+log, and off-topic queries that should hand off to a human) and reports
+top-1/top-3 accuracy, clarification and handoff rates, and latency.
+
+    python -m benchmarks.quality --output quality.json
+    python -m benchmarks.quality --engine myapp.matchers.FastMatcher --baseline quality.json
+
+With --baseline, exits non-zero if any accuracy metric drops by more than
+--tolerance, so a faster engine is only accepted if quality holds.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+
+from . import setup_django
+from .corpus import load_faqs
+from .harness import environment_info, load_faqs_into_db, summarize_latencies, temporary_database
+
+DEFAULT_ENGINE = 'chatbot.ai_matcher.FAQMatcher'
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'eval_queries.json')
+
+ANSWERED_TYPES = ('faq', 'clarification')
+
+# Metrics where higher is better; compared against --baseline
+GATED_METRICS = ('top1_accuracy', 'top3_accuracy', 'negative_handoff_rate')
+
+
+def load_dataset(path=DEFAULT_DATASET):
+    """Load labeled queries: {"query", "expected" (FAQ question or null), "source"}."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _rate(numerator, denominator):
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def evaluate(engine, dataset):
+    """Score ``engine`` on ``dataset`` and return the metrics report."""
+    has_top_matches = hasattr(engine, 'find_top_matches')
+
+    latencies = []
+    types = Counter()
+    positives = top1 = top3 = 0
+    negatives = negatives_handed_off = 0
+    by_source = defaultdict(lambda: {'queries': 0, 'top1': 0})
+    misses = []
+
+    started = time.perf_counter()
+    for item in dataset:
+        query, expected = item['query'], item.get('expected')
+
+        t0 = time.perf_counter()
+        response = engine.get_response(query)
+        latencies.append(time.perf_counter() - t0)
+
+        response_type = response.get('type', 'unknown')
+        answered = response.get('question') if response_type in ANSWERED_TYPES else None
+        types[response_type] += 1
+
+        source = by_source[item.get('source', 'unknown')]
+        source['queries'] += 1
+
+        if expected is None:
+            negatives += 1
+            correct = response_type == 'human_handoff_request'
+            negatives_handed_off += correct
+        else:
+            positives += 1
+            correct = answered == expected
+            top1 += correct
+            if has_top_matches:
+                ranked = [m['faq'].question for m in engine.find_top_matches(query, limit=3)]
+                top3 += expected in ranked
+        source['top1'] += correct
+
+        if not correct:
+            misses.append({
+                'query': query,
+                'expected': expected,
+                'answered': answered,
+                'type': response_type,
+                'confidence': response.get('confidence'),
+            })
+    elapsed = time.perf_counter() - started
+
+    total = len(dataset)
+    return {
+        'queries': total,
+        'positives': positives,
+        'negatives': negatives,
+        'top1_accuracy': _rate(top1, positives),
+        'top3_accuracy': _rate(top3, positives) if has_top_matches else None,
+        'negative_handoff_rate': _rate(negatives_handed_off, negatives),
+        'clarification_rate': _rate(types['clarification'], total),
+        'handoff_rate': _rate(types['human_handoff_request'], total),
+        'response_types': dict(types),
+        'by_source': {
+            name: dict(counts, accuracy=_rate(counts['top1'], counts['queries']))
+            for name, counts in sorted(by_source.items())
+        },
+        'latency': summarize_latencies(latencies, elapsed),
+        'misses': misses,
+    }
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    """Return human-readable regressions of ``report`` against ``baseline``."""
+    regressions = []
+    for metric in GATED_METRICS:
+        old, new = baseline.get(metric), report.get(metric)
+        if old is None or new is None:
+            continue
+        if new < old - tolerance:
+            regressions.append(f"{metric}: {old:.4f} -> {new:.4f}")
+    return regressions
+
+
+def run(engine_path=DEFAULT_ENGINE, dataset_path=DEFAULT_DATASET):
+    from django.utils.module_loading import import_string
+
+    dataset = load_dataset(dataset_path)
+    with temporary_database():
+        load_faqs_into_db(load_faqs())
+        engine = import_string(engine_path)()
+        engine.get_response(dataset[0]['query'])  # warm caches outside the timings
+        report = evaluate(engine, dataset)
+
+    report['engine'] = engine_path
+    report['dataset'] = os.path.relpath(dataset_path)
+    report['environment'] = environment_info()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate matcher quality on the labeled query set.')
+    parser.add_argument('--engine', default=DEFAULT_ENGINE, help='Dotted path of the matcher class')
+    parser.add_argument('--dataset', default=DEFAULT_DATASET, help='Labeled queries JSON file')
+    parser.add_argument('--output', help='Write the JSON report here')
+    parser.add_argument('--baseline', help='Previous report to compare accuracy against')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='Allowed drop in any accuracy metric versus the baseline')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    report = run(args.engine, args.dataset)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(report, indent=2, ensure_ascii=False, default=str) + '\n')
+
+    print(f"Engine:            {report['engine']}")
+    print(f"Queries:           {report['queries']} ({report['positives']} labeled, {report['negatives']} negative)")
+    print(f"Top-1 accuracy:    {report['top1_accuracy']}")
+    print(f"Top-3 accuracy:    {report['top3_accuracy']}")
+    print(f"Negative handoffs: {report['negative_handoff_rate']}")
+    print(f"Clarification:     {report['clarification_rate']}")
+    print(f"Handoff rate:      {report['handoff_rate']}")
+    print(f"Latency p50/p95:   {report['latency']['p50_ms']} / {report['latency']['p95_ms']} ms")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\nQuality regressions versus baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print("\nNo quality regressions versus baseline.")
+
+
+if __name__ == '__main__':
+    main()
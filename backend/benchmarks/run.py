@@ -0,0 +1,179 @@
+"""
+Benchmark FAQMatcher.get_response and the /api/chat/ view.
+
+For each corpus size, loads the FAQ corpus scaled to that size into a
+throwaway database, replays the query corpus through the matcher and
+through /api/chat/ with Django's test client, and writes a JSON report
+with latency percentiles, throughput, peak RSS and DB query counts.
+
+    python -m benchmarks.run --sizes 1000 10000 100000 --output bench.json
+
+Peak RSS is the process-wide high-water mark, so sizes run smallest first.
+"""
+
+import argparse
+import json
+import sys
+import time
+from collections import Counter
+
+from . import setup_django
+from .corpus import build_queries, load_faqs, scale_faqs
+from .harness import (
+    current_rss_mb,
+    environment_info,
+    load_faqs_into_db,
+    peak_rss_mb,
+    summarize_latencies,
+    temporary_database,
+)
+
+DEFAULT_ENGINE = 'chatbot.ai_matcher.FAQMatcher'
+
+
+def bench_matcher(engine_path, queries):
+    """Time get_response for every query on a warmed matcher."""
+    from django.utils.module_loading import import_string
+
+    matcher = import_string(engine_path)()
+
+    started = time.perf_counter()
+    matcher.get_response(queries[0])
+    warmup_ms = round(1000 * (time.perf_counter() - started), 3)
+
+    latencies = []
+    response_types = Counter()
+    scored = 0
+    started = time.perf_counter()
+    for query in queries:
+        t0 = time.perf_counter()
+        response = matcher.get_response(query)
+        latencies.append(time.perf_counter() - t0)
+        response_types[response.get('type', 'unknown')] += 1
+        scored += getattr(matcher, 'last_match_stats', {}).get('scored', 0)
+    elapsed = time.perf_counter() - started
+
+    report = summarize_latencies(latencies, elapsed)
+    report.update({
+        'engine': engine_path,
+        'warmup_ms': warmup_ms,
+        'full_scorings_per_query': round(scored / len(queries), 2),
+        'response_types': dict(response_types),
+    })
+    return report
+
+
+def bench_chat_view(queries, messages_per_session):
+    """POST every query to /api/chat/, grouping them into multi-turn sessions."""
+    from django.db import connection
+    from django.test import Client, override_settings
+    from django.test.utils import CaptureQueriesContext
+    from django.urls import reverse
+
+    client = Client()
+    url = reverse('chat')
+    latencies = []
+    query_counts = []
+    statuses = Counter()
+
+    # One client replaying the corpus would be rate limited per IP and session
+    with override_settings(CHAT_SESSION_RATE=0, CHAT_IP_RATE=0):
+        started = time.perf_counter()
+        for i, query in enumerate(queries):
+            payload = {
+                'session_id': f"bench-{i // messages_per_session}",
+                'message': query,
+                'language': 'en',
+            }
+            with CaptureQueriesContext(connection) as ctx:
+                t0 = time.perf_counter()
+                response = client.post(url, payload, content_type='application/json')
+                latencies.append(time.perf_counter() - t0)
+            query_counts.append(len(ctx.captured_queries))
+            statuses[response.status_code] += 1
+        elapsed = time.perf_counter() - started
+
+    report = summarize_latencies(latencies, elapsed)
+    report.update({
+        'status_codes': {str(code): n for code, n in statuses.items()},
+        'db_queries_total': sum(query_counts),
+        'db_queries_per_request': round(sum(query_counts) / len(query_counts), 2),
+        'db_queries_max': max(query_counts),
+    })
+    return report
+
+
+def run(sizes, query_count, seed=42, queries_path=None, engine=DEFAULT_ENGINE,
+        messages_per_session=10, skip_view=False):
+    base_faqs = load_faqs()
+    queries = build_queries(base_faqs, query_count, seed=seed, path=queries_path)
+    results = {
+        'environment': environment_info(),
+        'config': {
+            'sizes': sizes,
+            'queries': query_count,
+            'seed': seed,
+            'queries_path': queries_path,
+            'engine': engine,
+            'messages_per_session': messages_per_session,
+        },
+        'runs': [],
+    }
+
+    with temporary_database():
+        for size in sizes:
+            started = time.perf_counter()
+            loaded = load_faqs_into_db(scale_faqs(base_faqs, size, seed=seed))
+            run_report = {
+                'faqs': loaded,
+                'load_seconds': round(time.perf_counter() - started, 2),
+                'matcher': bench_matcher(engine, queries),
+            }
+            if not skip_view:
+                run_report['chat_view'] = bench_chat_view(queries, messages_per_session)
+            run_report['rss_mb'] = current_rss_mb()
+            run_report['peak_rss_mb'] = peak_rss_mb()
+            results['runs'].append(run_report)
+            print(
+                f"{loaded} FAQs: matcher p50 {run_report['matcher']['p50_ms']} ms, "
+                f"p95 {run_report['matcher']['p95_ms']} ms",
+                file=sys.stderr,
+            )
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the FAQ matcher and chat endpoint.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='FAQ corpus sizes to benchmark')
+    parser.add_argument('--queries', type=int, default=200, help='Queries replayed per size')
+    parser.add_argument('--queries-file', help='Replay queries from this file (one per line)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--engine', default=DEFAULT_ENGINE, help='Dotted path of the matcher class')
+    parser.add_argument('--messages-per-session', type=int, default=10)
+    parser.add_argument('--skip-view', action='store_true', help='Only benchmark the matcher')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    results = run(
+        sorted(args.sizes),
+        args.queries,
+        seed=args.seed,
+        queries_path=args.queries_file,
+        engine=args.engine,
+        messages_per_session=args.messages_per_session,
+        skip_view=args.skip_view,
+    )
+
+    report = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark the Tanglish/Tamil-script normalization stage.
+
+Runs the matcher over the labeled Tanglish and Tamil-script queries in
+benchmarks/tanglish_queries.json with transliteration off and on, and
+reports top-1 accuracy, handoff rate and latency for both. Also times
+transliterate() on its own, uncached and cached, over these queries and
+the English evaluation set, which it must leave unchanged.
+
+    python -m benchmarks.transliteration --output transliteration.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from . import setup_django
+from .corpus import load_faqs
+from .harness import environment_info, load_faqs_into_db, temporary_database
+from .quality import DEFAULT_DATASET, evaluate, load_dataset
+
+DEFAULT_TANGLISH_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tanglish_queries.json')
+
+
+def time_transliterate(queries, repeat):
+    """Microseconds per query for transliterate(), without and with its cache."""
+    from chatbot.transliteration import transliterate
+
+    uncached = cached = float('inf')
+    for _ in range(repeat):
+        transliterate.cache_clear()
+        started = time.perf_counter()
+        for query in queries:
+            transliterate(query)
+        uncached = min(uncached, time.perf_counter() - started)
+        started = time.perf_counter()
+        for query in queries:
+            transliterate(query)
+        cached = min(cached, time.perf_counter() - started)
+    return {
+        'uncached_us': round(1e6 * uncached / len(queries), 2),
+        'cached_us': round(1e6 * cached / len(queries), 2),
+    }
+
+
+def run(dataset_path=DEFAULT_TANGLISH_DATASET, repeat=20):
+    from chatbot.ai_matcher import FAQMatcher
+
+    dataset = load_dataset(dataset_path)
+    english = [item['query'] for item in load_dataset(DEFAULT_DATASET)]
+    results = {
+        'environment': environment_info(),
+        'config': {'dataset': os.path.relpath(dataset_path), 'repeat': repeat},
+        'runs': [],
+    }
+    with temporary_database():
+        load_faqs_into_db(load_faqs())
+        for enabled in (False, True):
+            engine = FAQMatcher(service_socket='')
+            engine.use_transliteration = enabled
+            engine.get_response(dataset[0]['query'])
+            report = evaluate(engine, dataset)
+            report['transliteration'] = enabled
+            results['runs'].append(report)
+            print(
+                f"transliteration {'on' if enabled else 'off'}: top-1 {report['top1_accuracy']}, "
+                f"handoffs {report['handoff_rate']}, p50 {report['latency']['p50_ms']} ms",
+                file=sys.stderr,
+            )
+
+    results['overhead'] = {
+        'tanglish': time_transliterate([item['query'] for item in dataset], repeat),
+        'english': time_transliterate(english, repeat),
+    }
+    from chatbot.transliteration import transliterate
+    results['english_changed'] = [q for q in english if transliterate(q) != q.lower()]
+    print(f"transliterate() overhead: {results['overhead']}", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Tanglish/Tamil-script normalization.')
+    parser.add_argument('--dataset', default=DEFAULT_TANGLISH_DATASET, help='Labeled queries JSON file')
+    parser.add_argument('--repeat', type=int, default=20, help='Timing passes (fastest is kept)')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    results = run(args.dataset, args.repeat)
+
+    report = json.dumps(results, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
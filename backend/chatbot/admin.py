@@ -3,11 +3,15 @@ Django admin configuration for chatbot models.
 """
 
 from django.contrib import admin
-from .models import Conversation, Message, HumanHandoffRequest
+
+from astrotamil_api.routers import ReplicaChangeListMixin
+from astrotamil_api.sharding import ShardedAdminMixin
+
+from .models import Conversation, Message, HumanHandoffRequest, ResponseRollup, FAQRollup
 
 
 @admin.register(Conversation)
-class ConversationAdmin(admin.ModelAdmin):
+class ConversationAdmin(ShardedAdminMixin, ReplicaChangeListMixin, admin.ModelAdmin):
     """Admin interface for Conversation model."""
     
     list_display = ('session_id_short', 'language', 'message_count', 'created_at', 'last_active', 'duration')
@@ -65,19 +69,23 @@ class ConversationAdmin(admin.ModelAdmin):
 
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
+class MessageAdmin(ShardedAdminMixin, ReplicaChangeListMixin, admin.ModelAdmin):
     """Admin interface for Message model."""
     
-    list_display = ('id_short', 'conversation_session', 'sender_type', 'content_preview', 'timestamp')
-    list_filter = ('is_user', 'timestamp', 'conversation__language')
+    list_display = ('id_short', 'conversation_session', 'sender_type', 'content_preview', 'response_type', 'confidence', 'timestamp')
+    list_filter = ('is_user', 'response_type', 'timestamp', 'conversation__language')
     search_fields = ('content', 'conversation__session_id')
-    readonly_fields = ('id', 'conversation', 'content', 'is_user', 'timestamp')
+    readonly_fields = ('id', 'conversation', 'content', 'is_user', 'matched_faq', 'response_type', 'confidence', 'timestamp')
+    list_select_related = ('conversation',)
     date_hierarchy = 'timestamp'
     
     fieldsets = (
         ('Message Info', {
             'fields': ('id', 'conversation', 'content', 'is_user')
         }),
+        ('Match', {
+            'fields': ('response_type', 'matched_faq', 'confidence')
+        }),
         ('Metadata', {
             'fields': ('timestamp',),
             'classes': ('collapse',)
@@ -121,7 +129,7 @@ class MessageAdmin(admin.ModelAdmin):
 
 
 @admin.register(HumanHandoffRequest)
-class HumanHandoffRequestAdmin(admin.ModelAdmin):
+class HumanHandoffRequestAdmin(ShardedAdminMixin, ReplicaChangeListMixin, admin.ModelAdmin):
     """Admin interface for HumanHandoffRequest model."""
     
     list_display = ('ticket_number', 'name', 'phone', 'status', 'created_at', 'session_id')
@@ -169,3 +177,47 @@ class HumanHandoffRequestAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         """Prevent manual creation via admin (use API instead)."""
         return False
+
+
+class ReadOnlyRollupAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
+    """Rollups are maintained by the chat views (see chatbot/analytics.py)."""
+    
+    list_filter = ('period', 'period_start')
+    date_hierarchy = 'period_start'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+
+@admin.register(ResponseRollup)
+class ResponseRollupAdmin(ReadOnlyRollupAdmin):
+    """Admin interface for hourly/daily response counts."""
+    
+    list_display = ('period_start', 'period', 'total', 'faq', 'clarification', 'human_handoff_request',
+                    'collect_human_details', 'other', 'unmatched')
+    
+    def unmatched(self, obj):
+        """Display the share of responses without a matching FAQ."""
+        return f"{100 * obj.unmatched_rate:.1f}%"
+    unmatched.short_description = 'Unmatched'
+
+
+@admin.register(FAQRollup)
+class FAQRollupAdmin(ReadOnlyRollupAdmin):
+    """Admin interface for hourly/daily matched-FAQ counts."""
+    
+    list_display = ('period_start', 'period', 'faq_question', 'category', 'count')
+    list_filter = ('period', 'category', 'period_start')
+    list_select_related = ('faq',)
+    search_fields = ('faq__question', 'category')
+    
+    def faq_question(self, obj):
+        """Display the matched FAQ question."""
+        return obj.faq.question[:80] if obj.faq else '(deleted FAQ)'
+    faq_question.short_description = 'FAQ'
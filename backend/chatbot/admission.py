@@ -0,0 +1,199 @@
+"""
+Admission control for the chat endpoints.
+
+Fuzzy matching is CPU-bound, so under bursty load requests pile up until
+gunicorn times them out. Two layers keep the endpoint responsive:
+
+* Token buckets per session and per client IP (SessionRateThrottle and
+  IPRateThrottle, DRF throttles) answer 429 with Retry-After once a
+  client exceeds CHAT_SESSION_RATE / CHAT_IP_RATE requests per second
+  beyond its burst allowance.
+* A per-process concurrency limiter admits CHAT_MAX_CONCURRENT chat turns
+  at a time and lets up to CHAT_MAX_QUEUE more wait CHAT_QUEUE_TIMEOUT
+  seconds for a slot. Requests that are not admitted are served in
+  degraded mode (exact FAQ question matches only) or get a fast 503 with
+  Retry-After.
+
+The limiter matters for threaded workers (gunicorn --threads, runserver);
+a sync worker already handles one request at a time.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import registry
+
+IN_FLIGHT = registry.gauge(
+    'chat_admission_in_flight',
+    'Chat turns currently being processed.',
+)
+QUEUE_DEPTH = registry.gauge(
+    'chat_admission_queue_depth',
+    'Chat turns waiting for a processing slot.',
+)
+SHED = registry.counter(
+    'chat_requests_shed_total',
+    'Chat requests rejected or degraded, by reason.',
+    ['reason'],
+)
+
+
+class ConcurrencyLimiter:
+    """Counting semaphore with a bounded, time-limited wait queue"""
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> Optional[str]:
+        """Take a slot; returns None once admitted, else why not ('queue_full' or 'queue_timeout')."""
+        with self._cond:
+            if self.active >= self.max_concurrent:
+                if self.waiting >= self.max_queue:
+                    return 'queue_full'
+                self.waiting += 1
+                QUEUE_DEPTH.set(value=self.waiting)
+                try:
+                    deadline = time.monotonic() + self.queue_timeout
+                    while self.active >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return 'queue_timeout'
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                    QUEUE_DEPTH.set(value=self.waiting)
+            self.active += 1
+            IN_FLIGHT.set(value=self.active)
+            return None
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            IN_FLIGHT.set(value=self.active)
+            self._cond.notify()
+
+
+class TokenBucketLimiter:
+    """Token bucket per key (``rate`` tokens/second, up to ``burst``), LRU-bounded"""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """Spend a token for ``key``; returns 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _get_limiter(name, factory):
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                limiter = _limiters[name] = factory()
+    return limiter
+
+
+@receiver(setting_changed)
+def _reset_limiters(setting, **kwargs):
+    if setting.startswith('CHAT_'):
+        _limiters.clear()
+
+
+def get_concurrency_limiter() -> ConcurrencyLimiter:
+    return _get_limiter('concurrency', lambda: ConcurrencyLimiter(
+        getattr(settings, 'CHAT_MAX_CONCURRENT', 4),
+        getattr(settings, 'CHAT_MAX_QUEUE', 16),
+        getattr(settings, 'CHAT_QUEUE_TIMEOUT', 2.0),
+    ))
+
+
+def retry_after_seconds() -> int:
+    """Retry-After for 503 responses while the chat endpoint is saturated"""
+    return max(1, math.ceil(getattr(settings, 'CHAT_QUEUE_TIMEOUT', 2.0)))
+
+
+def take_token(scope: str, key: Optional[str], rate_setting: str, burst_setting: str) -> float:
+    """
+    Spend a token from ``key``'s bucket in ``scope``; returns 0 if allowed,
+    else seconds until one is available. A rate of 0 (or no key) disables it.
+    """
+    rate = getattr(settings, rate_setting, 0)
+    if not rate or not key:
+        return 0.0
+    buckets = _get_limiter(scope, lambda: TokenBucketLimiter(rate, getattr(settings, burst_setting, 1)))
+    wait = buckets.take(key)
+    if wait:
+        SHED.inc(f"{scope}_rate")
+    return wait
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """DRF throttle backed by an in-process TokenBucketLimiter; a rate of 0 disables it."""
+
+    scope = ''
+    rate_setting = ''
+    burst_setting = ''
+
+    def get_key(self, request) -> Optional[str]:
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        self._wait = take_token(self.scope, self.get_key(request), self.rate_setting, self.burst_setting)
+        return not self._wait
+
+    def wait(self):
+        return self._wait
+
+
+class SessionRateThrottle(TokenBucketThrottle):
+    scope = 'session'
+    rate_setting = 'CHAT_SESSION_RATE'
+    burst_setting = 'CHAT_SESSION_BURST'
+
+    def get_key(self, request):
+        data = request.data
+        session_id = data.get('session_id') if hasattr(data, 'get') else None
+        return session_id if isinstance(session_id, str) else None
+
+
+class IPRateThrottle(TokenBucketThrottle):
+    scope = 'ip'
+    rate_setting = 'CHAT_IP_RATE'
+    burst_setting = 'CHAT_IP_BURST'
+
+    def get_key(self, request):
+        return self.get_ident(request)
@@ -1,9 +1,21 @@
 import re
+import threading
 import nltk
+import numpy as np
+from django.conf import settings
 from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
-from fuzzywuzzy import fuzz
-from typing import Dict, Optional, List
+from fuzzywuzzy import fuzz, utils as fuzz_utils
+from rapidfuzz import fuzz as rapid_fuzz, process as rapid_process
+from typing import Dict, Optional, List, Tuple
+
+from astrotamil_api.routers import use_replica
+
+from .matcher_service import MatcherServiceUnavailable, remote_exact_response, remote_responses
+from .metrics import CACHE_LOOKUPS, stage_timer
+from .renderers import faq_json_texts
+from .spelling import SpellingIndex
+from .transliteration import transliterate
 
 # Download NLTK data if missing at runtime (Django startup or first call will handle it)
 try:
@@ -15,11 +27,131 @@ except LookupError:
     nltk.download('punkt_tab')
     nltk.download('stopwords')
 
+# Words that earn the 1.1 score boost when they appear in the query
+IMPORTANT_WORDS = ['how', 'what', 'when', 'where', 'why', 'can', 'do', 'is', 'are']
+
+# fuzzywuzzy rounds every ratio to a whole percent, so a real score can
+# exceed the exact ratio it approximates by at most half a point.
+RATIO_ROUNDING_SLACK = 0.005
+
+# Batch scoring fully scores this many FAQs per requested match up front,
+# the best by token_sort_ratio, to find the score the rest must beat
+BATCH_SEEDS_PER_MATCH = 3
+
+
+def _joined_length(tokens) -> int:
+    """Length of the tokens joined by single spaces."""
+    if not tokens:
+        return 0
+    return sum(map(len, tokens)) + len(tokens) - 1
+
+
+def _length_ratio_bound(len1: int, len2: int) -> float:
+    """Upper bound on Levenshtein ratio() for strings of the given lengths."""
+    if len1 == len2:
+        return 1.0
+    return 2 * min(len1, len2) / (len1 + len2)
+
+
+class TokenProfile:
+    """Token statistics of a cleaned text, as seen by fuzzywuzzy's token scorers"""
+
+    __slots__ = ('processed', 'token_set', 'sort_length', 'set_length')
+
+    def __init__(self, text: str):
+        # The string fuzzywuzzy's token scorers actually compare
+        self.processed = fuzz_utils.full_process(text, force_ascii=True)
+        tokens = self.processed.split()
+        self.token_set = frozenset(tokens)
+        self.sort_length = _joined_length(tokens)
+        self.set_length = _joined_length(self.token_set)
+
+
+class FAQIndexEntry:
+    """Per-FAQ matching data computed once instead of on every query"""
+
+    __slots__ = ('faq', 'text', 'profile', 'keywords')
+
+    def __init__(self, faq, text: str):
+        self.faq = faq
+        self.text = text
+        self.profile = TokenProfile(text)
+        self.keywords = faq.keywords
+
+
+class FAQIndex:
+    """Preprocessed FAQ corpus, cached per process until the FAQ table changes"""
+
+    def __init__(self, entries: List[FAQIndexEntry], version: Optional[Tuple] = None,
+                 spelling: Optional[SpellingIndex] = None):
+        self.entries = entries
+        self.version = version
+        self.spelling = spelling if spelling is not None else SpellingIndex()
+        # Preprocessed question -> first FAQ with it, for exact-match lookups
+        self.exact: Dict[str, FAQIndexEntry] = {}
+        for entry in entries:
+            self.exact.setdefault(entry.text, entry)
+        # Column views of the entries for rapidfuzz's batch scoring
+        self.texts = [entry.text for entry in entries]
+        self.processed_texts = [entry.profile.processed for entry in entries]
+        self.sorted_texts = [' '.join(sorted(text.split())) for text in self.processed_texts]
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def current_version() -> Tuple:
+        """Cheap fingerprint of the FAQ table (row count and latest edit)"""
+        from django.db.models import Count, Max
+        from faq.models import FAQ
+
+        stats = FAQ.objects.aggregate(count=Count('id'), updated=Max('updated_at'))
+        return stats['count'], stats['updated']
+
+    @classmethod
+    def build(cls, matcher: 'FAQMatcher', faqs, version: Optional[Tuple] = None,
+              previous: Optional['FAQIndex'] = None) -> 'FAQIndex':
+        """Index ``faqs``; the spelling index is updated from ``previous`` when given"""
+        entries = [FAQIndexEntry(faq, matcher.preprocess_text(faq.question)) for faq in faqs]
+        
+        # Spelling vocabulary: the words of every question and keyword;
+        # answer words are known to be spelled right but are not targets
+        words, known_words = [], set(matcher.stop_words)
+        for entry in entries:
+            words.extend(entry.text.split())
+            for keyword in entry.keywords or ():
+                if isinstance(keyword, str):
+                    words.extend(matcher.preprocess_text(keyword).split())
+            known_words.update(matcher.preprocess_text(entry.faq.answer).split())
+        if previous is not None:
+            spelling = previous.spelling.updated(words, known_words)
+        else:
+            spelling = SpellingIndex.build(words, known_words)
+        return cls(entries, version, spelling)
+
+
+_faq_indexes: Dict[type, FAQIndex] = {}
+_faq_index_lock = threading.Lock()
+
 class FAQMatcher:
-    def __init__(self):
+    def __init__(self, service_socket: Optional[str] = None):
         self.stop_words = set(stopwords.words('english'))
         self.min_similarity_threshold = 0.7  # 70% fuzzy matching threshold
         self.keyword_weight = 0.3
+        # Skip the fuzzy ratios for FAQs whose score bound cannot win
+        self.use_upper_bounds = True
+        # Correct misspelled query words to FAQ vocabulary before matching
+        self.use_spelling_correction = True
+        # Rewrite Tanglish and Tamil-script words into FAQ vocabulary
+        self.use_transliteration = True
+        self.last_match_stats = {'candidates': 0, 'scored': 0, 'pruned': 0}
+        # Unix socket of `manage.py matcher_service` to match in; '' matches in-process
+        if service_socket is None:
+            service_socket = getattr(settings, 'MATCHER_SERVICE_SOCKET', '')
+        self.service_socket = service_socket
+        # Large corpora are bounded in batch by rapidfuzz on this many threads
+        self.scoring_workers = getattr(settings, 'MATCHER_SCORING_WORKERS', 1)
+        self.parallel_min_faqs = getattr(settings, 'MATCHER_PARALLEL_MIN_FAQS', 100)
         
     def preprocess_text(self, text: str) -> str:
         """Clean and normalize text"""
@@ -37,6 +169,18 @@ class FAQMatcher:
         
         return text
     
+    def normalize_query(self, user_query: str, index: FAQIndex) -> str:
+        """Preprocessed query in FAQ vocabulary: transliterated, then spell-corrected"""
+        if self.use_transliteration:
+            user_query = transliterate(user_query)
+        return self.correct_spelling(self.preprocess_text(user_query), index)
+    
+    def correct_spelling(self, text: str, index: FAQIndex) -> str:
+        """Preprocessed text with misspelled words replaced by FAQ vocabulary"""
+        if not self.use_spelling_correction:
+            return text
+        return index.spelling.correct(text)
+    
     def extract_keywords(self, text: str) -> List[str]:
         """Extract keywords from text"""
         text = self.preprocess_text(text)
@@ -56,6 +200,10 @@ class FAQMatcher:
         text1_clean = self.preprocess_text(text1)
         text2_clean = self.preprocess_text(text2)
         
+        return self._similarity_clean(text1_clean, text2_clean)
+    
+    def _similarity_clean(self, text1_clean: str, text2_clean: str) -> float:
+        """calculate_similarity() for texts that are already preprocessed"""
         if not text1_clean or not text2_clean:
             return 0.0
         
@@ -77,8 +225,10 @@ class FAQMatcher:
     
     def keyword_match_score(self, user_text: str, faq_keywords: List[str]) -> float:
         """Calculate keyword match score"""
-        user_keywords = self.extract_keywords(user_text)
-        
+        return self._keyword_overlap(self.extract_keywords(user_text), faq_keywords)
+    
+    def _keyword_overlap(self, user_keywords: List[str], faq_keywords: List[str]) -> float:
+        """keyword_match_score() for keywords already extracted from the query"""
         if not user_keywords or not faq_keywords:
             return 0.0
         
@@ -91,64 +241,311 @@ class FAQMatcher:
         
         return matches / len(user_keywords) if user_keywords else 0.0
     
+    def get_faq_index(self) -> FAQIndex:
+        """Return the preprocessed FAQ corpus, rebuilding it if FAQs changed"""
+        from faq.models import FAQ
+        
+        # FAQ edits are rare, so the index may load from a lagging replica
+        with use_replica():
+            version = FAQIndex.current_version()
+            index = _faq_indexes.get(type(self))
+            if index is not None and index.version == version:
+                CACHE_LOOKUPS.inc('faq_index', 'hit')
+                return index
+            
+            CACHE_LOOKUPS.inc('faq_index', 'miss')
+            with _faq_index_lock:
+                index = _faq_indexes.get(type(self))
+                if index is None or index.version != version:
+                    index = FAQIndex.build(self, FAQ.objects.all(), version, previous=index)
+                    _faq_indexes[type(self)] = index
+        return index
+    
+    def text_similarity_bound(self, query: TokenProfile, entry: FAQIndexEntry) -> float:
+        """
+        Upper bound on calculate_similarity() between the query and an FAQ.
+        
+        With python-Levenshtein, ratio() is 2*LCS/(len1+len2), so it can never
+        exceed 2*min(len1, len2)/(len1+len2). token_sort_ratio is bounded by the
+        lengths of the sorted token strings, and token_set_ratio by the shared
+        tokens: two of its three candidates compare the sorted intersection with
+        a string it prefixes, which has an exact closed form. partial_ratio has
+        no cheap bound and is taken as 1.
+        """
+        profile = entry.profile
+        if not query.token_set or not profile.token_set:
+            token_set_bound = 0.0
+        else:
+            shared = query.token_set & profile.token_set
+            set_bound = _length_ratio_bound(query.set_length, profile.set_length)
+            if shared:
+                shared_length = _joined_length(shared)
+                set_bound = max(
+                    set_bound,
+                    _length_ratio_bound(shared_length, query.set_length),
+                    _length_ratio_bound(shared_length, profile.set_length),
+                )
+            token_set_bound = set_bound
+        
+        if query.sort_length == 0 and profile.sort_length == 0:
+            token_sort_bound = 1.0
+        elif query.sort_length == 0 or profile.sort_length == 0:
+            token_sort_bound = 0.0
+        else:
+            token_sort_bound = _length_ratio_bound(query.sort_length, profile.sort_length)
+        
+        return ((token_sort_bound + RATIO_ROUNDING_SLACK) * 0.4 +
+                1.0 * 0.3 +
+                (token_set_bound + RATIO_ROUNDING_SLACK) * 0.3)
+    
     def find_best_match(self, user_query: str) -> Optional[Dict]:
         """Find the best matching FAQ for user query"""
-        from faq.models import FAQ
+        matches = self.find_top_matches(user_query, limit=1,
+                                        min_score=self.min_similarity_threshold)
+        return matches[0] if matches else None
+    
+    def find_top_matches(self, user_query: str, limit: int = 3,
+                         min_score: float = 0.0, index: Optional[FAQIndex] = None) -> List[Dict]:
+        """Find the ``limit`` best scoring FAQs (scoring at least ``min_score``), best first"""
+        if index is None:
+            with stage_timer('candidate_retrieval'):
+                index = self.get_faq_index()
+        
+        # Query-side work is the same for every FAQ, so do it once
+        with stage_timer('preprocess'):
+            user_query_clean = self.normalize_query(user_query, index)
+            query_text = self.preprocess_text(user_query_clean)
+            query_profile = TokenProfile(query_text)
+            user_keywords = self.extract_keywords(user_query_clean)
+            boosted = any(word in user_query_clean for word in IMPORTANT_WORDS)
+        
+        with stage_timer('fuzzy_scoring'):
+            if self.use_upper_bounds and query_text and len(index) >= self.parallel_min_faqs:
+                top_matches, scored = self._score_batch(
+                    index, query_text, query_profile, user_keywords,
+                    boosted, limit, min_score
+                )
+            else:
+                top_matches, scored = self._score_entries(
+                    index.entries, query_text, query_profile, user_keywords,
+                    boosted, limit, min_score
+                )
+        
+        self.last_match_stats = {
+            'candidates': len(index),
+            'scored': scored,
+            'pruned': len(index) - scored,
+        }
+        return top_matches
+    
+    def _score_batch(self, index, query_text, query_profile, user_keywords,
+                     boosted, limit, min_score):
+        """
+        _score_entries() over the whole index, with text bounds computed in
+        batch by rapidfuzz, which scores in C++ on ``scoring_workers`` threads
+        without holding the GIL.
+        
+        rapidfuzz's ratio and token_set_ratio equal fuzzywuzzy's before
+        rounding, and its partial_ratio searches every alignment where
+        fuzzywuzzy tries a few, so none is more than half a point below
+        fuzzywuzzy's. token_sort_ratio (a ratio of the pre-sorted token
+        strings) is computed for every FAQ; the best few by it are scored in
+        full to get a score floor, then the costlier token_set_ratio and
+        partial_ratio only for FAQs that the bounds so far leave within reach
+        of it. Only FAQs whose bound still reaches the floor are scored with
+        fuzzywuzzy, so scores and ranks are exactly those of serial scoring.
+        """
+        def ratios(scorer, query, choices):
+            return rapid_process.cdist([query], choices, scorer=scorer, dtype=np.float64,
+                                       workers=self.scoring_workers)[0]
+        
+        def score(positions, text_bounds=None):
+            return self._score_entries(
+                [index.entries[i] for i in positions], query_text, query_profile, user_keywords,
+                boosted, limit, min_score, text_bounds=text_bounds
+            )
+        
+        def reachable(text_bounds):
+            return (text_bounds * (1 - self.keyword_weight) + self.keyword_weight) * (1.1 if boosted else 1.0)
+        
+        slack = 100 * RATIO_ROUNDING_SLACK
+        query_sorted = ' '.join(sorted(query_profile.processed.split()))
+        if query_sorted:
+            token_sort = ratios(rapid_fuzz.ratio, query_sorted, index.sorted_texts)
+        else:
+            # fuzzywuzzy scores an empty token string 0 against anything
+            token_sort = np.zeros(len(index))
+        sort_bounds = np.minimum(token_sort + slack, 100) * 0.4 / 100
+        
+        seed_count = BATCH_SEEDS_PER_MATCH * limit
+        if seed_count < len(index):
+            seeds = np.sort(np.argpartition(-token_sort, seed_count)[:seed_count])
+        else:
+            seeds = np.arange(len(index))
+        seed_matches, seed_scored = score(seeds)
+        floor = min_score
+        if len(seed_matches) == limit:
+            floor = max(floor, seed_matches[-1]['score'])
         
-        user_query_clean = self.preprocess_text(user_query)
+        # Narrow the candidates with each bound in turn, the costliest last;
+        # token_set_ratio and partial_ratio are at most 100 each
+        candidates = np.flatnonzero(reachable(sort_bounds + 0.6) >= floor)
+        if query_sorted:
+            token_set = ratios(rapid_fuzz.token_set_ratio, query_profile.processed,
+                               [index.processed_texts[i] for i in candidates])
+        else:
+            token_set = np.zeros(len(candidates))
+        text_bounds = sort_bounds[candidates] + np.minimum(token_set + slack, 100) * 0.3 / 100
+        keep = reachable(text_bounds + 0.3) >= floor
+        candidates, text_bounds = candidates[keep], text_bounds[keep]
         
-        # Get all FAQs
-        all_faqs = FAQ.objects.all()
+        partial = ratios(rapid_fuzz.partial_ratio, query_text, [index.texts[i] for i in candidates])
+        text_bounds = text_bounds + np.minimum(partial + slack, 100) * 0.3 / 100
         
-        best_match = None
-        highest_score = 0
+        keep = reachable(text_bounds) >= floor
+        top_matches, scored = score(candidates[keep], text_bounds[keep].tolist())
+        return top_matches, seed_scored + scored
+    
+    def _score_entries(self, entries, query_text, query_profile, user_keywords,
+                       boosted, limit, min_score, text_bounds=None):
+        """
+        Score FAQ index entries against a preprocessed query; returns (top
+        matches, full scorings). ``text_bounds``, if given, are upper bounds on
+        each entry's text similarity to use instead of text_similarity_bound().
+        """
+        boost = 1.1 if boosted else 1.0
+        text_weight = 1 - self.keyword_weight
+        top_matches = []
+        scored = 0
         
-        for faq in all_faqs:
+        for position, entry in enumerate(entries):
+            keyword_score = None
+            if self.use_upper_bounds and query_text:
+                # A score only counts if it reaches min_score and beats the
+                # current top matches, so skip FAQs whose bound cannot.
+                floor = min_score
+                if len(top_matches) == limit:
+                    floor = max(floor, top_matches[-1]['score'])
+                if text_bounds is not None:
+                    text_bound = text_bounds[position]
+                else:
+                    text_bound = self.text_similarity_bound(query_profile, entry)
+                if (text_bound * text_weight + self.keyword_weight) * boost < floor:
+                    continue
+                keyword_score = self._keyword_overlap(user_keywords, entry.keywords)
+                if (text_bound * text_weight + keyword_score * self.keyword_weight) * boost < floor:
+                    continue
+            
             # Calculate text similarity
-            text_similarity = self.calculate_similarity(user_query_clean, faq.question)
+            scored += 1
+            text_similarity = self._similarity_clean(query_text, entry.text)
             
             # Calculate keyword match
-            keyword_score = self.keyword_match_score(user_query_clean, faq.keywords)
+            if keyword_score is None:
+                keyword_score = self._keyword_overlap(user_keywords, entry.keywords)
             
             # Combined score with weights
             combined_score = (text_similarity * (1 - self.keyword_weight) + 
                              keyword_score * self.keyword_weight)
             
             # Boost score if query contains important words
-            important_words = ['how', 'what', 'when', 'where', 'why', 'can', 'do', 'is', 'are']
-            if any(word in user_query_clean for word in important_words):
+            if boosted:
                 combined_score *= 1.1
             
-            if combined_score > highest_score and combined_score >= self.min_similarity_threshold:
-                highest_score = combined_score
-                best_match = {
-                    'faq': faq,
-                    'score': combined_score,
-                    'text_similarity': text_similarity,
-                    'keyword_score': keyword_score
-                }
+            if combined_score <= 0 or combined_score < min_score:
+                continue
+            if len(top_matches) == limit and combined_score <= top_matches[-1]['score']:
+                continue
+            
+            # Earlier FAQs win ties, as with a strict ">" against the best so far
+            position = len(top_matches)
+            while position > 0 and top_matches[position - 1]['score'] < combined_score:
+                position -= 1
+            top_matches.insert(position, {
+                'faq': entry.faq,
+                'score': combined_score,
+                'text_similarity': text_similarity,
+                'keyword_score': keyword_score
+            })
+            del top_matches[limit:]
         
-        return best_match
+        return top_matches, scored
     
+    def exact_response(self, user_query: str, index: Optional[FAQIndex] = None) -> Optional[Dict]:
+        """
+        Response for a query that is an FAQ question (after preprocessing),
+        without fuzzy scoring; None if there is no such FAQ. Used to keep
+        answering cheaply when the chat endpoint is shedding load.
+        """
+        if self.service_socket and index is None:
+            try:
+                return remote_exact_response(self.service_socket, user_query)
+            except MatcherServiceUnavailable:
+                pass
+        if index is None:
+            index = self.get_faq_index()
+        entry = index.exact.get(self.normalize_query(user_query, index))
+        if entry is None:
+            return None
+        return self.response_for_match({'faq': entry.faq, 'score': 1.0})
+
     def get_response(self, user_query: str) -> Dict:
         """Get response based on user query"""
-        match = self.find_best_match(user_query)
+        if self.service_socket:
+            try:
+                with stage_timer('matcher_service'):
+                    return remote_responses(self.service_socket, [user_query])[0]
+            except MatcherServiceUnavailable:
+                pass
+        return self.response_for_match(self.find_best_match(user_query))
+    
+    def get_responses(self, user_queries: List[str], index: Optional[FAQIndex] = None) -> List[Dict]:
+        """get_response() for many queries: loads the FAQ index once and scores each distinct query once"""
+        if self.service_socket and index is None:
+            distinct = list(dict.fromkeys(user_queries))
+            try:
+                with stage_timer('matcher_service'):
+                    responses = dict(zip(distinct, remote_responses(self.service_socket, distinct)))
+            except MatcherServiceUnavailable:
+                pass
+            else:
+                return [dict(responses[query]) for query in user_queries]
         
+        if index is None:
+            with stage_timer('candidate_retrieval'):
+                index = self.get_faq_index()
+        
+        responses = {}
+        for query in user_queries:
+            if query not in responses:
+                matches = self.find_top_matches(
+                    query, limit=1, min_score=self.min_similarity_threshold, index=index
+                )
+                responses[query] = self.response_for_match(matches[0] if matches else None)
+        return [dict(responses[query]) for query in user_queries]
+    
+    def response_for_match(self, match: Optional[Dict]) -> Dict:
+        """Turn a find_best_match() result into the chat response"""
         if match and match['score'] >= 0.7:  # 70%+ confidence - direct answer
+            texts = faq_json_texts(match['faq'])
             return {
                 'success': True,
-                'response': match['faq'].answer,
-                'question': match['faq'].question,
-                'category': match['faq'].category,
+                'response': texts['answer'],
+                'faq_id': match['faq'].id,
+                'question': texts['question'],
+                'category': texts['category'],
                 'confidence': round(match['score'], 2),
                 'type': 'faq'
             }
         elif match and match['score'] >= 0.6:  # 60-70% confidence - clarification
             # Ask for clarification or provide partial answer
+            texts = faq_json_texts(match['faq'])
             return {
                 'success': True,
-                'response': f"I think you're asking about: {match['faq'].question}\n\n{match['faq'].answer}",
-                'question': match['faq'].question,
+                'response': texts['clarification'],
+                'faq_id': match['faq'].id,
+                'question': texts['question'],
+                'category': texts['category'],
                 'confidence': round(match['score'], 2),
                 'type': 'clarification'
             }
@@ -0,0 +1,218 @@
+"""
+Pre-aggregated analytics for AI responses.
+
+Every AI response counts towards its hour and day row in ResponseRollup
+(counts by response type) and, when an FAQ matched, in FAQRollup (counts
+by FAQ and category). The counts are kept in memory per process and added
+to the tables at most every ANALYTICS_FLUSH_SECONDS, in one transaction,
+after a response has been sent: chat turns never wait on the few hot
+rollup rows every worker updates. Rows are updated with F() increments,
+so concurrent workers never lose counts; a failed flush keeps its counts
+for the next one. Counts a worker had not flushed when it exits are lost,
+which rebuild_rollups() repairs: it recomputes both tables from the match
+columns on Message. The admin reads these small tables instead of
+aggregating the messages table.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncHour
+from django.dispatch import receiver
+from django.utils import timezone
+
+from astrotamil_api.sharding import chat_aliases
+from faq.models import FAQ
+
+from .models import FAQRollup, Message, ResponseRollup
+from .sqlite_tuning import run_write
+
+logger = logging.getLogger(__name__)
+
+# Response types with their own ResponseRollup column; anything else counts as 'other'
+RESPONSE_TYPE_COLUMNS = ('faq', 'clarification', 'human_handoff_request', 'collect_human_details')
+
+
+def period_starts(when):
+    """Start of the UTC hour and day containing ``when``."""
+    hour = when.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return {'hour': hour, 'day': hour.replace(hour=0)}
+
+
+def _type_column(response_type):
+    return response_type if response_type in RESPONSE_TYPE_COLUMNS else 'other'
+
+
+def _increment(model, lookup, amounts, defaults=None):
+    """Add ``amounts`` to the row matching ``lookup``, creating it if needed."""
+    expressions = {field: F(field) + amount for field, amount in amounts.items()}
+    if model.objects.filter(**lookup).update(**expressions):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **amounts, **(defaults or {}))
+    except IntegrityError:
+        # Another worker created the row between our update and insert
+        model.objects.filter(**lookup).update(**expressions)
+
+
+class RollupBuffer:
+    """Counts recorded by this process and not yet added to the rollup tables"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        # (period, period_start) -> Counter of ResponseRollup columns
+        self.responses = {}
+        # (period, period_start, faq_id) -> [category, count]
+        self.faqs = {}
+
+    def add(self, starts, type_counts, faq_counts):
+        with self._lock:
+            self._add(starts, type_counts, faq_counts)
+
+    def _add(self, starts, type_counts, faq_counts):
+        for period, start in starts.items():
+            self.responses.setdefault((period, start), Counter()).update(type_counts)
+            for (faq_id, category), count in faq_counts.items():
+                self.faqs.setdefault((period, start, faq_id), [category, 0])[1] += count
+
+    def take(self):
+        """The buffered counts, leaving the buffer empty"""
+        with self._lock:
+            taken = self.responses, self.faqs
+            self.clear()
+        return taken
+
+    def restore(self, responses, faqs):
+        """Put back counts that could not be written."""
+        with self._lock:
+            for key, counts in responses.items():
+                self.responses.setdefault(key, Counter()).update(counts)
+            for key, (category, count) in faqs.items():
+                self.faqs.setdefault(key, [category, 0])[1] += count
+
+
+_buffer = RollupBuffer()
+_flush_lock = threading.Lock()
+_next_flush = 0.0
+
+if hasattr(os, 'register_at_fork'):
+    # A forked worker starts without its parent's counts, which the parent flushes
+    os.register_at_fork(after_in_child=_buffer.clear)
+
+
+def record_responses(ai_responses, when=None):
+    """Count AI responses (FAQMatcher response dicts) towards the rollups; no queries."""
+    type_counts = Counter()
+    faq_counts = Counter()
+    for response in ai_responses:
+        type_counts[_type_column(response.get('type'))] += 1
+        if response.get('faq_id'):
+            faq_counts[(response['faq_id'], response.get('category') or '')] += 1
+    if not type_counts:
+        return
+    type_counts['total'] = sum(type_counts.values())
+    _buffer.add(period_starts(when or timezone.now()), type_counts, faq_counts)
+
+
+def _write_rollups(responses, faqs):
+    with transaction.atomic():
+        # Sorted, so that workers flushing at once lock the rows in the same order
+        for (period, start), counts in sorted(responses.items()):
+            _increment(ResponseRollup, {'period': period, 'period_start': start}, dict(counts))
+        for (period, start, faq_id), (category, count) in sorted(faqs.items()):
+            _increment(
+                FAQRollup,
+                {'period': period, 'period_start': start, 'faq_id': faq_id},
+                {'count': count},
+                defaults={'category': category}
+            )
+
+
+def flush_rollups(force: bool = False):
+    """
+    Add the buffered counts to the rollup tables, if ANALYTICS_FLUSH_SECONDS
+    have passed since the last flush (or ``force``). Failures are logged and
+    the counts kept for the next flush.
+    """
+    global _next_flush
+    if not force and time.monotonic() < _next_flush:
+        return
+    if not _flush_lock.acquire(blocking=force):
+        # Another thread is flushing
+        return
+    try:
+        _next_flush = time.monotonic() + getattr(settings, 'ANALYTICS_FLUSH_SECONDS', 10.0)
+        responses, faqs = _buffer.take()
+        if not responses:
+            return
+        try:
+            run_write(_write_rollups, responses, faqs)
+        except Exception:
+            _buffer.restore(responses, faqs)
+            logger.exception("Failed to update analytics rollups; keeping the counts for the next flush")
+    finally:
+        _flush_lock.release()
+
+
+@receiver(request_finished)
+def _flush_after_request(sender, **kwargs):
+    # After the response has gone out, so no request waits for the rollups
+    flush_rollups()
+
+
+@transaction.atomic
+def rebuild_rollups():
+    """Recompute both rollup tables from the match columns on Message (on every shard)."""
+    responses = {}
+    faq_counts = Counter()
+    for alias in chat_aliases():
+        ai_messages = Message.objects.using(alias).filter(is_user=False).exclude(response_type='').annotate(
+            hour=TruncHour('timestamp', tzinfo=dt_timezone.utc)
+        )
+        
+        for row in ai_messages.values('hour', 'response_type').annotate(n=Count('id')).order_by():
+            for period, start in period_starts(row['hour']).items():
+                rollup = responses.setdefault(
+                    (period, start), ResponseRollup(period=period, period_start=start)
+                )
+                column = _type_column(row['response_type'])
+                setattr(rollup, column, getattr(rollup, column) + row['n'])
+                rollup.total += row['n']
+        
+        matched = ai_messages.filter(matched_faq__isnull=False)
+        for row in matched.values('hour', 'matched_faq').annotate(n=Count('id')).order_by():
+            faq_counts[row['hour'], row['matched_faq']] += row['n']
+    
+    # FAQs are not on the shards, so their categories are looked up separately
+    categories = dict(
+        FAQ.objects.filter(pk__in={faq_id for _, faq_id in faq_counts}).values_list('pk', 'category')
+    )
+    faqs = {}
+    for (hour, faq_id), n in faq_counts.items():
+        if faq_id not in categories:
+            # Deleted FAQ whose messages were not unlinked
+            continue
+        for period, start in period_starts(hour).items():
+            rollup = faqs.setdefault(
+                (period, start, faq_id),
+                FAQRollup(period=period, period_start=start, faq_id=faq_id, category=categories[faq_id])
+            )
+            rollup.count += n
+    
+    ResponseRollup.objects.all().delete()
+    FAQRollup.objects.all().delete()
+    ResponseRollup.objects.bulk_create(responses.values(), batch_size=1000)
+    FAQRollup.objects.bulk_create(faqs.values(), batch_size=1000)
+    return len(responses), len(faqs)
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class ChatbotConfig(AppConfig):
+    name = 'chatbot'
+
+    def ready(self):
+        # Connect the SQLite connection tuning before the first query, and
+        # the cross-shard cleanup of deleted FAQs
+        from . import sqlite_tuning  # noqa: F401
+        from astrotamil_api import sharding  # noqa: F401
@@ -0,0 +1,298 @@
+"""
+WebSocket chat channel (ws/chat/?session_id=...&language=en), served
+under ASGI (astrotamil_api/asgi.py).
+
+A socket answers the same messages as POST /api/chat/ with the same
+payload, but resolves the conversation and whether the last answer
+offered a human agent once per connection instead of on every message.
+Messages are written in batches per connection: every
+CHAT_WS_FLUSH_MESSAGES messages, once the oldest unwritten turn is
+CHAT_WS_FLUSH_SECONDS old (a timer, so an idle socket is flushed too),
+before a human handoff, and when the socket closes. Each message keeps the
+time it was sent, not the time it was written. Clients that cannot open
+the socket, or lose it, send to /api/chat/ instead; both share the session.
+
+Client -> server: {"message": "...", "request_id": "...", "idempotency_key": "..."}
+Server -> client: the /api/chat/ response, or {"error": ..., "status": ...},
+with the request_id echoed back.
+
+idempotency_key is optional and shares the Idempotency-Key store of
+/api/chat/ (chatbot/idempotency.py). A client that gives up on the socket
+and posts {"session_id", "message", "language"} with the same key gets the
+socket's answer instead of a second turn. The key only counts as answered
+once the turn is written; until then such a post gets 409. Turns that
+fail to be written stay queued and are retried by the timer; if they are
+still unwritten when the socket closes, their keys are released so that
+the client's retry runs the turn again.
+"""
+
+import asyncio
+import logging
+import time
+from urllib.parse import parse_qs
+
+import orjson
+from channels.db import database_sync_to_async
+from channels.exceptions import StopConsumer
+from channels.generic.websocket import JsonWebsocketConsumer
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.utils import timezone
+
+from astrotamil_api.routers import mark_session_written
+from astrotamil_api.sharding import use_shard
+
+from .admission import SHED, get_concurrency_limiter, retry_after_seconds, take_token
+from .ai_matcher import FAQMatcher
+from .analytics import flush_rollups, record_responses
+from .idempotency import IdempotencyConflict, get_idempotency_store, request_fingerprint, valid_key
+from .metrics import RESPONSES, stage_timer
+from .models import Conversation, Message
+from .renderers import ORJSONRenderer
+from .serializers import ChatMessageSerializer
+from .session_cache import conversation_state, forget_session
+from .sqlite_tuning import run_write
+from .views import HUMAN_DETAILS_RESPONSE, accepts_human_agent, ai_message, chat_response_data
+
+logger = logging.getLogger(__name__)
+
+# Close codes (4000-4999 are for applications)
+CLOSE_INVALID_SESSION = 4400
+
+# Response types after which the client may call /api/request-human/,
+# which must see the conversation as the socket left it
+FLUSH_BEFORE = ('collect_human_details', 'human_handoff_request')
+
+
+class ChatConsumer(JsonWebsocketConsumer):
+    renderer = ORJSONRenderer()
+    flush_task = None
+    pending_since = None
+
+    async def dispatch(self, message):
+        # Handlers run on the sync thread; the flush timer runs on the event
+        # loop and goes through that same thread to flush
+        try:
+            await super().dispatch(message)
+        except StopConsumer:
+            if self.flush_task is not None:
+                self.flush_task.cancel()
+            raise
+        if self.pending_since is not None and self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_when_due())
+
+    async def flush_when_due(self):
+        try:
+            delay = self.seconds_until_flush()
+            while delay is not None:
+                await asyncio.sleep(delay)
+                delay = await database_sync_to_async(self.flush_if_due)()
+        finally:
+            self.flush_task = None
+
+    def seconds_until_flush(self):
+        """Seconds until the queued turns are due to be written, or None if there are none"""
+        if self.pending_since is None:
+            return None
+        max_seconds = getattr(settings, 'CHAT_WS_FLUSH_SECONDS', 5.0)
+        return max(0.0, max_seconds - (time.monotonic() - self.pending_since))
+
+    def flush_if_due(self):
+        if self.seconds_until_flush() == 0.0:
+            self.try_flush()
+        return self.seconds_until_flush()
+
+    def try_flush(self) -> bool:
+        """flush(), logging a failure; the turns stay queued and are retried when due again."""
+        try:
+            self.flush()
+            return True
+        except Exception:
+            logger.exception(
+                f"Failed to save {len(self.pending_messages)} chat messages for {self.session_id}; will retry"
+            )
+            self.pending_since = time.monotonic()
+            return False
+
+    def connect(self):
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        serializer = ChatMessageSerializer(data={
+            'session_id': params.get('session_id', [''])[0],
+            'message': '-',
+            'language': params.get('language', ['en'])[0],
+        })
+        if not serializer.is_valid():
+            self.close(code=CLOSE_INVALID_SESSION)
+            return
+
+        self.session_id = serializer.validated_data['session_id']
+        self.language = serializer.validated_data['language']
+        self.faq_matcher = FAQMatcher()
+        self.pending_messages = []
+        self.pending_responses = []
+        # (idempotency key, fingerprint, response data) of the queued turns
+        self.pending_keys = []
+
+        with use_shard(self.session_id):
+            with stage_timer('db_write'):
+                self.state = run_write(conversation_state, self.session_id, self.language)
+            recent = list(Message.objects.filter(
+                conversation_id=self.state.conversation_id
+            ).order_by('-timestamp')[:4])
+        last_ai_msg = next((m for m in recent if not m.is_user), None)
+        self.offered_human_agent = bool(last_ai_msg) and 'human agent' in last_ai_msg.content.lower()
+        self.accept()
+
+    def disconnect(self, code):
+        if getattr(self, 'pending_messages', None) and not self.try_flush():
+            # Lost: let the client's retry with the same key run the turn again
+            logger.error(f"Dropped {len(self.pending_messages)} unsaved chat messages for {self.session_id}")
+            store = get_idempotency_store()
+            for key, _, _ in self.pending_keys:
+                store.release('chat', key)
+
+    def receive(self, text_data=None, bytes_data=None, **kwargs):
+        try:
+            content = orjson.loads(text_data or bytes_data or b'')
+        except orjson.JSONDecodeError:
+            self.send_error(None, 'Invalid JSON', 400)
+            return
+        if not isinstance(content, dict):
+            self.send_error(None, 'Expected a JSON object', 400)
+            return
+        self.receive_json(content)
+
+    @classmethod
+    def encode_json(cls, content):
+        return cls.renderer.render(content).decode()
+
+    def send_error(self, request_id, error, status, **extra):
+        self.send_json(dict(extra, error=error, status=status, request_id=request_id))
+
+    def receive_json(self, content, **kwargs):
+        received_at = timezone.now()
+        request_id = content.get('request_id')
+        raw_message = content.get('message')
+        user_message = raw_message.strip() if isinstance(raw_message, str) else ''
+        if not user_message:
+            self.send_error(request_id, 'Message cannot be empty', 400)
+            return
+
+        wait = take_token('session', self.session_id, 'CHAT_SESSION_RATE', 'CHAT_SESSION_BURST')
+        if wait:
+            self.send_error(request_id, 'Too many messages', 429, retry_after=wait)
+            return
+
+        key = content.get('idempotency_key')
+        if key is not None:
+            if not valid_key(key):
+                self.send_error(request_id, 'Invalid idempotency_key', 400)
+                return
+            store = get_idempotency_store()
+            # The body the client posts to /api/chat/ for this message
+            fingerprint = request_fingerprint({
+                'session_id': self.session_id, 'message': raw_message, 'language': self.language,
+            })
+            try:
+                stored = store.begin('chat', key, fingerprint)
+            except IdempotencyConflict as conflict:
+                self.send_error(request_id, str(conflict), conflict.status_code)
+                return
+            if stored is not None:
+                # Already answered over REST; the turn is saved there
+                self.send_json(dict(stored.data, request_id=request_id))
+                return
+
+        try:
+            ai_response = self.answer(user_message)
+        except BaseException:
+            if key is not None:
+                store.release('chat', key)
+            raise
+        if ai_response is None:
+            if key is not None:
+                store.release('chat', key)
+            self.send_error(
+                request_id, 'The assistant is busy right now. Please try again in a moment.',
+                503, retry_after=retry_after_seconds()
+            )
+            return
+
+        RESPONSES.inc(ai_response.get('type', 'unknown'))
+        self.offered_human_agent = 'human agent' in ai_response['response'].lower()
+        data = chat_response_data(self.session_id, user_message, ai_response)
+        self.queue_turn(user_message, ai_response, received_at,
+                        completion=None if key is None else (key, fingerprint, data))
+        self.send_json(dict(data, request_id=request_id))
+
+    def answer(self, user_message):
+        """The AI response to a message, or None if it was shed."""
+        limiter = get_concurrency_limiter()
+        shed_reason = limiter.acquire()
+        try:
+            if shed_reason:
+                # Saturated: only answer exact FAQ questions, as /api/chat/ does
+                ai_response = self.faq_matcher.exact_response(user_message)
+                SHED.inc(shed_reason if ai_response is None else 'degraded')
+                return ai_response
+            if self.offered_human_agent and accepts_human_agent(user_message):
+                return dict(HUMAN_DETAILS_RESPONSE)
+            return self.faq_matcher.get_response(user_message)
+        finally:
+            if not shed_reason:
+                limiter.release()
+
+    def queue_turn(self, user_message, ai_response, received_at, completion=None):
+        """Queue a turn for the next flush; ``completion`` is its (key, fingerprint, data)."""
+        self.pending_messages.append(Message(
+            conversation_id=self.state.conversation_id, content=user_message, is_user=True,
+            timestamp=received_at
+        ))
+        self.pending_messages.append(ai_message(self.state.conversation_id, ai_response))
+        self.pending_responses.append(ai_response)
+        if completion is not None:
+            self.pending_keys.append(completion)
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+
+        max_messages = getattr(settings, 'CHAT_WS_FLUSH_MESSAGES', 20)
+        if (ai_response.get('type') in FLUSH_BEFORE
+                or len(self.pending_messages) >= max_messages
+                or self.seconds_until_flush() == 0.0):
+            self.try_flush()
+
+    def flush(self):
+        """Write the queued turns in one batch; they stay queued if that fails."""
+        messages, responses, keys = self.pending_messages, self.pending_responses, self.pending_keys
+
+        with use_shard(self.session_id):
+            with stage_timer('db_write'):
+                try:
+                    run_write(self.save_messages, self.state.conversation_id, messages)
+                except IntegrityError:
+                    # Conversation was deleted while the socket was open
+                    forget_session(self.session_id)
+                    self.state = run_write(conversation_state, self.session_id, self.language)
+                    for message in messages:
+                        message.conversation_id = self.state.conversation_id
+                    run_write(self.save_messages, self.state.conversation_id, messages)
+        self.pending_messages, self.pending_responses, self.pending_keys, self.pending_since = [], [], [], None
+
+        # Written: only now may a retry of these turns be answered from the store
+        store = get_idempotency_store()
+        for key, fingerprint, data in keys:
+            store.complete('chat', key, fingerprint, 200, data)
+        record_responses(responses)
+        # No request_finished for sockets: flush here when due
+        flush_rollups()
+
+        # The REST endpoint's cached human-agent state is out of date now
+        forget_session(self.session_id)
+        mark_session_written(self.session_id)
+
+    @staticmethod
+    def save_messages(conversation_id, messages):
+        # All or nothing, so that a failed batch can be written again
+        with transaction.atomic(using=router.db_for_write(Message)):
+            Message.objects.bulk_create(messages)
+            Conversation.objects.filter(pk=conversation_id).update(last_active=timezone.now())
@@ -0,0 +1,254 @@
+"""
+Idempotency keys for the chat and handoff POSTs.
+
+The mobile app retries a POST whose response it never received (timeouts,
+dropped connections). Without a key each retry saves the user message
+again and runs the matcher again. A client that sends an
+``Idempotency-Key`` header (any unique string, e.g. a UUID per message)
+gets the stored response of the first attempt back instead, marked with
+``Idempotent-Replayed: true``, and nothing is executed twice:
+
+* a retry while the first attempt is still running gets 409
+* a key reused with a different request body gets 422
+* 5xx and 429 responses are not stored, so the client can retry them
+
+Keys and completed responses are kept for IDEMPOTENCY_TIMEOUT seconds in
+the idempotency_records table, so every worker sees them: a unique
+constraint on (scope, key hash) lets exactly one request claim a key, and
+expired rows are taken over by the next claim and purged now and then.
+IDEMPOTENCY_BACKEND may instead name a Django cache shared by all workers
+(e.g. Redis), which saves the database round trips.
+Requests without the header are not affected.
+"""
+
+import functools
+import hashlib
+import threading
+import time
+from datetime import timedelta
+from typing import Optional
+
+import orjson
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import IntegrityError, router, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import CACHE_LOOKUPS
+from .models import IdempotencyRecord
+from .renderers import ORJSONRenderer
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+# How long a key stays claimed by an attempt that never completes (e.g. a killed worker)
+IN_PROGRESS_TIMEOUT = 60
+# Seconds between deletes of expired rows, per process
+PURGE_INTERVAL = 300
+
+
+class IdempotencyConflict(Exception):
+    """The key is in use by a running request, or by a different request"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class StoredResponse:
+    """A completed response, or a claim on the key while status_code is None"""
+
+    __slots__ = ('fingerprint', 'status_code', 'data')
+
+    def __init__(self, fingerprint: str, status_code: Optional[int] = None, data=None):
+        self.fingerprint = fingerprint
+        self.status_code = status_code
+        self.data = data
+
+
+class IdempotencyStore:
+    """StoredResponse per key in the idempotency_records table, or in a shared Django cache"""
+
+    key_prefix = 'idempotency:'
+
+    def __init__(self, backend=None, timeout: int = 86400):
+        self.backend = backend
+        self.timeout = timeout
+        self._next_purge = 0.0
+
+    def _key(self, scope: str, key: str) -> str:
+        # Hashed so any header value is a valid key for every cache backend
+        return self.key_prefix + self._hash(scope, key)
+
+    @staticmethod
+    def _hash(scope: str, key: str) -> str:
+        return hashlib.sha256(f'{scope}:{key}'.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _records():
+        # Always the primary: a replica may not have the claim yet
+        return IdempotencyRecord.objects.using(router.db_for_write(IdempotencyRecord))
+
+    def begin(self, scope: str, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        """
+        The stored response for the key, or None after claiming the key for
+        this request. Raises IdempotencyConflict if another request holds it.
+        """
+        if self.backend is not None:
+            cache_key = self._key(scope, key)
+            stored = self.backend.get(cache_key)
+            if stored is None:
+                if self.backend.add(cache_key, StoredResponse(fingerprint), IN_PROGRESS_TIMEOUT):
+                    return None
+                stored = self.backend.get(cache_key)
+        else:
+            stored = self._begin_record(scope, self._hash(scope, key), fingerprint)
+            if stored is True:
+                return None
+        if stored is None:
+            # Released between add() and get(); let the client try again
+            raise IdempotencyConflict('A request with this Idempotency-Key is in progress.', status.HTTP_409_CONFLICT)
+        if stored.fingerprint != fingerprint:
+            raise IdempotencyConflict(
+                'This Idempotency-Key was already used for a different request.',
+                status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if stored.status_code is None:
+            raise IdempotencyConflict('A request with this Idempotency-Key is in progress.', status.HTTP_409_CONFLICT)
+        return stored
+
+    def _begin_record(self, scope: str, key_hash: str, fingerprint: str):
+        """True after claiming the key, else the StoredResponse holding it (None if just released)"""
+        records = self._records()
+        now = timezone.now()
+        self._purge_expired(records, now)
+        claim = dict(fingerprint=fingerprint, status_code=None, data=None,
+                     expires_at=now + timedelta(seconds=IN_PROGRESS_TIMEOUT))
+        record = records.filter(scope=scope, key_hash=key_hash).first()
+        if record is None:
+            try:
+                # The unique constraint lets only one concurrent request in
+                with transaction.atomic(using=records.db):
+                    records.create(scope=scope, key_hash=key_hash, **claim)
+                return True
+            except IntegrityError:
+                record = records.filter(scope=scope, key_hash=key_hash).first()
+        elif record.expires_at <= now:
+            # Unless another request took over the expired row first
+            if records.filter(pk=record.pk, expires_at__lte=now).update(**claim):
+                return True
+            record = records.filter(pk=record.pk).first()
+        if record is None:
+            return None
+        return StoredResponse(record.fingerprint, record.status_code, record.data)
+
+    def _purge_expired(self, records, now):
+        if time.monotonic() < self._next_purge:
+            return
+        self._next_purge = time.monotonic() + PURGE_INTERVAL
+        records.filter(expires_at__lte=now).delete()
+
+    def complete(self, scope: str, key: str, fingerprint: str, status_code: int, data):
+        """Store the response of the request that claimed the key."""
+        if self.backend is not None:
+            self.backend.set(self._key(scope, key), StoredResponse(fingerprint, status_code, data), self.timeout)
+            return
+        self._records().filter(scope=scope, key_hash=self._hash(scope, key)).update(
+            fingerprint=fingerprint,
+            status_code=status_code,
+            # As the client received it: JSONText, datetimes, UUIDs etc. become JSON values
+            data=None if data is None else orjson.loads(ORJSONRenderer().render(data)),
+            expires_at=timezone.now() + timedelta(seconds=self.timeout),
+        )
+
+    def release(self, scope: str, key: str):
+        """Give up the claim without storing a response, so the key can be retried."""
+        if self.backend is not None:
+            self.backend.delete(self._key(scope, key))
+            return
+        self._records().filter(scope=scope, key_hash=self._hash(scope, key)).delete()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    """The process-wide IdempotencyStore, built from settings on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                alias = getattr(settings, 'IDEMPOTENCY_BACKEND', '')
+                _store = IdempotencyStore(
+                    backend=caches[alias] if alias else None,
+                    timeout=getattr(settings, 'IDEMPOTENCY_TIMEOUT', 86400),
+                )
+    return _store
+
+
+@receiver(setting_changed)
+def _reset_store(setting, **kwargs):
+    global _store
+    if setting.startswith('IDEMPOTENCY_'):
+        _store = None
+
+
+def valid_key(key) -> bool:
+    return isinstance(key, str) and 0 < len(key) <= MAX_KEY_LENGTH
+
+
+def request_fingerprint(data) -> str:
+    """Hash of a parsed request body, to tell a retry from a reused key"""
+    return hashlib.sha256(orjson.dumps(data, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
+
+def is_stored(status_code: int) -> bool:
+    """Whether a response is final for its key; 5xx and 429 may succeed on retry"""
+    return status_code < 500 and status_code != status.HTTP_429_TOO_MANY_REQUESTS
+
+
+def idempotent(scope: str):
+    """
+    Decorate an APIView's post() to honour the Idempotency-Key header.
+    ``scope`` keeps the keys of different endpoints apart.
+    """
+    def decorator(post):
+        @functools.wraps(post)
+        def wrapper(view, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if key is None:
+                return post(view, request, *args, **kwargs)
+            if not valid_key(key):
+                return Response({
+                    'error': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            store = get_idempotency_store()
+            fingerprint = request_fingerprint(request.data)
+            try:
+                stored = store.begin(scope, key, fingerprint)
+            except IdempotencyConflict as conflict:
+                CACHE_LOOKUPS.inc('idempotency', 'conflict')
+                return Response({'error': str(conflict)}, status=conflict.status_code)
+            if stored is not None:
+                CACHE_LOOKUPS.inc('idempotency', 'hit')
+                return Response(stored.data, status=stored.status_code, headers={REPLAYED_HEADER: 'true'})
+            CACHE_LOOKUPS.inc('idempotency', 'miss')
+
+            try:
+                response = post(view, request, *args, **kwargs)
+            except BaseException:
+                store.release(scope, key)
+                raise
+            if is_stored(response.status_code):
+                store.complete(scope, key, fingerprint, response.status_code, response.data)
+            else:
+                store.release(scope, key)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,235 @@
+"""
+Classify a file of exported user questions with the FAQ matcher.
+
+    python manage.py classify_queries questions.jsonl --output results.jsonl
+    python manage.py classify_queries questions.csv --field message --workers 8
+    python manage.py classify_queries questions.jsonl --output results.jsonl --resume
+
+Input is JSONL (one object per line, or one JSON string per line) or CSV
+with a header row. Queries are scored in chunks across a process pool;
+each worker builds the FAQ index once from the FAQ rows it is started
+with, so workers never query the database. Results are written as JSONL
+in input order as soon as each chunk is done, one line per input record
+with its 0-based ``offset``, so an interrupted run can be continued with
+--resume (or --offset).
+"""
+
+import csv
+import json
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+# Set in each worker process by _init_worker
+_worker_matcher = None
+_worker_index = None
+
+
+def _init_worker(faq_rows):
+    """Build the matcher and FAQ index once per worker process."""
+    global _worker_matcher, _worker_index
+
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        # spawn start method (macOS/Windows): the worker starts without Django
+        django.setup()
+
+    from chatbot.ai_matcher import FAQIndex, FAQMatcher
+    from faq.models import FAQ
+
+    _worker_matcher = FAQMatcher()
+    _worker_index = FAQIndex.build(_worker_matcher, [FAQ(**row) for row in faq_rows])
+
+
+def _classify_chunk(chunk):
+    """Score a list of (offset, query) pairs; returns one result dict per pair."""
+    matcher, index = _worker_matcher, _worker_index
+    results = []
+    for offset, query in chunk:
+        if not isinstance(query, str) or not query.strip():
+            results.append({'offset': offset, 'query': query, 'error': 'missing or unreadable query'})
+            continue
+        matches = matcher.find_top_matches(
+            query, limit=1, min_score=matcher.min_similarity_threshold, index=index
+        )
+        match = matches[0] if matches else None
+        response = matcher.response_for_match(match)
+        results.append({
+            'offset': offset,
+            'query': query,
+            'type': response['type'],
+            'faq_id': str(response['faq_id']) if response.get('faq_id') else None,
+            'question': response.get('question'),
+            'category': response.get('category'),
+            'confidence': response.get('confidence', 0),
+        })
+    return results
+
+
+def read_queries(stream, fmt, field):
+    """Yield the query of every input record (None for unreadable records)."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        if reader.fieldnames and field not in reader.fieldnames:
+            raise CommandError(f"CSV has no '{field}' column (columns: {', '.join(reader.fieldnames)})")
+        for row in reader:
+            yield row.get(field)
+        return
+
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        yield record.get(field) if isinstance(record, dict) else record
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'Classify a JSONL/CSV file of user questions with the FAQ matcher, in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="JSONL or CSV file of queries ('-' for stdin)")
+        parser.add_argument('--output', default='-', help="JSONL results file (default: stdout)")
+        parser.add_argument('--format', choices=['jsonl', 'csv'],
+                            help='Input format (default: from the file extension, else jsonl)')
+        parser.add_argument('--field', default='query',
+                            help="JSON key or CSV column holding the query (default: query)")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes; 0 scores in this process (default: CPU count)')
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Queries sent to a worker at a time (default: 200)')
+        parser.add_argument('--offset', type=int, default=0,
+                            help='Skip this many input records before classifying')
+        parser.add_argument('--resume', action='store_true',
+                            help='Append to --output, skipping the records it already has')
+        parser.add_argument('--progress-every', type=float, default=5.0,
+                            help='Seconds between throughput reports on stderr (0 to disable)')
+
+    def handle(self, *args, **options):
+        from faq.models import FAQ
+
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        output_path = options['output']
+        offset = options['offset']
+        if options['resume']:
+            if output_path == '-':
+                raise CommandError('--resume needs an --output file')
+            offset = self._completed_records(output_path)
+            self.stderr.write(f"Resuming at offset {offset}")
+
+        faq_rows = list(FAQ.objects.values('id', 'question', 'answer', 'keywords', 'category'))
+        if not faq_rows:
+            raise CommandError('There are no FAQs to match against')
+
+        fmt = options['format'] or ('csv' if options['input'].lower().endswith('.csv') else 'jsonl')
+        input_stream = sys.stdin if options['input'] == '-' else open(
+            options['input'], 'r', encoding='utf-8', newline=''
+        )
+        if output_path == '-':
+            output_stream = self.stdout
+        else:
+            output_stream = open(output_path, 'a' if options['resume'] else 'w', encoding='utf-8')
+
+        records = islice(enumerate(read_queries(input_stream, fmt, options['field'])), offset, None)
+        try:
+            stats = self._classify(
+                chunked(records, options['chunk_size']), faq_rows, output_stream,
+                options['workers'], options['progress_every']
+            )
+        finally:
+            if input_stream is not sys.stdin:
+                input_stream.close()
+            if output_stream is not self.stdout:
+                output_stream.close()
+
+        processed, elapsed, types = stats
+        rate = processed / elapsed if elapsed else 0.0
+        self.stderr.write(
+            f"Classified {processed} queries (from offset {offset}) in {elapsed:.1f}s, {rate:.1f} queries/s"
+        )
+        for response_type, count in types.most_common():
+            share = 100 * count / processed if processed else 0
+            self.stderr.write(f"   {response_type}: {count} ({share:.1f}%)")
+
+    def _classify(self, chunks, faq_rows, output_stream, workers, progress_every):
+        types = Counter()
+        processed = 0
+        started = last_report = time.perf_counter()
+
+        def write(results):
+            nonlocal processed, last_report
+            for result in results:
+                output_stream.write(json.dumps(result, ensure_ascii=False) + '\n')
+                types[result.get('type', 'error')] += 1
+            processed += len(results)
+            output_stream.flush()
+
+            now = time.perf_counter()
+            if progress_every and now - last_report >= progress_every:
+                last_report = now
+                self.stderr.write(f"{processed} queries, {processed / (now - started):.1f} queries/s")
+
+        if workers <= 0:
+            _init_worker(faq_rows)
+            for chunk in chunks:
+                write(_classify_chunk(chunk))
+        else:
+            # Forked workers must not inherit open database connections
+            connections.close_all()
+            max_in_flight = 4 * workers
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(faq_rows,)) as executor:
+                # Bounded window of in-flight chunks, written in submission order
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(executor.submit(_classify_chunk, chunk))
+                    if len(pending) >= max_in_flight:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+
+        return processed, time.perf_counter() - started, types
+
+    @staticmethod
+    def _completed_records(output_path):
+        """
+        Number of records already written to an earlier run's output file.
+        A last line cut off by an interrupted run is truncated away.
+        """
+        if not os.path.exists(output_path):
+            return 0
+        completed = good_bytes = 0
+        with open(output_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    completed = json.loads(line)['offset'] + 1
+                except (ValueError, KeyError, TypeError):
+                    break
+                good_bytes += len(line)
+        with open(output_path, 'r+b') as f:
+            f.truncate(good_bytes)
+        return completed
@@ -0,0 +1,60 @@
+"""
+Serve FAQ matching to the web workers over a Unix domain socket.
+
+    python manage.py matcher_service
+    python manage.py matcher_service --socket /run/astrotamil/matcher.sock --refresh-interval 5
+
+Loads the FAQ index once and answers the workers' match requests (see
+chatbot/matcher_service.py). Point MATCHER_SERVICE_SOCKET at the same path
+for the workers to use it; while the service is down they match
+in-process. FAQ edits are picked up within --refresh-interval seconds.
+"""
+
+import os
+import socket
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.matcher_service import MatcherServer, MatcherService
+
+
+class Command(BaseCommand):
+    help = 'Run the out-of-process FAQ matcher on a Unix domain socket'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=getattr(settings, 'MATCHER_SERVICE_SOCKET', ''),
+                            help='Socket path (default: MATCHER_SERVICE_SOCKET)')
+        parser.add_argument('--refresh-interval', type=float, default=1.0,
+                            help='Seconds between checks for FAQ changes (default: 1)')
+
+    def handle(self, *args, **options):
+        path = options['socket']
+        if not path:
+            raise CommandError('Give --socket or set MATCHER_SERVICE_SOCKET')
+        self._remove_stale_socket(path)
+
+        service = MatcherService(refresh_interval=options['refresh_interval'])
+        server = MatcherServer(path, service)
+        self.stdout.write(f"Matching against {len(service.index())} FAQs on {path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    @staticmethod
+    def _remove_stale_socket(path):
+        """Remove a socket file left by a service that is no longer running."""
+        if not os.path.exists(path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+        else:
+            raise CommandError(f'A matcher service is already listening on {path}')
+        finally:
+            probe.close()
@@ -0,0 +1,153 @@
+"""
+Move conversations to the shard their session belongs on.
+
+    python manage.py rebalance_shards --dry-run
+    python manage.py rebalance_shards --batch-size 200
+
+Run it after turning sharding on (everything starts out on default) and
+after changing DATABASE_SHARD_COUNT (migrate the new shards first). Each
+conversation is copied with its messages and handoff request to its shard
+in one transaction there, then deleted where it was. Rows keep their ids
+and timestamps, so cached sessions and ticket numbers stay valid, and an
+interrupted run can simply be repeated. If the session has meanwhile
+started a conversation on its new shard, the old messages are merged into
+that conversation.
+"""
+
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from astrotamil_api.sharding import chat_aliases, shard_aliases, shard_for
+from chatbot.models import Conversation, HumanHandoffRequest, Message
+
+MESSAGE_CHUNK_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Move conversations, messages and handoff requests to the shard of their session'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Conversations read (and moved) at a time (default: 200)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be moved')
+
+    def handle(self, *args, **options):
+        if not shard_aliases():
+            raise CommandError('Sharding is off: set DATABASE_SHARD_COUNT')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        moved = Counter()
+        for source in chat_aliases():
+            for batch in self._misplaced(source, options['batch_size']):
+                targets = {}
+                for conversation in batch:
+                    targets.setdefault(shard_for(conversation.session_id), []).append(conversation)
+                for target, conversations in targets.items():
+                    if options['dry_run']:
+                        counts = self._count(source, conversations)
+                    else:
+                        counts = self._move(source, target, conversations)
+                    for kind, n in counts.items():
+                        moved[source, target, kind] += n
+
+        pairs = sorted({(source, target) for source, target, _ in moved})
+        for source, target in pairs:
+            self.stdout.write(
+                f"{source} -> {target}: {moved[source, target, 'conversations']} conversations, "
+                f"{moved[source, target, 'messages']} messages, "
+                f"{moved[source, target, 'handoff_requests']} handoff requests"
+            )
+        total = sum(n for (_, _, kind), n in moved.items() if kind == 'conversations')
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {total} conversations"))
+
+    def _misplaced(self, source, batch_size):
+        """Batches of the conversations on ``source`` that belong on another shard."""
+        last_pk = None
+        while True:
+            conversations = Conversation.objects.using(source).order_by('pk')
+            if last_pk is not None:
+                conversations = conversations.filter(pk__gt=last_pk)
+            batch = list(conversations[:batch_size])
+            if not batch:
+                return
+            last_pk = batch[-1].pk
+            misplaced = [c for c in batch if shard_for(c.session_id) != source]
+            if misplaced:
+                yield misplaced
+
+    def _count(self, source, conversations):
+        ids = [c.pk for c in conversations]
+        return {
+            'conversations': len(conversations),
+            'messages': Message.objects.using(source).filter(conversation_id__in=ids).count(),
+            'handoff_requests': HumanHandoffRequest.objects.using(source).filter(conversation_id__in=ids).count(),
+        }
+
+    def _move(self, source, target, conversations):
+        ids = [c.pk for c in conversations]
+        counts = Counter()
+
+        with transaction.atomic(using=target):
+            existing = dict(
+                Conversation.objects.using(target).filter(
+                    session_id__in=[c.session_id for c in conversations]
+                ).values_list('session_id', 'pk')
+            )
+            # Conversation a row of each moved conversation belongs to on the target
+            merged_into = {c.pk: existing.get(c.session_id, c.pk) for c in conversations}
+            for conversation in conversations:
+                if conversation.session_id not in existing:
+                    self._copy(conversation, target)
+                counts['conversations'] += 1
+
+            copied = set(
+                Message.objects.using(target).filter(
+                    conversation_id__in=set(merged_into.values())
+                ).values_list('pk', flat=True)
+            )
+            # Messages are inserted a chunk per query; their timestamp is a
+            # default rather than auto_now_add, so bulk_create keeps it
+            chunk = []
+            messages = Message.objects.using(source).filter(conversation_id__in=ids)
+            for message in messages.iterator(chunk_size=MESSAGE_CHUNK_SIZE):
+                if message.pk not in copied:
+                    message.conversation_id = merged_into[message.conversation_id]
+                    chunk.append(message)
+                    if len(chunk) == MESSAGE_CHUNK_SIZE:
+                        Message.objects.using(target).bulk_create(chunk)
+                        chunk = []
+                counts['messages'] += 1
+            if chunk:
+                Message.objects.using(target).bulk_create(chunk)
+
+            handled = set(
+                HumanHandoffRequest.objects.using(target).filter(
+                    conversation_id__in=set(merged_into.values())
+                ).values_list('conversation_id', flat=True)
+            )
+            for handoff in HumanHandoffRequest.objects.using(source).filter(conversation_id__in=ids):
+                conversation_id = merged_into[handoff.conversation_id]
+                if conversation_id not in handled:
+                    handoff.conversation_id = conversation_id
+                    self._copy(handoff, target)
+                    counts['handoff_requests'] += 1
+                elif not HumanHandoffRequest.objects.using(target).filter(pk=handoff.pk).exists():
+                    # One request per conversation: the session already has one on its shard
+                    self.stderr.write(self.style.WARNING(
+                        f"Dropping handoff request {str(handoff.id)[:8].upper()} ({handoff.name}, "
+                        f"{handoff.phone}, {handoff.status}): the session has a newer one on {target}"
+                    ))
+
+        with transaction.atomic(using=source):
+            Conversation.objects.using(source).filter(pk__in=ids).delete()
+        return counts
+
+    @staticmethod
+    def _copy(obj, target):
+        # Raw insert, as loaddata does: keeps auto_now timestamps as they are
+        obj.save_base(using=target, raw=True, force_insert=True)
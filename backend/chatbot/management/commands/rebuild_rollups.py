@@ -0,0 +1,23 @@
+"""
+Recompute the analytics rollup tables from the match metadata on Message.
+
+    python manage.py rebuild_rollups
+
+The rollups are maintained incrementally by the chat views; run this after
+bulk-deleting messages or to repair counts. Messages stored before match
+metadata was recorded have no response type and are not counted.
+"""
+
+from django.core.management.base import BaseCommand
+
+from chatbot.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the hourly/daily analytics rollups from the messages table'
+
+    def handle(self, *args, **options):
+        responses, faqs = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {responses} response rollup rows and {faqs} FAQ rollup rows"
+        ))
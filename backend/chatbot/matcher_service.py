@@ -0,0 +1,296 @@
+"""
+Out-of-process FAQ matcher.
+
+Matching inside every gunicorn worker keeps a copy of the FAQ index per
+worker and runs fuzzy scoring under the same GIL as request handling.
+``manage.py matcher_service`` instead loads the index once and answers
+match requests on a Unix domain socket. With MATCHER_SERVICE_SOCKET set,
+FAQMatcher.get_response(), get_responses() and exact_response() go to the
+service, and fall back to matching in-process when it cannot be reached
+(the service is then skipped for MATCHER_SERVICE_RETRY_SECONDS).
+
+Every message is a 4-byte big-endian length followed by a msgpack array:
+requests are ``[request_id, op, argument]`` and replies
+``[request_id, ok, result]``. A connection may send any number of requests
+before reading the replies, which come back in request order. Ops:
+
+* ``match``: query -> chat response (FAQMatcher.get_response)
+* ``exact``: query -> chat response, or None (FAQMatcher.exact_response)
+* ``ping``: None -> number of FAQs in the index
+"""
+
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import msgpack
+from django.conf import settings
+from django.db import connections
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SERVICE_CALLS = registry.counter(
+    'matcher_service_calls_total',
+    'Matcher service calls by result (ok, error, or down while skipped).',
+    ['result'],
+)
+
+_HEADER = struct.Struct('>I')
+# Far above any real request; protects both ends from a corrupt length
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+
+class MatcherServiceUnavailable(Exception):
+    """The matcher service could not answer; match in-process instead"""
+
+
+def pack_frame(message) -> bytes:
+    body = msgpack.packb(message, use_bin_type=True)
+    return _HEADER.pack(len(body)) + body
+
+
+def read_frame(stream):
+    """Next message from a buffered binary stream; None at a clean end of stream."""
+    header = stream.read(_HEADER.size)
+    if not header:
+        return None
+    if len(header) < _HEADER.size:
+        raise ConnectionError('connection closed inside a message')
+    (length,) = _HEADER.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f'message of {length} bytes is too large')
+    body = stream.read(length)
+    if len(body) < length:
+        raise ConnectionError('connection closed inside a message')
+    return msgpack.unpackb(body, raw=False)
+
+
+def response_to_wire(response: Dict) -> Dict:
+    """Chat response with its FAQ id as a string, which msgpack can carry"""
+    if response.get('faq_id') is not None:
+        response = dict(response, faq_id=str(response['faq_id']))
+    return response
+
+
+def response_from_wire(response: Dict) -> Dict:
+    if response.get('faq_id') is not None:
+        response['faq_id'] = uuid.UUID(response['faq_id'])
+    return response
+
+
+# ---------------------------------------------------------------- client
+
+
+class MatcherClient:
+    """One connection to the matcher service (used by a single thread)"""
+
+    def __init__(self, path: str, timeout: float):
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._rfile = None
+        self._next_id = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._sock is not None
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock, self._rfile = sock, sock.makefile('rb')
+
+    def close(self):
+        if self._sock is not None:
+            self._rfile.close()
+            self._sock.close()
+            self._sock = self._rfile = None
+
+    def call(self, requests: List) -> List:
+        """
+        Send (op, argument) requests in one write, then read their results
+        in order. Any failure closes the connection, so a half-read reply
+        never leaks into the next call.
+        """
+        if self._sock is None:
+            self.connect()
+        first_id = self._next_id
+        self._next_id += len(requests)
+        try:
+            self._sock.sendall(b''.join(
+                pack_frame([first_id + i, op, argument]) for i, (op, argument) in enumerate(requests)
+            ))
+            results = []
+            for i in range(len(requests)):
+                reply = read_frame(self._rfile)
+                if reply is None:
+                    raise ConnectionError('matcher service closed the connection')
+                request_id, ok, result = reply
+                if request_id != first_id + i:
+                    raise ValueError(f'reply {request_id} out of order, expected {first_id + i}')
+                if not ok:
+                    raise MatcherServiceUnavailable(f'matcher service failed: {result}')
+                results.append(result)
+        except BaseException:
+            self.close()
+            raise
+        return results
+
+
+_clients = threading.local()
+# Socket path -> time.monotonic() until which the service is not tried
+_down_until: Dict[str, float] = {}
+
+
+def get_client(path: str) -> MatcherClient:
+    """This thread's connection to the service at ``path``"""
+    clients = getattr(_clients, 'by_path', None)
+    if clients is None:
+        clients = _clients.by_path = {}
+    client = clients.get(path)
+    if client is None:
+        client = clients[path] = MatcherClient(path, getattr(settings, 'MATCHER_SERVICE_TIMEOUT', 1.0))
+    return client
+
+
+def call_service(path: str, requests: List) -> List:
+    """MatcherClient.call() on this thread's connection; raises MatcherServiceUnavailable."""
+    if time.monotonic() < _down_until.get(path, 0.0):
+        SERVICE_CALLS.inc('down')
+        raise MatcherServiceUnavailable(f'matcher service at {path} is marked down')
+
+    client = get_client(path)
+    reused = client.connected
+    try:
+        try:
+            results = client.call(requests)
+        except ConnectionError:
+            # A kept-open connection goes stale when the service restarts
+            if not reused:
+                raise
+            results = client.call(requests)
+    except MatcherServiceUnavailable as error:
+        SERVICE_CALLS.inc('error')
+        logger.warning("%s; matching in-process", error)
+        raise
+    except (OSError, ValueError, TypeError, msgpack.UnpackException) as error:
+        SERVICE_CALLS.inc('error')
+        if path not in _down_until:
+            logger.warning("Matcher service at %s unavailable (%s); matching in-process", path, error)
+        _down_until[path] = time.monotonic() + getattr(settings, 'MATCHER_SERVICE_RETRY_SECONDS', 5.0)
+        raise MatcherServiceUnavailable(str(error)) from error
+
+    if _down_until.pop(path, None) is not None:
+        logger.info("Matcher service at %s is back", path)
+    SERVICE_CALLS.inc('ok', amount=len(requests))
+    return results
+
+
+def remote_responses(path: str, queries: List[str]) -> List[Dict]:
+    """Chat responses for the queries, pipelined over one connection"""
+    return [response_from_wire(result) for result in call_service(path, [('match', query) for query in queries])]
+
+
+def remote_exact_response(path: str, query: str) -> Optional[Dict]:
+    (result,) = call_service(path, [('exact', query)])
+    return None if result is None else response_from_wire(result)
+
+
+# ---------------------------------------------------------------- server
+
+
+class MatcherService:
+    """The matcher and FAQ index behind the socket"""
+
+    def __init__(self, refresh_interval: Optional[float] = 1.0):
+        from .ai_matcher import FAQMatcher
+
+        self.matcher = FAQMatcher(service_socket='')
+        # Seconds between checks for FAQ edits; None keeps the first index
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._index = self.matcher.get_faq_index()
+        self._checked_at = time.monotonic()
+
+    def index(self):
+        if self.refresh_interval is None or time.monotonic() - self._checked_at < self.refresh_interval:
+            return self._index
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.refresh_interval:
+                try:
+                    self._index = self.matcher.get_faq_index()
+                except Exception:
+                    logger.exception("Could not check the FAQ table; keeping the current index")
+                self._checked_at = time.monotonic()
+        return self._index
+
+    def handle(self, op: str, argument):
+        index = self.index()
+        if op == 'match':
+            return response_to_wire(self.matcher.get_responses([argument], index=index)[0])
+        if op == 'exact':
+            response = self.matcher.exact_response(argument, index=index)
+            return None if response is None else response_to_wire(response)
+        if op == 'ping':
+            return len(index)
+        raise ValueError(f'unknown op {op!r}')
+
+
+class MatcherRequestHandler(socketserver.StreamRequestHandler):
+    """Answers one client connection's requests, in order, until it disconnects"""
+
+    def handle(self):
+        service = self.server.service
+        while True:
+            try:
+                message = read_frame(self.rfile)
+                if message is None:
+                    return
+                request_id, op, argument = message
+            except (OSError, ValueError, TypeError, msgpack.UnpackException) as error:
+                logger.warning("Dropping matcher client after a bad request: %s", error)
+                return
+
+            try:
+                reply = [request_id, True, service.handle(op, argument)]
+            except Exception as error:
+                logger.exception("Matcher service request %r failed", op)
+                reply = [request_id, False, str(error)]
+
+            try:
+                self.wfile.write(pack_frame(reply))
+            except OSError:
+                return
+
+    def finish(self):
+        super().finish()
+        # Handler threads come and go with client connections
+        connections.close_all()
+
+
+class MatcherServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, service: MatcherService):
+        self.service = service
+        super().__init__(path, MatcherRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
@@ -0,0 +1,375 @@
+"""
+Prometheus-style metrics for the chat hot path.
+
+Counters, gauges and histograms are kept in process memory behind one lock,
+so recording a value costs a dict update. When METRICS_MULTIPROC_DIR is set
+(required with several gunicorn workers), a background thread in each
+process snapshots its values to ``<dir>/<pid>-<token>.json`` every
+METRICS_FLUSH_INTERVAL seconds, and /metrics sums the snapshots of all
+processes. Empty the directory when the server (re)starts, and call
+mark_process_dead() from gunicorn's child_exit hook so gauges of dead
+workers are dropped while their counters are kept.
+"""
+
+import bisect
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class Metric:
+    """Base class: a named metric family with fixed label names."""
+
+    kind = ''
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, documentation: str,
+                 labelnames: Iterable[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Tuple) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(v) for v in labels)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float = 1.0):
+        self.registry._add(self.name, self._key(labels), amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, *labels, amount: float = 1.0):
+        self.registry._add(self.name, self._key(labels), amount)
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.registry._add(self.name, self._key(labels), -amount)
+
+    def set(self, *labels, value: float):
+        self.registry._set(self.name, self._key(labels), value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value: float):
+        self.registry._observe(self, self._key(labels), value)
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the duration of the block in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labels, value=time.perf_counter() - started)
+
+
+class MetricsRegistry:
+    """Holds metric families and this process's values."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Metric] = {}
+        # name -> {labels: value} for counters and gauges,
+        # name -> {labels: [bucket counts..., sum, count]} for histograms
+        self._values: Dict[str, Dict[LabelValues, object]] = {}
+        self._dirty = False
+        self._flusher_pid = None
+        self._snapshot_path = None
+
+    # Registration -----------------------------------------------------------
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            self._values[metric.name] = {}
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    # Recording --------------------------------------------------------------
+
+    def _add(self, name: str, key: LabelValues, amount: float):
+        with self._lock:
+            values = self._values[name]
+            values[key] = values.get(key, 0.0) + amount
+            self._dirty = True
+        self._ensure_flusher()
+
+    def _set(self, name: str, key: LabelValues, value: float):
+        with self._lock:
+            self._values[name][key] = float(value)
+            self._dirty = True
+        self._ensure_flusher()
+
+    def _observe(self, histogram: Histogram, key: LabelValues, value: float):
+        position = bisect.bisect_left(histogram.buckets, value)
+        with self._lock:
+            values = self._values[histogram.name]
+            state = values.get(key)
+            if state is None:
+                state = values[key] = [0] * (len(histogram.buckets) + 2)
+            if position < len(histogram.buckets):
+                state[position] += 1
+            state[-2] += value
+            state[-1] += 1
+            self._dirty = True
+        self._ensure_flusher()
+
+    def snapshot(self) -> Dict:
+        """Copy of this process's values, keyed by metric name."""
+        with self._lock:
+            return {
+                name: {labels: (list(v) if isinstance(v, list) else v) for labels, v in values.items()}
+                for name, values in self._values.items()
+            }
+
+    def reset(self):
+        """Zero all values in this process (for tests)."""
+        with self._lock:
+            for values in self._values.values():
+                values.clear()
+
+    def _after_fork(self):
+        # A forked worker starts from zero with its own snapshot file
+        self._lock = threading.Lock()
+        for values in self._values.values():
+            values.clear()
+        self._dirty = False
+        self._flusher_pid = None
+        self._snapshot_path = None
+
+    # Multiprocess snapshots ---------------------------------------------------
+
+    def _multiproc_dir(self) -> Optional[str]:
+        from django.conf import settings
+
+        return getattr(settings, 'METRICS_MULTIPROC_DIR', '') or None
+
+    def _ensure_flusher(self):
+        # Cheap once started; restarts in a forked child, which loses threads
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        directory = self._multiproc_dir()
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+            self._snapshot_path = None
+        if directory:
+            thread = threading.Thread(target=self._flush_loop, name='metrics-flusher', daemon=True)
+            thread.start()
+
+    def _flush_loop(self):
+        from django.conf import settings
+
+        interval = float(getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0))
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write metrics snapshot: {str(e)}")
+
+    def flush(self):
+        """Write this process's values to the multiprocess directory, if changed."""
+        directory = self._multiproc_dir()
+        if not directory or not self._dirty:
+            return
+        with self._lock:
+            self._dirty = False
+        if self._snapshot_path is None or os.path.dirname(self._snapshot_path) != directory:
+            os.makedirs(directory, exist_ok=True)
+            self._snapshot_path = os.path.join(
+                directory, f"{os.getpid()}-{time.time_ns()}.json"
+            )
+        data = {
+            'gauges': [name for name, m in self._metrics.items() if m.kind == 'gauge'],
+            'values': {
+                name: [[list(labels), value] for labels, value in values.items()]
+                for name, values in self.snapshot().items()
+            },
+        }
+        tmp_path = f"{self._snapshot_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._snapshot_path)
+
+    def _other_process_snapshots(self):
+        directory = self._multiproc_dir()
+        if not directory:
+            return []
+        snapshots = []
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            if path == self._snapshot_path:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def collect(self) -> Dict:
+        """Values summed over this process and every snapshot on disk."""
+        merged = self.snapshot()
+        for data in self._other_process_snapshots():
+            for name, rows in data.get('values', {}).items():
+                if name not in self._metrics:
+                    continue
+                values = merged.setdefault(name, {})
+                for labels, value in rows:
+                    key = tuple(labels)
+                    if isinstance(value, list):
+                        current = values.get(key)
+                        values[key] = value if current is None else [a + b for a, b in zip(current, value)]
+                    else:
+                        values[key] = values.get(key, 0.0) + value
+        return merged
+
+    # Exposition ---------------------------------------------------------------
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        values = self.collect()
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(values.get(name, {}).items()):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets, value):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(pairs + [('le', _number(bound))])} {cumulative}")
+                    lines.append(f"{name}_bucket{_labels(pairs + [('le', '+Inf')])} {value[-1]}")
+                    lines.append(f"{name}_sum{_labels(pairs)} {_number(value[-2])}")
+                    lines.append(f"{name}_count{_labels(pairs)} {value[-1]}")
+                else:
+                    lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value: float) -> str:
+    return repr(float(value))
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ''
+    escaped = (
+        (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pairs
+    )
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+def mark_process_dead(pid: int, directory: Optional[str] = None):
+    """
+    Drop the gauges of a dead worker's snapshot, keeping its counters and
+    histograms so totals do not go backwards. Call from gunicorn's child_exit.
+    """
+    if directory is None:
+        directory = registry._multiproc_dir()
+    if not directory:
+        return
+    for path in glob.glob(os.path.join(directory, f"{pid}-*.json")):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            for name in data.get('gauges', []):
+                data['values'].pop(name, None)
+            data['gauges'] = []
+            with open(path, 'w') as f:
+                json.dump(data, f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to clean up metrics of dead process {pid}: {str(e)}")
+
+
+registry = MetricsRegistry()
+# POSIX only; there are no forked workers on Windows
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry._after_fork)
+
+STAGE_SECONDS = registry.histogram(
+    'chat_stage_seconds',
+    'Time spent in each stage of a chat turn.',
+    ['stage'],
+)
+RESPONSES = registry.counter(
+    'chat_responses_total',
+    'Chat responses by response type.',
+    ['type'],
+)
+CACHE_LOOKUPS = registry.counter(
+    'chat_cache_lookups_total',
+    'Cache lookups by cache and result (hit or miss).',
+    ['cache', 'result'],
+)
+
+
+# Per-request stage totals, set while a request is being timed (Server-Timing)
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time a block of the chat hot path, e.g. ``with stage_timer('db_write'):``."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(stage, value=elapsed)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def collect_stage_timings():
+    """Collect {stage: seconds} for every stage_timer() run inside the block."""
+    stages = {}
+    token = _request_stages.set(stages)
+    try:
+        yield stages
+    finally:
+        _request_stages.reset(token)
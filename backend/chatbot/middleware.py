@@ -0,0 +1,270 @@
+"""
+Middleware for the chat API.
+"""
+
+import cProfile
+import glob
+import gzip
+import json
+import logging
+import os
+import random
+import re
+import time
+import zlib
+from collections import Counter
+from contextlib import ExitStack
+from typing import Optional
+
+import brotli
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+
+from .metrics import collect_stage_timings
+
+logger = logging.getLogger(__name__)
+
+
+class QueryLog:
+    """Database execute wrapper that records every statement and its duration."""
+
+    def __init__(self, keep_statements: bool):
+        self.keep_statements = keep_statements
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if self.keep_statements:
+                self.statements.append((sql, elapsed))
+
+    def summary(self) -> dict:
+        """Count, total time and duplicated statements (same SQL, any params)."""
+        repeats = Counter(sql for sql, _ in self.statements)
+        return {
+            'count': self.count,
+            'time_ms': round(1000 * self.seconds, 3),
+            'duplicates': [
+                {'sql': sql, 'count': n} for sql, n in repeats.most_common() if n > 1
+            ],
+            'statements': [
+                {'sql': sql, 'time_ms': round(1000 * elapsed, 3)} for sql, elapsed in self.statements
+            ],
+        }
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in request profiling for API paths (PROFILING_ENABLED).
+
+    Every API response gets a Server-Timing header with the chat stage
+    timings and the DB query count/time. A sample of requests
+    (PROFILING_SAMPLE_RATE), plus any request sending the
+    X-Profile-Request header with the PROFILING_TOKEN value, also runs
+    under cProfile; the profile and a SQL query log are written to
+    PROFILING_DIR, which keeps only the newest PROFILING_MAX_FILES requests.
+    """
+
+    header = 'X-Profile-Request'
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.path_prefix = getattr(settings, 'PROFILING_PATH_PREFIX', '/api/')
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        self.token = getattr(settings, 'PROFILING_TOKEN', '')
+        self.directory = getattr(settings, 'PROFILING_DIR', '')
+        self.max_files = getattr(settings, 'PROFILING_MAX_FILES', 200)
+
+    def __call__(self, request):
+        if not request.path.startswith(self.path_prefix):
+            return self.get_response(request)
+
+        sampled = self._should_profile(request)
+        query_log = QueryLog(keep_statements=sampled)
+        profiler = cProfile.Profile() if sampled else None
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_log))
+            stages = stack.enter_context(collect_stage_timings())
+            if profiler:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler:
+                    profiler.disable()
+        elapsed = time.perf_counter() - started
+
+        response['Server-Timing'] = self._server_timing(stages, query_log, elapsed)
+
+        if profiler:
+            try:
+                self._write_profile(request, response, profiler, query_log, elapsed)
+            except OSError as e:
+                logger.error(f"Failed to write request profile: {str(e)}")
+
+        return response
+
+    def _should_profile(self, request) -> bool:
+        if self.token and request.headers.get(self.header) == self.token:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @staticmethod
+    def _server_timing(stages, query_log, elapsed) -> str:
+        entries = [f"{stage};dur={1000 * seconds:.2f}" for stage, seconds in stages.items()]
+        entries.append(f'db;dur={1000 * query_log.seconds:.2f};desc="{query_log.count} queries"')
+        entries.append(f"total;dur={1000 * elapsed:.2f}")
+        return ', '.join(entries)
+
+    def _write_profile(self, request, response, profiler, query_log, elapsed):
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^\w]+', '-', request.path).strip('-') or 'root'
+        base = os.path.join(
+            self.directory,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{request.method}-{slug}"
+        )
+
+        profiler.dump_stats(f"{base}.prof")
+        with open(f"{base}.sql.json", 'w') as f:
+            json.dump({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(1000 * elapsed, 3),
+                'queries': query_log.summary(),
+            }, f, indent=2)
+
+        self._rotate()
+
+    def _rotate(self):
+        profiles = sorted(glob.glob(os.path.join(self.directory, '*.prof')))
+        for path in profiles[:max(0, len(profiles) - self.max_files)]:
+            for stale in (path, f"{path[:-len('.prof')]}.sql.json"):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+
+
+# Content codings we can produce, in order of preference when the client
+# accepts several equally
+COMPRESSION_ENCODINGS = ('br', 'gzip')
+
+
+def preferred_encoding(accept_encoding: str) -> Optional[str]:
+    """Best of COMPRESSION_ENCODINGS for an Accept-Encoding header, or None."""
+    qualities = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        match = re.search(r'q\s*=\s*([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+
+    best, best_quality = None, 0.0
+    for coding in COMPRESSION_ENCODINGS:
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Negotiated brotli/gzip compression of JSON responses under
+    RESPONSE_COMPRESSION_PATH_PREFIX.
+
+    Responses smaller than RESPONSE_COMPRESSION_MIN_BYTES (a typical chat
+    reply) are sent as they are: compressing them costs more CPU than it
+    saves on the wire. Streaming responses (e.g. streamed conversation
+    history) are compressed chunk by chunk, flushing after each chunk so the
+    client can start parsing before the last one is produced.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'RESPONSE_COMPRESSION_ENABLED', True):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.path_prefix = getattr(settings, 'RESPONSE_COMPRESSION_PATH_PREFIX', '/api/')
+        self.min_bytes = getattr(settings, 'RESPONSE_COMPRESSION_MIN_BYTES', 1024)
+        self.gzip_level = getattr(settings, 'RESPONSE_COMPRESSION_GZIP_LEVEL', 6)
+        self.brotli_quality = getattr(settings, 'RESPONSE_COMPRESSION_BROTLI_QUALITY', 4)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self._compressible(request, response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = preferred_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self.compress_stream(encoding, response.streaming_content)
+            del response['Content-Length']
+        else:
+            compressed = self.compress(encoding, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # The compressed body is a different representation of the resource
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    def _compressible(self, request, response) -> bool:
+        if not request.path.startswith(self.path_prefix):
+            return False
+        if response.status_code != 200 or response.has_header('Content-Encoding'):
+            return False
+        if not response.get('Content-Type', '').startswith('application/json'):
+            return False
+        return response.streaming or len(response.content) >= self.min_bytes
+
+    def compress(self, encoding: str, data: bytes) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    def compress_stream(self, encoding: str, chunks):
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            for chunk in chunks:
+                data = compressor.process(chunk) + compressor.flush()
+                if data:
+                    yield data
+            yield compressor.finish()
+        else:
+            # wbits 16 + MAX_WBITS writes a gzip header and trailer
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            for chunk in chunks:
+                data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+            yield compressor.flush()
@@ -0,0 +1,83 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faq', '0001_initial'),
+        ('chatbot', '0002_alter_conversation_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FAQRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('period_start', models.DateTimeField()),
+                ('category', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'FAQ Rollup',
+                'verbose_name_plural': 'FAQ Rollups',
+                'db_table': 'faq_rollups',
+                'ordering': ['-period_start', '-count'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResponseRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('period_start', models.DateTimeField()),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('faq', models.PositiveIntegerField(default=0)),
+                ('clarification', models.PositiveIntegerField(default=0)),
+                ('human_handoff_request', models.PositiveIntegerField(default=0)),
+                ('collect_human_details', models.PositiveIntegerField(default=0)),
+                ('other', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Response Rollup',
+                'verbose_name_plural': 'Response Rollups',
+                'db_table': 'response_rollups',
+                'ordering': ['-period_start'],
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='confidence',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='matched_faq',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='matched_messages', to='faq.faq'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='response_type',
+            field=models.CharField(blank=True, db_index=True, max_length=30),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['response_type', 'timestamp'], name='messages_respons_5dd1b8_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='responserollup',
+            constraint=models.UniqueConstraint(fields=('period', 'period_start'), name='unique_response_rollup'),
+        ),
+        migrations.AddField(
+            model_name='faqrollup',
+            name='faq',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rollups', to='faq.faq'),
+        ),
+        migrations.AddConstraint(
+            model_name='faqrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'period_start', 'faq'), name='unique_faq_rollup'),
+        ),
+    ]
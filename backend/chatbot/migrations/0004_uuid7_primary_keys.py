@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:30
+
+import chatbot.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0003_message_match_metadata_and_rollups'),
+    ]
+
+    # The id default only exists in Python: existing rows keep their uuid4
+    # ids and new rows get uuid7 ids. State-only, so SQLite does not rebuild
+    # the tables (and every index on messages) for a default change.
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='conversation',
+                    name='id',
+                    field=models.UUIDField(default=chatbot.ids.uuid7, editable=False, primary_key=True, serialize=False),
+                ),
+                migrations.AlterField(
+                    model_name='humanhandoffrequest',
+                    name='id',
+                    field=models.UUIDField(default=chatbot.ids.uuid7, editable=False, primary_key=True, serialize=False),
+                ),
+                migrations.AlterField(
+                    model_name='message',
+                    name='id',
+                    field=models.UUIDField(default=chatbot.ids.uuid7, editable=False, primary_key=True, serialize=False),
+                ),
+            ],
+        ),
+    ]
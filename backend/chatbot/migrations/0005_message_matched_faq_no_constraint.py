@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faq', '0001_initial'),
+        ('chatbot', '0004_uuid7_primary_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='matched_faq',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='matched_messages', to='faq.faq'),
+        ),
+    ]
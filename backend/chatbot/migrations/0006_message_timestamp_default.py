@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0005_message_matched_faq_no_constraint'),
+    ]
+
+    # Neither auto_now_add nor a Python default is stored in the database;
+    # without this, SQLite would rebuild the messages table to "alter" it
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='message',
+                    name='timestamp',
+                    field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+                ),
+            ],
+        ),
+    ]
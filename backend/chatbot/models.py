@@ -1,8 +1,10 @@
-import uuid
 from django.db import models
+from django.utils import timezone
+
+from .ids import uuid7
 
 class Conversation(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     session_id = models.CharField(max_length=100, unique=True, db_index=True)
     language = models.CharField(max_length=10, default='en')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -22,11 +24,19 @@ class Conversation(models.Model):
         return self.messages.count()
 
 class Message(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     content = models.TextField()
     is_user = models.BooleanField(default=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # A default rather than auto_now_add, so that messages written in a
+    # batch (WebSocket chat) keep the time they were sent
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    # Match metadata, set on AI messages only. No database constraint: with
+    # sharding, messages and FAQs live in different databases
+    matched_faq = models.ForeignKey('faq.FAQ', null=True, blank=True, on_delete=models.SET_NULL,
+                                    related_name='matched_messages', db_constraint=False)
+    response_type = models.CharField(max_length=30, blank=True, db_index=True)
+    confidence = models.FloatField(null=True, blank=True)
 
     class Meta:
         db_table = 'messages'
@@ -35,6 +45,7 @@ class Message(models.Model):
         verbose_name_plural = 'Messages'
         indexes = [
             models.Index(fields=['conversation', 'timestamp']),
+            models.Index(fields=['response_type', 'timestamp']),
         ]
     
     def __str__(self):
@@ -43,7 +54,7 @@ class Message(models.Model):
         return f"{sender}: {preview}"
 
 class HumanHandoffRequest(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
     phone = models.CharField(max_length=20)
@@ -63,3 +74,80 @@ class HumanHandoffRequest(models.Model):
     
     def __str__(self):
         return f"Handoff: {self.name} ({self.status})"
+
+class ResponseRollup(models.Model):
+    """AI response counts per hour/day, incremented as responses are sent (see analytics.py)"""
+    PERIOD_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day')
+    ]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    period_start = models.DateTimeField()
+    total = models.PositiveIntegerField(default=0)
+    faq = models.PositiveIntegerField(default=0)
+    clarification = models.PositiveIntegerField(default=0)
+    human_handoff_request = models.PositiveIntegerField(default=0)
+    collect_human_details = models.PositiveIntegerField(default=0)
+    other = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'response_rollups'
+        ordering = ['-period_start']
+        verbose_name = 'Response Rollup'
+        verbose_name_plural = 'Response Rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'period_start'], name='unique_response_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.period_start:%Y-%m-%d %H:00}: {self.total} responses"
+
+    @property
+    def unmatched_rate(self):
+        """Share of responses where no FAQ matched and a human agent was offered"""
+        return self.human_handoff_request / self.total if self.total else 0.0
+
+
+class FAQRollup(models.Model):
+    """Matched-FAQ counts per hour/day; category is the FAQ's category when matched"""
+    period = models.CharField(max_length=4, choices=ResponseRollup.PERIOD_CHOICES)
+    period_start = models.DateTimeField()
+    faq = models.ForeignKey('faq.FAQ', null=True, on_delete=models.SET_NULL, related_name='rollups')
+    category = models.CharField(max_length=100, blank=True, db_index=True)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'faq_rollups'
+        ordering = ['-period_start', '-count']
+        verbose_name = 'FAQ Rollup'
+        verbose_name_plural = 'FAQ Rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'period_start', 'faq'], name='unique_faq_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.period} {self.period_start:%Y-%m-%d %H:00}: {self.faq_id} x{self.count}"
+
+
+class IdempotencyRecord(models.Model):
+    """A claimed Idempotency-Key and, once answered, its response (see idempotency.py)"""
+    scope = models.CharField(max_length=32)
+    # sha256 of the client's key, which may be up to 255 characters of anything
+    key_hash = models.CharField(max_length=64)
+    fingerprint = models.CharField(max_length=64)
+    # Null while the request that claimed the key is running
+    status_code = models.PositiveSmallIntegerField(null=True)
+    data = models.JSONField(null=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'idempotency_records'
+        verbose_name = 'Idempotency Record'
+        verbose_name_plural = 'Idempotency Records'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key_hash'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key_hash[:12]}: {self.status_code or 'in progress'}"
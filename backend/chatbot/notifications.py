@@ -7,6 +7,8 @@ import os
 from typing import Optional
 import logging
 
+from .metrics import stage_timer
+
 logger = logging.getLogger(__name__)
 
 
@@ -24,6 +26,11 @@ class NotificationService:
         Returns:
             bool: True if notification sent successfully, False otherwise
         """
+        with stage_timer('notification'):
+            return NotificationService._send_agent_notification(handoff_request)
+    
+    @staticmethod
+    def _send_agent_notification(handoff_request) -> bool:
         try:
             # Get admin email from settings (configure via env var ADMIN_EMAIL)
             admin_email = os.getenv('ADMIN_EMAIL', '')
@@ -0,0 +1,94 @@
+"""
+orjson-backed JSON rendering for the API.
+
+ORJSONRenderer replaces DRF's JSONRenderer (see REST_FRAMEWORK in
+settings). Output parses to the same JSON: compact UTF-8 and UTC
+datetimes with a trailing Z. Values DRF's encoder understands but orjson
+does not (Decimal, lazy strings, ...) are handed to DRF's encoder. Unlike
+DRF, U+2028/U+2029 are only escaped in JSONText (once per FAQ): scanning
+every response for them cost more than encoding it, and JSON.parse
+accepts them.
+
+FAQ answers, questions and categories are static between FAQ edits, so
+faq_json_texts() wraps them in JSONText: a str that carries its own JSON
+encoding, which the renderer splices into the response instead of
+escaping the text again on every request.
+"""
+
+from typing import Dict
+
+import orjson
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_drf_encoder = JSONEncoder()
+
+
+class JSONText(str):
+    """A str with its JSON encoding built once (``fragment``)"""
+
+    def __new__(cls, value: str):
+        text = super().__new__(cls, value)
+        encoded = orjson.dumps(str(value))
+        # Escaped as DRF's JSONRenderer does, so the text is also valid JavaScript
+        encoded = encoded.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        text.fragment = orjson.Fragment(encoded)
+        return text
+
+    def __reduce__(self):
+        # Pickles (e.g. from classify_queries workers) as a plain str
+        return (str, (str(self),))
+
+
+def faq_json_texts(faq) -> Dict[str, JSONText]:
+    """
+    The FAQ's answer, question, category and clarification text as
+    JSONText. Cached on the FAQ instance, which the matcher's FAQ index
+    replaces when FAQs change, so each FAQ version is encoded once.
+    """
+    texts = faq.__dict__.get('_json_texts')
+    if texts is None:
+        texts = faq._json_texts = {
+            'answer': JSONText(faq.answer),
+            'question': JSONText(faq.question),
+            'category': JSONText(faq.category),
+            'clarification': JSONText(f"I think you're asking about: {faq.question}\n\n{faq.answer}"),
+        }
+    return texts
+
+
+def _default(obj):
+    if isinstance(obj, JSONText):
+        return obj.fragment
+    # OPT_PASSTHROUGH_SUBCLASS sends every subclass here (ErrorDetail,
+    # ReturnDict, ReturnList, ...), not only JSONText
+    if isinstance(obj, str):
+        return str(obj)
+    if isinstance(obj, dict):
+        return dict(obj)
+    if isinstance(obj, list):
+        return list(obj)
+    if isinstance(obj, int):
+        return int(obj)
+    return _drf_encoder.default(obj)
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    # OPT_NON_STR_KEYS: json.dumps turns int keys (e.g. serializer errors
+    # for list items) into strings, orjson refuses them without it
+    options = orjson.OPT_PASSTHROUGH_SUBCLASS | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        options = self.options
+        # The browsable API asks for indented JSON; orjson only indents by 2
+        if (renderer_context or {}).get('indent') or 'indent=' in (accepted_media_type or ''):
+            options |= orjson.OPT_INDENT_2
+
+        return orjson.dumps(data, default=_default, option=options)
@@ -0,0 +1,180 @@
+"""
+Session lookup cache for the chat endpoints.
+
+Maps a session_id to its conversation id, when last_active was last
+written, and whether the last AI message offered a human agent. A hot
+session then skips Conversation.get_or_create() and the full save() on
+every turn; last_active is written at most once per
+LAST_ACTIVE_WRITE_INTERVAL seconds.
+
+Each process keeps a bounded LRU (SESSION_CACHE_MAX_ENTRIES) by default.
+Set SESSION_CACHE_BACKEND to the alias of a Django cache shared by all
+workers (e.g. Redis) to keep the state there instead. Only then is the
+human-agent flag trusted to skip the recent-messages query: with
+per-process caches another worker may have answered the previous turn.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import router, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .metrics import CACHE_LOOKUPS
+from .models import Conversation
+
+
+class SessionState:
+    """What the chat view needs to know about a session between turns"""
+
+    __slots__ = ('conversation_id', 'last_active_written', 'offered_human_agent')
+
+    def __init__(self, conversation_id, last_active_written, offered_human_agent: Optional[bool] = None):
+        self.conversation_id = conversation_id
+        self.last_active_written = last_active_written
+        # None until this cache has seen an AI response for the session
+        self.offered_human_agent = offered_human_agent
+
+
+class SessionCache:
+    """Bounded per-process LRU of SessionState, or a shared Django cache"""
+
+    key_prefix = 'chat-session:'
+
+    def __init__(self, max_entries: int = 10000, backend=None, timeout: Optional[int] = 3600):
+        self.max_entries = max_entries
+        self.backend = backend
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self) -> bool:
+        return self.backend is not None
+
+    def _key(self, session_id: str) -> str:
+        # Hashed so any session_id is a valid key for every cache backend
+        return self.key_prefix + hashlib.md5(session_id.encode('utf-8')).hexdigest()
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        if self.backend is not None:
+            return self.backend.get(self._key(session_id))
+        with self._lock:
+            state = self._entries.get(session_id)
+            if state is not None:
+                self._entries.move_to_end(session_id)
+            return state
+
+    def set(self, session_id: str, state: SessionState):
+        if self.backend is not None:
+            self.backend.set(self._key(session_id), state, self.timeout)
+            return
+        with self._lock:
+            self._entries[session_id] = state
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, session_id: str):
+        if self.backend is not None:
+            self.backend.delete(self._key(session_id))
+            return
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def clear(self):
+        """Drop this process's entries (shared backends are left alone)."""
+        with self._lock:
+            self._entries.clear()
+
+
+_session_cache = None
+_session_cache_lock = threading.Lock()
+
+
+def get_session_cache() -> SessionCache:
+    """The process-wide SessionCache, built from settings on first use"""
+    global _session_cache
+    if _session_cache is None:
+        with _session_cache_lock:
+            if _session_cache is None:
+                alias = getattr(settings, 'SESSION_CACHE_BACKEND', '')
+                _session_cache = SessionCache(
+                    max_entries=getattr(settings, 'SESSION_CACHE_MAX_ENTRIES', 10000),
+                    backend=caches[alias] if alias else None,
+                    timeout=getattr(settings, 'SESSION_CACHE_TIMEOUT', 3600),
+                )
+    return _session_cache
+
+
+@receiver(setting_changed)
+def _reset_session_cache(setting, **kwargs):
+    global _session_cache
+    if setting.startswith('SESSION_CACHE_'):
+        _session_cache = None
+
+
+@receiver(post_delete, sender=Conversation)
+def _forget_deleted_conversation(sender, instance, **kwargs):
+    get_session_cache().delete(instance.session_id)
+
+
+def _store(session_id: str, state: SessionState):
+    # Only cache what is committed: a rolled-back conversation must not be cached
+    transaction.on_commit(lambda: get_session_cache().set(session_id, state),
+                          using=router.db_for_write(Conversation))
+
+
+def conversation_state(session_id: str, language: str) -> SessionState:
+    """
+    Look up (or create) the conversation for a chat turn and mark it active.
+    Replaces get_or_create() + save() on every turn with a cache lookup and
+    an occasional last_active update.
+    """
+    cache = get_session_cache()
+    now = timezone.now()
+    state = cache.get(session_id)
+
+    if state is None:
+        CACHE_LOOKUPS.inc('session', 'miss')
+        conversation, created = Conversation.objects.get_or_create(
+            session_id=session_id,
+            defaults={'language': language}
+        )
+        if not created:
+            Conversation.objects.filter(pk=conversation.pk).update(last_active=now)
+        state = SessionState(conversation.pk, now)
+        _store(session_id, state)
+        return state
+
+    CACHE_LOOKUPS.inc('session', 'hit')
+    interval = getattr(settings, 'LAST_ACTIVE_WRITE_INTERVAL', 60)
+    if (now - state.last_active_written).total_seconds() >= interval:
+        Conversation.objects.filter(pk=state.conversation_id).update(last_active=now)
+        state.last_active_written = now
+        _store(session_id, state)
+    return state
+
+
+def known_human_agent_offer(state: SessionState) -> Optional[bool]:
+    """Whether the previous AI message offered a human agent, or None if not known reliably"""
+    if not get_session_cache().shared:
+        return None
+    return state.offered_human_agent
+
+
+def remember_response(session_id: str, state: SessionState, ai_response: dict):
+    """Record whether this turn's AI response offered a human agent"""
+    state.offered_human_agent = 'human agent' in ai_response['response'].lower()
+    _store(session_id, state)
+
+
+def forget_session(session_id: str):
+    get_session_cache().delete(session_id)
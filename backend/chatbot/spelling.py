@@ -0,0 +1,133 @@
+"""
+Spelling correction for queries, from the FAQ vocabulary.
+
+A misspelled word ("registraton", "astrologr") matches no FAQ exactly and
+drags the whole query through full fuzzy scoring, often into a handoff.
+SpellingIndex corrects query words to words that appear in FAQ questions
+or keywords, with the symmetric delete method (SymSpell): every vocabulary
+word is stored under each string obtained by deleting up to
+MAX_EDIT_DISTANCE characters from its first PREFIX_LENGTH characters. A
+query word then only needs its own deletes looked up, a fixed number of
+dictionary probes, and the candidates found are checked with the real edit
+distance (optimal string alignment, so "brith" is one edit from "birth"). The closest candidate wins, then the most frequent one.
+
+The vocabulary is small, so plenty of correctly spelled words are one edit
+away from an FAQ word ("find" / "fund"). Words that also occur in FAQ
+answers are therefore left alone, short words are never corrected, words
+under 9 letters only by one edit, and a correction must keep the first
+letter, which misspellings rarely change.
+
+The index belongs to an FAQIndex and is updated from the previous one when
+FAQs change, re-deriving deletes only for words that appeared or vanished.
+"""
+
+from collections import Counter
+from itertools import combinations
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+from rapidfuzz.distance import OSA
+
+MAX_EDIT_DISTANCE = 2
+# Words shorter than this get one edit at most
+LONG_WORD_LENGTH = 9
+# Only the start of a word is expanded into deletes, which keeps the
+# index small for long words; the full words are compared afterwards
+PREFIX_LENGTH = 7
+# Shorter words are too easily "corrected" into a different word
+MIN_WORD_LENGTH = 5
+
+
+def max_distance_for(word: str) -> int:
+    """Edits allowed when correcting ``word``: one for short words, else MAX_EDIT_DISTANCE"""
+    return 1 if len(word) < LONG_WORD_LENGTH else MAX_EDIT_DISTANCE
+
+
+def deletes(word: str, max_distance: int = MAX_EDIT_DISTANCE) -> set:
+    """``word``'s prefix with up to ``max_distance`` characters deleted (including none)"""
+    prefix = word[:PREFIX_LENGTH]
+    variants = {prefix}
+    for removed in range(1, min(max_distance, len(prefix) - 1) + 1):
+        for positions in combinations(range(len(prefix)), removed):
+            variants.add(''.join(c for i, c in enumerate(prefix) if i not in positions))
+    return variants
+
+
+class SpellingIndex:
+    """Vocabulary word counts, other known words and the symmetric-delete lookup table"""
+
+    def __init__(self, vocabulary: Optional[Dict[str, int]] = None,
+                 lookup: Optional[Dict[str, Tuple[str, ...]]] = None,
+                 known: FrozenSet[str] = frozenset()):
+        self.vocabulary: Dict[str, int] = vocabulary if vocabulary is not None else {}
+        self.lookup: Dict[str, Tuple[str, ...]] = lookup if lookup is not None else {}
+        # Correctly spelled words that are not correction targets
+        self.known = known
+
+    @classmethod
+    def build(cls, words: Iterable[str], known_words: Iterable[str] = ()) -> 'SpellingIndex':
+        index = cls(known=frozenset(known_words))
+        counts = Counter(words)
+        index.vocabulary.update(counts)
+        for word in counts:
+            index._add_deletes(word)
+        return index
+
+    def updated(self, words: Iterable[str], known_words: Iterable[str] = ()) -> 'SpellingIndex':
+        """
+        Index for a new vocabulary, sharing everything that did not change.
+        Copy-on-write: this index may still be serving queries.
+        """
+        counts = Counter(words)
+        updated = SpellingIndex(dict(counts), dict(self.lookup), frozenset(known_words))
+        for word in self.vocabulary.keys() - counts.keys():
+            updated._remove_deletes(word)
+        for word in counts.keys() - self.vocabulary.keys():
+            updated._add_deletes(word)
+        return updated
+
+    def _add_deletes(self, word: str):
+        for variant in deletes(word):
+            self.lookup[variant] = self.lookup.get(variant, ()) + (word,)
+
+    def _remove_deletes(self, word: str):
+        for variant in deletes(word):
+            remaining = tuple(w for w in self.lookup.get(variant, ()) if w != word)
+            if remaining:
+                self.lookup[variant] = remaining
+            else:
+                self.lookup.pop(variant, None)
+
+    def __len__(self):
+        return len(self.vocabulary)
+
+    def correct_word(self, word: str) -> str:
+        """Closest vocabulary word to ``word``, or ``word`` itself if none is close enough"""
+        if (word in self.vocabulary or word in self.known
+                or len(word) < MIN_WORD_LENGTH or not word.isalpha()):
+            return word
+
+        max_distance = max_distance_for(word)
+        best, best_distance, best_count = word, max_distance + 1, 0
+        seen = set()
+        for variant in deletes(word, max_distance):
+            for candidate in self.lookup.get(variant, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if candidate[0] != word[0] or abs(len(candidate) - len(word)) > max_distance:
+                    continue
+                candidate_distance = OSA.distance(word, candidate, score_cutoff=max_distance)
+                if candidate_distance > max_distance:
+                    continue
+                count = self.vocabulary[candidate]
+                if (candidate_distance, -count, candidate) < (best_distance, -best_count, best):
+                    best, best_distance, best_count = candidate, candidate_distance, count
+        return best
+
+    def correct(self, text: str) -> str:
+        """Correct every word of preprocessed ``text``"""
+        if not self.vocabulary:
+            return text
+        words = text.split(' ')
+        corrected = [self.correct_word(word) for word in words]
+        return text if corrected == words else ' '.join(corrected)
@@ -0,0 +1,212 @@
+"""
+SQLite tuning for single-box deployments.
+
+The default SQLite setup (rollback journal, no busy timeout) fails with
+"database is locked" as soon as two gunicorn workers write at once. With
+SQLITE_TUNING enabled every new SQLite connection gets:
+
+* journal_mode=WAL, so readers never block the writer and vice versa
+* busy_timeout, so a writer waits for the lock instead of failing
+* synchronous=NORMAL, which is durable across application crashes in WAL
+  mode and skips an fsync per commit
+* mmap_size and cache_size for the read side
+
+SQLite still allows one writer at a time. SQLITE_SINGLE_WRITER sends the
+chat-turn writes of a process through one writer thread per database,
+which commits whatever has queued up in a single transaction (one
+savepoint per write, so a failing write only rolls back itself). Threads
+in a worker then never compete for the write lock, and workers only wait
+on each other's short group commits: each transaction takes the write
+lock as it begins, so that wait honours busy_timeout. Both settings are
+off by default and only apply to SQLite connections: run_write() leaves
+writes to any other database inline.
+"""
+
+import contextvars
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from astrotamil_api.sharding import current_shard
+
+logger = logging.getLogger(__name__)
+
+
+def sqlite_pragmas() -> dict:
+    """PRAGMA name -> value applied to each new SQLite connection"""
+    return {
+        'journal_mode': 'WAL',
+        'busy_timeout': getattr(settings, 'SQLITE_BUSY_TIMEOUT_MS', 5000),
+        'synchronous': 'NORMAL',
+        'mmap_size': getattr(settings, 'SQLITE_MMAP_SIZE', 268435456),
+        'cache_size': getattr(settings, 'SQLITE_CACHE_SIZE', -65536),
+        'temp_store': 'MEMORY',
+    }
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or not getattr(settings, 'SQLITE_TUNING', False):
+        return
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas().items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+@contextmanager
+def immediate_atomic(using: str = DEFAULT_DB_ALIAS):
+    """
+    transaction.atomic() that takes SQLite's write lock when it begins
+    (BEGIN IMMEDIATE). A plain BEGIN that reads before it writes, as
+    get_or_create() does, fails with "database is locked" right away when
+    another process is writing: SQLite does not apply busy_timeout to that
+    lock upgrade. Waiting for the lock up front does honour it.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+    # Django starts SQLite transactions with this method; only this
+    # thread's connection is patched, and only for this block
+    connection._start_transaction_under_autocommit = lambda: connection.cursor().execute('BEGIN IMMEDIATE')
+    try:
+        with transaction.atomic(using=using):
+            connection.__dict__.pop('_start_transaction_under_autocommit', None)
+            yield
+    finally:
+        connection.__dict__.pop('_start_transaction_under_autocommit', None)
+
+
+class SingleWriter:
+    """
+    One thread that runs every submitted write against ``using``, batching
+    whatever is queued (up to ``max_batch`` writes) into one transaction.
+    """
+
+    def __init__(self, using: str = 'default', max_batch: int = 64):
+        self.using = using
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` on the writer thread and return (or raise) its result."""
+        if threading.current_thread() is self._thread:
+            return fn(*args, **kwargs)
+        future = Future()
+        # Run in the caller's context, e.g. its use_shard() routing
+        context = contextvars.copy_context()
+        self._queue.put((future, context.run, (fn,) + args, kwargs))
+        self._ensure_started()
+        return future.result()
+
+    def stop(self):
+        """Finish the queued writes and stop the thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        stopping = False
+        try:
+            while not stopping:
+                jobs = [self._queue.get()]
+                while len(jobs) < self.max_batch:
+                    try:
+                        jobs.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in jobs:
+                    stopping = True
+                    jobs = [job for job in jobs if job is not None]
+                if jobs:
+                    self._run_batch(jobs)
+        finally:
+            connections.close_all()
+
+    def _run_batch(self, jobs):
+        # Like a request: drop connections that are too old or unusable
+        close_old_connections()
+        outcomes = []
+        try:
+            # Wait (up to busy_timeout) for other processes' writers
+            with immediate_atomic(using=self.using):
+                for future, fn, args, kwargs in jobs:
+                    try:
+                        with transaction.atomic(using=self.using):
+                            outcomes.append((future, fn(*args, **kwargs), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+        except Exception as e:
+            logger.error(f"SQLite writer batch failed: {str(e)}")
+            for future, _, _, _ in jobs:
+                future.set_exception(e)
+            return
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_writers = {}
+_writer_lock = threading.Lock()
+
+
+def get_writer(using: str = DEFAULT_DB_ALIAS) -> SingleWriter:
+    """The writer for the SQLite database ``using`` (one per database, so each shard has its own)"""
+    if connections[using].vendor != 'sqlite':
+        raise ValueError(f"The single writer is for SQLite databases only, not {using!r}")
+    writer = _writers.get(using)
+    if writer is None:
+        with _writer_lock:
+            writer = _writers.get(using)
+            if writer is None:
+                writer = _writers[using] = SingleWriter(
+                    using=using, max_batch=getattr(settings, 'SQLITE_WRITER_MAX_BATCH', 64)
+                )
+    return writer
+
+
+@receiver(setting_changed)
+def _reset_writer(setting, **kwargs):
+    if setting.startswith('SQLITE_') or setting == 'DATABASE_SHARDS':
+        with _writer_lock:
+            writers = list(_writers.values())
+            _writers.clear()
+        for writer in writers:
+            writer.stop()
+
+
+def run_write(fn, *args, **kwargs):
+    """
+    Run a chat-turn write: on the single writer thread when
+    SQLITE_SINGLE_WRITER is on and the database is SQLite, otherwise
+    inline. ``fn`` must not rely on a transaction opened by the caller.
+    """
+    if not getattr(settings, 'SQLITE_SINGLE_WRITER', False):
+        return fn(*args, **kwargs)
+    using = current_shard() or DEFAULT_DB_ALIAS
+    if connections[using].vendor != 'sqlite':
+        # Other databases take concurrent writers; batching would only add latency
+        return fn(*args, **kwargs)
+    return get_writer(using).submit(fn, *args, **kwargs)
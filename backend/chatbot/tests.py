@@ -3,15 +3,58 @@ Unit tests for chatbot application.
 Tests FAQMatcher algorithm, API views, and model interactions.
 """
 
-from django.test import TestCase, Client
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.serializer_helpers import ReturnDict
+from datetime import datetime, timezone as dt_timezone
+from unittest import mock, skipUnless
+import asyncio
+import brotli
+import gzip
+import io
 import json
+import os
+import pickle
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
 
-from .models import Conversation, Message, HumanHandoffRequest
-from .ai_matcher import FAQMatcher
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+
+from astrotamil_api.asgi import application
+from astrotamil_api.routers import REPLICA_ALIAS, ReplicaRouter, use_replica
+from astrotamil_api.sharding import jump_hash, shard_for, use_shard
+from .models import Conversation, Message, HumanHandoffRequest, IdempotencyRecord, ResponseRollup, FAQRollup
+from .admission import ConcurrencyLimiter, TokenBucketLimiter, get_concurrency_limiter
+from .analytics import _buffer as rollup_buffer, flush_rollups, rebuild_rollups
+from .ids import uuid7, uuid7_timestamp_ms
+from .idempotency import IdempotencyConflict, IdempotencyStore, get_idempotency_store
+from .session_cache import get_session_cache
+from .sqlite_tuning import SingleWriter, get_writer, run_write
+from .ai_matcher import FAQIndex, FAQMatcher, TokenProfile
+from .transliteration import transliterate
+from .warmup import warm_up
+from .matcher_service import MatcherClient, MatcherServer, MatcherService, pack_frame, read_frame
+from .consumers import ChatConsumer
+from .views import ConversationHistoryView
+from .metrics import RESPONSES, registry
+from .middleware import preferred_encoding
+from .renderers import ORJSONRenderer, faq_json_texts
 from faq.models import FAQ
 
 
@@ -103,6 +146,194 @@ class FAQMatcherTestCase(TestCase):
         
         # Should still return a response but with low confidence
         self.assertIn('response', response)
+    
+    def test_similarity_bound_is_upper_bound(self):
+        """Test that the cheap bound never undershoots the real similarity."""
+        index = self.matcher.get_faq_index()
+        queries = [
+            "What is astrology?",
+            "astrology",
+            "How do I get a birth chart?",
+            "Tell me about pizza and cooking recipes",
+            "reading chart birth",
+        ]
+        for query in queries:
+            query_text = self.matcher.preprocess_text(self.matcher.preprocess_text(query))
+            profile = TokenProfile(query_text)
+            for entry in index.entries:
+                bound = self.matcher.text_similarity_bound(profile, entry)
+                actual = self.matcher.calculate_similarity(query_text, entry.faq.question)
+                self.assertGreaterEqual(bound, actual)
+    
+    def test_upper_bounds_do_not_change_best_match(self):
+        """Test that pruning skips work without changing the answer."""
+        queries = [
+            "What is astrology?",
+            "How do I get a birth chart reading?",
+            "birth chart reading booking",
+            "Tell me about pizza and cooking recipes",
+        ]
+        for query in queries:
+            self.matcher.use_upper_bounds = False
+            exhaustive = self.matcher.find_best_match(query)
+            self.assertEqual(self.matcher.last_match_stats['pruned'], 0)
+            
+            self.matcher.use_upper_bounds = True
+            pruned = self.matcher.find_best_match(query)
+            
+            if exhaustive is None:
+                self.assertIsNone(pruned)
+            else:
+                self.assertEqual(pruned['faq'].pk, exhaustive['faq'].pk)
+                self.assertEqual(pruned['score'], exhaustive['score'])
+        
+        self.matcher.find_best_match("Tell me about pizza and cooking recipes")
+        self.assertEqual(self.matcher.last_match_stats['scored'], 0)
+    
+    def test_find_top_matches_ranked(self):
+        """Test that top matches are ranked best first and agree with the best match."""
+        matches = self.matcher.find_top_matches("How do I get a birth chart reading?", limit=2)
+        
+        self.assertEqual(len(matches), 2)
+        self.assertGreaterEqual(matches[0]['score'], matches[1]['score'])
+        best = self.matcher.find_best_match("How do I get a birth chart reading?")
+        self.assertEqual(matches[0]['faq'].pk, best['faq'].pk)
+    
+    def test_faq_index_rebuilt_after_faq_change(self):
+        """Test that the cached FAQ index picks up new FAQs."""
+        index = self.matcher.get_faq_index()
+        self.assertIs(self.matcher.get_faq_index(), index)
+        
+        FAQ.objects.create(
+            question="Do you offer palmistry?",
+            answer="Yes, palmistry sessions are available.",
+            keywords=['palmistry'],
+            category='Services'
+        )
+        
+        self.assertEqual(len(self.matcher.get_faq_index()), len(index) + 1)
+    
+    def test_misspelled_query_corrected(self):
+        """Test that misspelled words are corrected to FAQ vocabulary before matching."""
+        index = self.matcher.get_faq_index()
+        
+        self.assertEqual(
+            self.matcher.correct_spelling("how do i get a brith chart readng", index),
+            "how do i get a birth chart reading"
+        )
+        # Answer words are spelled right even if close to a question word
+        self.assertEqual(self.matcher.correct_spelling("celestial bodies", index), "celestial bodies")
+        self.assertEqual(self.matcher.exact_response("What is astrolgy?")['type'], 'faq')
+        
+        self.matcher.use_spelling_correction = False
+        self.assertIsNone(self.matcher.exact_response("What is astrolgy?"))
+    
+    def test_spelling_index_updated_incrementally(self):
+        """Test that an FAQ change updates the spelling index like a full rebuild."""
+        index = self.matcher.get_faq_index()
+        FAQ.objects.filter(question="What is astrology?").update(question="What is numerology?")
+        FAQ.objects.create(
+            question="Do you offer palmistry?",
+            answer="Yes, palmistry sessions are available.",
+            keywords=['palmistry'],
+            category='Services'
+        )
+        
+        updated = self.matcher.get_faq_index()
+        rebuilt = FAQIndex.build(self.matcher, FAQ.objects.all())
+        self.assertIsNot(updated.spelling, index.spelling)
+        self.assertEqual(updated.spelling.vocabulary, rebuilt.spelling.vocabulary)
+        self.assertEqual(
+            {variant: sorted(words) for variant, words in updated.spelling.lookup.items()},
+            {variant: sorted(words) for variant, words in rebuilt.spelling.lookup.items()}
+        )
+        self.assertEqual(updated.spelling.correct_word("palmestry"), "palmistry")
+        self.assertEqual(updated.spelling.correct_word("numerolgy"), "numerology")
+        self.assertEqual(index.spelling.correct_word("numerolgy"), "numerolgy")
+    
+    def test_transliterate_tanglish_and_tamil(self):
+        """Test that Tanglish and Tamil-script words become FAQ vocabulary and English is untouched."""
+        self.assertEqual(transliterate("Jadhagam download panna mudiyuma?"), "horoscope download  can?")
+        self.assertEqual(transliterate("jathagathula"), "horoscope")
+        self.assertEqual(transliterate("ஜாதகத்தை பதிவிறக்கம் செய்யலாமா"), "horoscope download ")
+        self.assertEqual(transliterate("How do I get a birth chart reading?"), "how do i get a birth chart reading?")
+        self.assertEqual(transliterate("Is it cheaper than a vacation?"), "is it cheaper than a vacation?")
+    
+    def test_transliterate_leaves_english_lookalikes(self):
+        """Test that English words starting with a Tanglish stem, or spelled like one, pass through."""
+        for text in ("tankard", "katana", "Kovilpatti", "yen", "aka", "le", "la", "La Jolla", "downloads"):
+            self.assertEqual(transliterate(text), text.lower())
+        self.assertEqual(transliterate("kovilukku thangathai"), "temple gold")
+        self.assertEqual(transliterate("jothidar aaga sambathikka"), "astrologer  earn")
+    
+    def test_tanglish_query_matched(self):
+        """Test that a Tanglish query reaches the FAQ it asks about."""
+        FAQ.objects.create(
+            question="Can I download my horoscope?",
+            answer="Yes, from the Reports tab.",
+            keywords=['horoscope', 'download'],
+            category='Services'
+        )
+        response = self.matcher.get_response("jathagam download panna mudiyuma?")
+        self.assertEqual(response['type'], 'faq')
+        self.assertEqual(response['question'], "Can I download my horoscope?")
+        
+        self.matcher.use_transliteration = False
+        self.assertNotEqual(self.matcher.get_response("jathagam download panna mudiyuma?")['type'], 'faq')
+    
+    def test_batch_scoring_matches_serial(self):
+        """Test that rapidfuzz-bounded batch scoring ranks exactly like serial scoring."""
+        for i in range(10):
+            FAQ.objects.create(
+                question=f"How do I get a birth chart reading, option {i}?",
+                answer="You can book a reading through our website.",
+                keywords=['birth', 'chart', 'reading'],
+                category='Services'
+            )
+        FAQ.objects.create(question="ஜாதகம்?", answer="Tamil only.", keywords=[], category='Basic')
+        index = self.matcher.get_faq_index()
+        batch = FAQMatcher()
+        batch.scoring_workers = 3
+        batch.parallel_min_faqs = 0
+        
+        for query in ("How do I get a birth chart reading?", "What is astrology?",
+                      "Tell me about pizza", "ஜாதகம்", "birth chart option 7"):
+            serial_matches = self.matcher.find_top_matches(query, limit=5, index=index)
+            batch_matches = batch.find_top_matches(query, limit=5, index=index)
+            self.assertEqual(
+                [(m['faq'].pk, m['score']) for m in batch_matches],
+                [(m['faq'].pk, m['score']) for m in serial_matches]
+            )
+        batch.find_top_matches("How do I get a birth chart reading?", limit=1, index=index)
+        self.assertLess(batch.last_match_stats['scored'], len(index))
+    
+    def test_small_corpus_scored_serially(self):
+        """Test that corpora below the cut-over are not batch scored."""
+        with mock.patch('chatbot.ai_matcher.rapid_process.cdist') as cdist:
+            self.assertIsNotNone(self.matcher.find_best_match("What is astrology?"))
+        cdist.assert_not_called()
+
+
+class WarmUpTestCase(TestCase):
+    """Test the pre-fork warm start used by gunicorn's preloaded master."""
+    
+    def setUp(self):
+        FAQ.objects.create(
+            question="How do I register as an astrologer?",
+            answer="Sign up in the app.",
+            keywords=['register', 'astrologer'],
+            category='Registration'
+        )
+    
+    def test_warm_up_builds_index_and_closes_connections(self):
+        """Test that warm_up leaves the FAQ index built and no DB connection to inherit."""
+        with mock.patch('chatbot.warmup.connections') as warmup_connections:
+            self.assertEqual(warm_up(), 1)
+        warmup_connections.close_all.assert_called_once()
+        
+        with mock.patch.object(FAQIndex, 'build') as build:
+            FAQMatcher().get_faq_index()
+        build.assert_not_called()
 
 
 class ChatAPITestCase(APITestCase):
@@ -171,6 +402,345 @@ class ChatAPITestCase(APITestCase):
         self.assertGreaterEqual(messages.count(), 2)  # User + AI response
 
 
+class ChatBatchAPITestCase(APITestCase):
+    """Test the batch chat endpoint."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.url = reverse('chat_batch')
+        self.faq = FAQ.objects.create(
+            question="What is your service?",
+            answer="We provide astrology services.",
+            keywords=['service', 'astrology'],
+            category='General'
+        )
+    
+    def post_batch(self, messages):
+        return self.client.post(self.url, {'messages': messages}, format='json')
+    
+    def test_results_in_input_order(self):
+        """Test each message gets the same answer as /api/chat/, in order."""
+        response = self.post_batch([
+            {'session_id': 'batch-a', 'message': 'What is your service?'},
+            {'session_id': 'batch-b', 'message': 'xyzzy plugh'},
+            {'session_id': 'batch-a', 'message': 'What is your service?'},
+        ])
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([r['session_id'] for r in results], ['batch-a', 'batch-b', 'batch-a'])
+        self.assertEqual(results[0]['response_type'], 'faq')
+        self.assertEqual(results[0]['ai_response'], self.faq.answer)
+        self.assertEqual(results[1]['response_type'], 'human_handoff_request')
+        self.assertEqual(results[2]['ai_response'], self.faq.answer)
+        
+        conversation = Conversation.objects.get(session_id='batch-a')
+        self.assertEqual(conversation.messages.count(), 4)
+        self.assertEqual(Conversation.objects.get(session_id='batch-b').messages.count(), 2)
+    
+    def test_invalid_items_do_not_fail_batch(self):
+        """Test that bad items get per-item errors and the rest are answered."""
+        response = self.post_batch([
+            {'session_id': 'batch-a', 'message': ''},
+            'not an object',
+            {'session_id': 'batch-a', 'message': 'What is your service?'},
+        ])
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(results[0], {'error': 'Message cannot be empty'})
+        self.assertIn('error', results[1])
+        self.assertEqual(results[2]['response_type'], 'faq')
+        self.assertEqual(Message.objects.count(), 2)
+    
+    def test_human_agent_confirmation_within_batch(self):
+        """Test that a 'yes' answers a human agent offer made earlier in the batch."""
+        response = self.post_batch([
+            {'session_id': 'batch-h', 'message': 'xyzzy plugh'},
+            {'session_id': 'batch-h', 'message': 'yes please'},
+        ])
+        
+        results = response.data['results']
+        self.assertEqual(results[0]['response_type'], 'human_handoff_request')
+        self.assertEqual(results[1]['response_type'], 'collect_human_details')
+    
+    def test_query_count_independent_of_batch_size(self):
+        """Test that the batch is persisted with a fixed number of queries."""
+        def count_queries(size):
+            messages = [
+                {'session_id': f'batch-q{size}-{i % 3}', 'message': 'What is your service?'}
+                for i in range(size)
+            ]
+            with CaptureQueriesContext(connection) as ctx:
+                self.post_batch(messages)
+            return len(ctx.captured_queries)
+        
+        # Warm up the FAQ index and create this hour's rollup rows
+        self.post_batch([{'message': 'What is your service?'}])
+        self.assertEqual(count_queries(3), count_queries(12))
+    
+    def test_batch_size_limit(self):
+        """Test that oversized and empty batches are rejected."""
+        with override_settings(CHAT_BATCH_MAX_ITEMS=2):
+            response = self.post_batch([{'message': 'hi'}] * 3)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        response = self.post_batch([])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AdmissionControlTestCase(APITestCase):
+    """Test rate limiting and load shedding on the chat endpoint."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.url = reverse('chat')
+        self.faq = FAQ.objects.create(
+            question="What is your service?",
+            answer="We provide astrology services.",
+            keywords=['service', 'astrology'],
+            category='General'
+        )
+    
+    def chat(self, message, session_id='admission-session'):
+        return self.client.post(self.url, {'session_id': session_id, 'message': message}, format='json')
+    
+    def test_concurrency_limiter_queue(self):
+        """Test that the limiter queues up to its bound and then sheds."""
+        limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=1, queue_timeout=0.05)
+        self.assertIsNone(limiter.acquire())
+        self.assertEqual(limiter.acquire(), 'queue_timeout')
+        
+        limiter.waiting = 1  # as if another request were queued
+        self.assertEqual(limiter.acquire(), 'queue_full')
+        limiter.waiting = 0
+        
+        limiter.release()
+        self.assertIsNone(limiter.acquire())
+    
+    def test_token_bucket(self):
+        """Test that a bucket allows its burst and then asks the client to wait."""
+        buckets = TokenBucketLimiter(rate=2, burst=2)
+        self.assertEqual(buckets.take('a'), 0)
+        self.assertEqual(buckets.take('a'), 0)
+        self.assertAlmostEqual(buckets.take('a'), 0.5, places=2)
+        self.assertEqual(buckets.take('b'), 0)
+    
+    @override_settings(CHAT_SESSION_RATE=0.1, CHAT_SESSION_BURST=2)
+    def test_session_rate_limit(self):
+        """Test that a session over its rate gets 429 with Retry-After."""
+        self.assertEqual(self.chat('Hello').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.chat('Hello').status_code, status.HTTP_200_OK)
+        
+        response = self.chat('Hello')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(response['Retry-After']), 9)
+        self.assertEqual(self.chat('Hello', session_id='other-session').status_code, status.HTTP_200_OK)
+    
+    def test_default_limits_allow_quick_follow_ups(self):
+        """Test that the default buckets let a person send a quick run of messages."""
+        for _ in range(20):
+            response = self.chat('Hello', session_id='quick-follow-ups')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    @override_settings(CHAT_SESSION_RATE=0, CHAT_IP_RATE=0.1, CHAT_IP_BURST=2)
+    def test_ip_rate_limit_ignores_spoofed_forwarded_for(self):
+        """Test that a client cannot get a fresh IP bucket by sending its own X-Forwarded-For."""
+        for n in range(2):
+            response = self.client.post(self.url, {'session_id': f'ip-{n}', 'message': 'Hello'},
+                                        format='json', HTTP_X_FORWARDED_FOR=f'198.51.100.{n}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(self.url, {'session_id': 'ip-2', 'message': 'Hello'},
+                                    format='json', HTTP_X_FORWARDED_FOR='198.51.100.2')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+    
+    @override_settings(CHAT_SESSION_RATE=0, CHAT_IP_RATE=0.1, CHAT_IP_BURST=1)
+    def test_ip_rate_limit_behind_proxy(self):
+        """Test that behind one proxy the client IP is the entry the proxy appended."""
+        with self.settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, NUM_PROXIES=1)):
+            for client_ip in ('203.0.113.7', '203.0.113.8'):
+                response = self.client.post(self.url, {'session_id': client_ip, 'message': 'Hello'},
+                                            format='json', HTTP_X_FORWARDED_FOR=f'198.51.100.1, {client_ip}')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.post(self.url, {'session_id': 'proxied', 'message': 'Hello'},
+                                        format='json', HTTP_X_FORWARDED_FOR='198.51.100.9, 203.0.113.7')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+    
+    @override_settings(CHAT_MAX_CONCURRENT=1, CHAT_MAX_QUEUE=0, CHAT_QUEUE_TIMEOUT=0.5)
+    def test_saturated_endpoint_degrades(self):
+        """Test that a saturated endpoint answers exact questions and sheds the rest."""
+        registry.reset()
+        limiter = get_concurrency_limiter()
+        self.assertIsNone(limiter.acquire())
+        self.addCleanup(limiter.release)
+        
+        response = self.chat('What is your service?')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['ai_response'], self.faq.answer)
+        
+        response = self.chat('Tell me about your services')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        
+        shed = registry.snapshot()['chat_requests_shed_total']
+        self.assertEqual(shed, {('degraded',): 1.0, ('queue_full',): 1.0})
+        self.assertEqual(registry.snapshot()['chat_admission_in_flight'], {(): 1.0})
+
+
+class SessionCacheTestCase(APITestCase):
+    """Test the session lookup cache used by the chat endpoint."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.url = reverse('chat')
+        get_session_cache().clear()
+        self.addCleanup(get_session_cache().clear)
+        self.addCleanup(caches['default'].clear)
+    
+    def chat(self, message, session_id='cached-session'):
+        # Cache entries are only stored once the turn's writes are committed
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'session_id': session_id, 'message': message}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+    
+    def conversation_queries(self, message, session_id='cached-session'):
+        with CaptureQueriesContext(connection) as ctx:
+            self.chat(message, session_id)
+        return [q['sql'] for q in ctx.captured_queries if '"conversations"' in q['sql']]
+    
+    def test_hot_session_skips_conversation_queries(self):
+        """Test that later turns neither look up nor save the conversation."""
+        self.assertTrue(self.conversation_queries('Hello'))
+        self.assertEqual(self.conversation_queries('Hello again'), [])
+        self.assertEqual(Conversation.objects.get(session_id='cached-session').messages.count(), 4)
+    
+    @override_settings(LAST_ACTIVE_WRITE_INTERVAL=0)
+    def test_last_active_written_after_interval(self):
+        """Test that last_active is still updated once the interval has passed."""
+        self.chat('Hello')
+        before = Conversation.objects.get(session_id='cached-session').last_active
+        
+        queries = self.conversation_queries('Hello again')
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0].startswith('UPDATE'))
+        self.assertGreater(Conversation.objects.get(session_id='cached-session').last_active, before)
+    
+    @override_settings(SESSION_CACHE_BACKEND='default')
+    def test_shared_backend_tracks_human_agent_offer(self):
+        """Test that a shared cache answers the human agent check without loading messages."""
+        self.chat('xyzzy plugh', 'shared-session')
+        
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.chat('yes please', 'shared-session')
+        
+        self.assertEqual(response.data['response_type'], 'collect_human_details')
+        self.assertFalse(any(q['sql'].startswith('SELECT') and '"messages"' in q['sql']
+                             for q in ctx.captured_queries))
+    
+    def test_deleted_conversation_is_forgotten(self):
+        """Test that deleting a conversation drops its cached id."""
+        self.chat('Hello')
+        Conversation.objects.get(session_id='cached-session').delete()
+        
+        self.assertIsNone(get_session_cache().get('cached-session'))
+        self.chat('Hello again')
+        self.assertEqual(Conversation.objects.get(session_id='cached-session').messages.count(), 2)
+
+
+class AnalyticsRollupTestCase(APITestCase):
+    """Test match metadata on messages and the analytics rollups."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.faq = FAQ.objects.create(
+            question="What is your service?",
+            answer="We provide astrology services.",
+            keywords=['service', 'astrology'],
+            category='General'
+        )
+        # Counts left over from other tests
+        rollup_buffer.clear()
+    
+    def chat(self, message, session_id='rollup-session'):
+        return self.client.post(reverse('chat'), {'session_id': session_id, 'message': message}, format='json')
+    
+    def test_ai_message_match_metadata(self):
+        """Test that AI messages store the matched FAQ, type and confidence."""
+        self.chat('What is your service?')
+        
+        ai_msg = Message.objects.get(is_user=False)
+        self.assertEqual(ai_msg.matched_faq, self.faq)
+        self.assertEqual(ai_msg.response_type, 'faq')
+        self.assertGreaterEqual(ai_msg.confidence, 0.7)
+        
+        user_msg = Message.objects.get(is_user=True)
+        self.assertIsNone(user_msg.matched_faq)
+        self.assertEqual(user_msg.response_type, '')
+    
+    def test_rollups_incremented_per_response(self):
+        """Test hourly and daily rollups by type and FAQ, and the unmatched rate."""
+        self.chat('What is your service?')
+        self.chat('xyzzy plugh')
+        self.client.post(reverse('chat_batch'), {'messages': [
+            {'session_id': 'rollup-batch', 'message': 'What is your service?'},
+        ]}, format='json')
+        flush_rollups(force=True)
+        
+        for period in ('hour', 'day'):
+            rollup = ResponseRollup.objects.get(period=period)
+            self.assertEqual(rollup.total, 3)
+            self.assertEqual(rollup.faq, 2)
+            self.assertEqual(rollup.human_handoff_request, 1)
+            self.assertAlmostEqual(rollup.unmatched_rate, 1 / 3)
+            
+            faq_rollup = FAQRollup.objects.get(period=period)
+            self.assertEqual((faq_rollup.faq, faq_rollup.category, faq_rollup.count), (self.faq, 'General', 2))
+    
+    def test_rebuild_matches_incremental_rollups(self):
+        """Test that rebuilding from messages reproduces the incremental counts."""
+        for message in ('What is your service?', 'xyzzy plugh', 'yes'):
+            self.chat(message)
+        flush_rollups(force=True)
+        
+        def snapshot():
+            return (
+                sorted(ResponseRollup.objects.values_list(
+                    'period', 'period_start', 'total', 'faq', 'human_handoff_request', 'collect_human_details'
+                )),
+                sorted(FAQRollup.objects.values_list('period', 'period_start', 'faq', 'category', 'count')),
+            )
+        
+        incremental = snapshot()
+        rebuild_rollups()
+        self.assertEqual(snapshot(), incremental)
+    
+    @override_settings(ANALYTICS_FLUSH_SECONDS=60)
+    def test_rollups_written_off_the_chat_turn(self):
+        """Test that chat turns only count in memory and a flush writes them in one go."""
+        flush_rollups(force=True)
+        with CaptureQueriesContext(connection) as ctx:
+            self.chat('What is your service?')
+            self.chat('xyzzy plugh')
+        self.assertFalse([q for q in ctx.captured_queries if 'rollups' in q['sql']])
+        self.assertFalse(ResponseRollup.objects.exists())
+        
+        flush_rollups(force=True)
+        self.assertEqual(ResponseRollup.objects.get(period='day').total, 2)
+    
+    def test_failed_flush_keeps_counts(self):
+        """Test that counts a flush could not write are written by the next one."""
+        self.chat('What is your service?')
+        with mock.patch('chatbot.analytics._increment', side_effect=OperationalError('database is locked')):
+            with self.assertLogs('chatbot.analytics', level='ERROR'):
+                flush_rollups(force=True)
+        self.assertFalse(ResponseRollup.objects.exists())
+        
+        flush_rollups(force=True)
+        self.assertEqual(ResponseRollup.objects.get(period='hour').faq, 1)
+        self.assertEqual(FAQRollup.objects.get(period='day').count, 1)
+
+
 class HumanHandoffTestCase(APITestCase):
     """Test human handoff workflow."""
     
@@ -234,6 +804,151 @@ class HumanHandoffTestCase(APITestCase):
         
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('error', response.data)
+    
+    def test_handoff_reopens_closed_request(self):
+        """Test that a new request on a resolved conversation reopens its request."""
+        handoff = HumanHandoffRequest.objects.create(
+            conversation=self.conversation,
+            name='John Doe',
+            phone='+1234567890',
+            problem_summary='Issue 1',
+            status='resolved'
+        )
+        url = reverse('request_human')
+        data = {
+            'session_id': 'test-handoff-session',
+            'name': 'John Doe',
+            'phone': '+1234567890',
+            'problem_summary': 'Issue 2'
+        }
+        response = self.client.post(url, data, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['ticket_id'], handoff.id)
+        self.assertIn('submitted', response.data['message'])
+        handoff.refresh_from_db()
+        self.assertEqual((handoff.status, handoff.problem_summary), ('pending', 'Issue 2'))
+    
+    def test_handoff_insert_skips_conflict(self):
+        """Test that a request inserted since the caller looked is returned, not duplicated."""
+        from .views import RequestHumanAgentView
+        
+        details = {'name': 'John Doe', 'phone': '+1234567890', 'problem_summary': 'Issue'}
+        first, created = RequestHumanAgentView.open_request(self.conversation, details)
+        self.assertTrue(created)
+        again, created = RequestHumanAgentView.open_request(self.conversation, dict(details, name='Jane'))
+        
+        self.assertFalse(created)
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(HumanHandoffRequest.objects.get().name, 'John Doe')
+
+
+class IdempotencyTestCase(APITestCase):
+    """Test Idempotency-Key replay on the chat and handoff POSTs."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.addCleanup(caches['default'].clear)
+    
+    def chat(self, message, key, session_id='idempotent-session'):
+        return self.client.post(reverse('chat'), {'session_id': session_id, 'message': message},
+                                format='json', HTTP_IDEMPOTENCY_KEY=key)
+    
+    def test_retry_replays_chat_response(self):
+        """Test that a retried chat turn is answered from the store without saving it again."""
+        first = self.chat('How do I register as an astrologer?', 'key-1')
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self.chat('How do I register as an astrologer?', 'key-1')
+        
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(retry.data, first.data)
+        # Only the key lookup
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(Message.objects.count(), 2)
+    
+    def test_new_key_runs_again(self):
+        """Test that a different key is a new turn."""
+        self.chat('Hello', 'key-1')
+        self.chat('Hello', 'key-2')
+        self.client.post(reverse('chat'), {'session_id': 'idempotent-session', 'message': 'Hello'}, format='json')
+        
+        self.assertEqual(Message.objects.count(), 6)
+    
+    def test_key_reused_for_other_request(self):
+        """Test that a key reused with a different body is rejected."""
+        self.chat('Hello', 'key-1')
+        response = self.chat('Something else', 'key-1')
+        
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Message.objects.count(), 2)
+    
+    def test_key_in_progress(self):
+        """Test that a retry while the first attempt runs gets 409."""
+        from .idempotency import request_fingerprint
+        
+        body = {'session_id': 'idempotent-session', 'message': 'Hello'}
+        get_idempotency_store().begin('chat', 'key-1', request_fingerprint(body))
+        response = self.chat('Hello', 'key-1')
+        
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Message.objects.count(), 0)
+    
+    def test_server_errors_not_stored(self):
+        """Test that a failed attempt releases its key for the retry."""
+        with mock.patch('chatbot.views.ChatAPIView.reply', side_effect=RuntimeError('down')):
+            with self.assertRaises(RuntimeError):
+                self.chat('Hello', 'key-1')
+        response = self.chat('Hello', 'key-1')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Message.objects.count(), 2)
+    
+    def test_claim_seen_by_every_worker(self):
+        """Test that a key claimed through one worker's store is held for the others."""
+        workers = [IdempotencyStore(), IdempotencyStore()]
+        self.assertIsNone(workers[0].begin('chat', 'key-1', 'body'))
+        with self.assertRaises(IdempotencyConflict) as conflict:
+            workers[1].begin('chat', 'key-1', 'body')
+        self.assertEqual(conflict.exception.status_code, status.HTTP_409_CONFLICT)
+        
+        workers[0].complete('chat', 'key-1', 'body', 201, {'id': uuid.UUID(int=1), 'at': datetime(2026, 1, 1, tzinfo=dt_timezone.utc)})
+        stored = workers[1].begin('chat', 'key-1', 'body')
+        self.assertEqual(stored.status_code, 201)
+        self.assertEqual(stored.data, {'id': '00000000-0000-0000-0000-000000000001', 'at': '2026-01-01T00:00:00Z'})
+        self.assertIsNone(workers[1].begin('handoff', 'key-1', 'body'))
+    
+    def test_expired_claim_taken_over(self):
+        """Test that a claim left by a killed worker expires and can be claimed again."""
+        store = IdempotencyStore()
+        store.begin('chat', 'key-1', 'body')
+        IdempotencyRecord.objects.update(expires_at=timezone.now())
+        self.assertIsNone(store.begin('chat', 'key-1', 'other body'))
+        self.assertEqual(IdempotencyRecord.objects.get().fingerprint, 'other body')
+    
+    @override_settings(IDEMPOTENCY_BACKEND='default')
+    def test_shared_cache_replays_handoff(self):
+        """Test that a retried handoff is replayed from a shared cache and notifies once."""
+        Conversation.objects.create(session_id='idempotent-session', language='en')
+        url = reverse('request_human')
+        data = {
+            'session_id': 'idempotent-session',
+            'name': 'John Doe',
+            'phone': '+1234567890',
+            'problem_summary': 'Unable to book an appointment'
+        }
+        with mock.patch('chatbot.views.NotificationService.send_agent_notification') as notify:
+            first = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='handoff-1')
+            retry = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='handoff-1')
+        
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data, first.data)
+        self.assertIn('submitted', retry.data['message'])
+        self.assertEqual(notify.call_count, 1)
+        self.assertEqual(HumanHandoffRequest.objects.count(), 1)
+        self.assertFalse(IdempotencyRecord.objects.exists())
 
 
 class ConversationHistoryTestCase(APITestCase):
@@ -283,6 +998,1224 @@ class ConversationHistoryTestCase(APITestCase):
         
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertIn('error', response.data)
+    
+    def test_get_history_pages(self):
+        """Test keyset pagination with limit and after."""
+        for i in range(3):
+            Message.objects.create(conversation=self.conversation, content=f"Page {i}", is_user=True)
+        url = reverse('conversation_history')
+        
+        contents = []
+        params = {'session_id': 'test-history-session', 'limit': 2}
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['messages']), 2)
+            contents.extend(m['content'] for m in response.data['messages'])
+            if response.data['next_after'] is None:
+                break
+            params['after'] = response.data['next_after']
+        
+        self.assertEqual(contents, ['Hello', 'Hi there!', 'Page 0', 'Page 1', 'Page 2'])
+    
+    def test_stream_history_matches_history(self):
+        """Test that the streamed history has the same body as the regular one."""
+        for i in range(5):
+            Message.objects.create(conversation=self.conversation, content=f"Streamed {i}", is_user=True)
+        url = reverse('conversation_history')
+        expected = self.client.get(url, {'session_id': 'test-history-session'}).json()
+        
+        with mock.patch.object(ConversationHistoryView, 'stream_chunk_size', 2):
+            response = self.client.get(url, {'session_id': 'test-history-session', 'stream': '1'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), expected)
+    
+    def test_get_history_invalid_cursor(self):
+        """Test that after must name a message and limit must be positive."""
+        url = reverse('conversation_history')
+        for params in ({'after': 'not-a-uuid'}, {'after': str(uuid7())}, {'limit': '0'}):
+            response = self.client.get(url, dict(params, session_id='test-history-session'))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FAQSearchTestCase(APITestCase):
+    """Test the indexed FAQ search behind /api/faq/search/ and the admin."""
+    
+    def setUp(self):
+        self.register = FAQ.objects.create(
+            question="How do I register as an astrologer?",
+            answer="Sign up in the app and upload your certificates.",
+            keywords=['signup', 'onboarding'],
+            category='Registration'
+        )
+        self.fee = FAQ.objects.create(
+            question="Is there a registration fee?",
+            answer="No, joining is free.",
+            keywords=['fee', 'cost'],
+            category='Registration'
+        )
+        self.payments = FAQ.objects.create(
+            question="When will I receive my payments?",
+            answer="Payments are sent weekly once you register your bank account.",
+            keywords=['payout', 'bank'],
+            category='Payments'
+        )
+        self.url = reverse('faq_search')
+    
+    def result_ids(self, response):
+        return [result['id'] for result in response.data['results']]
+    
+    def test_search_ranks_question_matches_first(self):
+        """Test that prefix matches in questions outrank matches in answers."""
+        response = self.client.get(self.url, {'q': 'regist'})
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        ids = self.result_ids(response)
+        self.assertEqual(ids[-1], str(self.payments.id))
+        self.assertEqual(set(ids[:2]), {str(self.register.id), str(self.fee.id)})
+        ranks = [result['rank'] for result in response.data['results']]
+        self.assertEqual(ranks, sorted(ranks, reverse=True))
+    
+    def test_search_matches_keywords(self):
+        """Test that FAQs are found by their keywords alone."""
+        response = self.client.get(self.url, {'q': 'payout'})
+        self.assertEqual(self.result_ids(response), [str(self.payments.id)])
+        self.assertEqual(self.client.get(self.url, {'q': 'horoscope'}).data['count'], 0)
+    
+    def test_search_index_follows_edits(self):
+        """Test that the index picks up created, edited and deleted FAQs."""
+        self.fee.question = "Do I pay anything to join?"
+        self.fee.save()
+        self.register.delete()
+        FAQ.objects.filter(pk=self.payments.pk).update(keywords=['remittance'])
+        
+        self.assertEqual(self.result_ids(self.client.get(self.url, {'q': 'join'})), [str(self.fee.id)])
+        self.assertEqual(self.result_ids(self.client.get(self.url, {'q': 'remittance'})), [str(self.payments.id)])
+        self.assertEqual(self.result_ids(self.client.get(self.url, {'q': 'astrologer'})), [])
+    
+    def test_search_pages(self):
+        """Test page_size/page pagination of the results."""
+        response = self.client.get(self.url, {'q': 'regist', 'page_size': 2})
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+        
+        second = self.client.get(self.url, {'q': 'regist', 'page_size': 2, 'page': 2})
+        self.assertEqual(self.result_ids(second), [str(self.payments.id)])
+        self.assertIsNone(second.data['next'])
+    
+    def test_search_requires_query(self):
+        """Test that q is required and must contain a word."""
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'q': 'x' * 201}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'q': '?!'}).data['count'], 0)
+    
+    def test_admin_search_uses_index(self):
+        """Test that the admin search box returns ranked index results."""
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+        url = reverse('admin:faq_faq_changelist')
+        
+        response = self.client.get(url, {'q': 'regist'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = list(response.context['cl'].result_list)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[-1].pk, self.payments.pk)
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'q': 'payout'})
+        self.assertTrue(any('faqs_fts MATCH' in query['sql'] for query in queries.captured_queries))
+        self.assertFalse(any('LIKE' in query['sql'] for query in queries.captured_queries))
+
+
+class UUID7TestCase(TestCase):
+    """Test time-ordered primary keys."""
+    
+    def test_uuid7_is_version_7_and_increasing(self):
+        """Test that ids are version 7, RFC 4122 variant, and sort in creation order."""
+        ids = [uuid7() for _ in range(10000)]
+        self.assertTrue(all(value.version == 7 for value in ids))
+        self.assertTrue(all(value.variant == uuid.RFC_4122 for value in ids))
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertLessEqual(abs(uuid7_timestamp_ms(ids[0]) - time.time() * 1000), 5000)
+    
+    def test_new_rows_get_uuid7_ids(self):
+        """Test that new conversations and messages get time-ordered ids."""
+        conversation = Conversation.objects.create(session_id='uuid7-session')
+        first = Message.objects.create(conversation=conversation, content='First', is_user=True)
+        second = Message.objects.create(conversation=conversation, content='Second', is_user=True)
+        self.assertEqual(conversation.id.version, 7)
+        self.assertLess(first.id, second.id)
+
+
+class JSONRenderingTestCase(APITestCase):
+    """Test the orjson renderer/parser and pre-encoded FAQ texts."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.faq = FAQ.objects.create(
+            question='What is a "birth chart"?',
+            answer='A map of the sky at your birth \u2028 with Tamil: ஜாதகம்',
+            keywords=['birth', 'chart'],
+            category='Basic'
+        )
+    
+    def test_renderer_matches_drf_json(self):
+        """Test that the orjson renderer produces the same JSON as DRF's renderer."""
+        texts = faq_json_texts(self.faq)
+        data = {
+            'ai_response': texts['answer'],
+            'category': texts['category'],
+            'errors': ReturnDict({'message': [ErrorDetail('This field is required.')]}, serializer=None),
+            'id': uuid.UUID(int=1),
+            'confidence': 0.75,
+            'when': datetime(2024, 1, 2, 3, 4, 5, tzinfo=dt_timezone.utc),
+        }
+        self.assertEqual(
+            json.loads(ORJSONRenderer().render(data)),
+            json.loads(JSONRenderer().render(data)),
+        )
+        self.assertIn(b'\\u2028', ORJSONRenderer().render(data))
+    
+    def test_renderer_accepts_non_string_keys(self):
+        """Test that int keys, as in errors for list items, render like DRF's renderer."""
+        data = {0: ['x'], 'items': {1: [ErrorDetail('Not a valid string.')]}}
+        self.assertEqual(ORJSONRenderer().render({0: ['x']}), b'{"0":["x"]}')
+        self.assertEqual(
+            json.loads(ORJSONRenderer().render(data)),
+            json.loads(JSONRenderer().render(data)),
+        )
+    
+    def test_faq_texts_encoded_once_per_faq_instance(self):
+        """Test that FAQ texts are encoded once and pickle as plain strings."""
+        texts = faq_json_texts(self.faq)
+        self.assertIs(faq_json_texts(self.faq), texts)
+        self.assertEqual(texts['answer'], self.faq.answer)
+        self.assertIs(type(pickle.loads(pickle.dumps(texts['answer']))), str)
+        
+        edited = FAQ.objects.get(pk=self.faq.pk)
+        self.assertIsNot(faq_json_texts(edited), texts)
+    
+    def test_chat_response_rendered_with_faq_texts(self):
+        """Test that a matched answer round-trips through the chat endpoint."""
+        response = self.client.post(
+            reverse('chat'), {'session_id': 'json-session', 'message': 'What is a birth chart?'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = json.loads(response.content)
+        self.assertEqual(body['ai_response'], self.faq.answer)
+        self.assertEqual(body['matched_question'], self.faq.question)
+    
+    def test_invalid_json_rejected(self):
+        """Test that malformed JSON gets a 400 from the parser."""
+        response = self.client.post(reverse('chat'), '{"session_id": ', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CompressionTestCase(APITestCase):
+    """Test negotiated compression of large API responses."""
+    
+    def setUp(self):
+        """Set up a conversation whose history is well over the size threshold."""
+        conversation = Conversation.objects.create(session_id='compressed-session')
+        Message.objects.bulk_create(
+            Message(conversation=conversation, content=f"Tell me about my birth chart, part {i}", is_user=True)
+            for i in range(100)
+        )
+        self.url = reverse('conversation_history')
+    
+    def get(self, accept_encoding, **params):
+        return self.client.get(
+            self.url, dict(params, session_id='compressed-session'), HTTP_ACCEPT_ENCODING=accept_encoding
+        )
+    
+    def test_preferred_encoding(self):
+        """Test Accept-Encoding negotiation."""
+        self.assertEqual(preferred_encoding('gzip, deflate, br'), 'br')
+        self.assertEqual(preferred_encoding('gzip;q=1.0, br;q=0.5'), 'gzip')
+        self.assertEqual(preferred_encoding('br;q=0, gzip'), 'gzip')
+        self.assertEqual(preferred_encoding('*'), 'br')
+        self.assertIsNone(preferred_encoding('identity'))
+        self.assertIsNone(preferred_encoding(''))
+    
+    def test_large_response_compressed(self):
+        """Test that history is brotli/gzip compressed when accepted."""
+        plain = self.get('identity')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        
+        gzipped = self.get('gzip')
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+        self.assertLess(len(gzipped.content), len(plain.content) // 3)
+        self.assertEqual(gzip.decompress(gzipped.content), plain.content)
+        
+        brotlied = self.get('gzip, br')
+        self.assertEqual(brotlied['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(brotlied.content), plain.content)
+    
+    def test_streamed_response_compressed(self):
+        """Test that streamed history is compressed chunk by chunk."""
+        plain = b''.join(self.get('identity', stream='1').streaming_content)
+        for encoding, decompress in (('gzip', gzip.decompress), ('br', brotli.decompress)):
+            response = self.get(encoding, stream='1')
+            self.assertEqual(response['Content-Encoding'], encoding)
+            self.assertEqual(decompress(b''.join(response.streaming_content)), plain)
+    
+    def test_small_chat_reply_not_compressed(self):
+        """Test that responses under the threshold are sent as they are."""
+        response = self.client.post(
+            reverse('chat'), {'session_id': 'small-reply', 'message': 'Hi'},
+            format='json', HTTP_ACCEPT_ENCODING='gzip, br'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+@override_settings(CHAT_SESSION_RATE=0, CHAT_WS_FLUSH_SECONDS=60)
+class ChatSocketTestCase(TestCase):
+    """Test the WebSocket chat channel."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.faq = FAQ.objects.create(
+            question='What is astrology?',
+            answer='Astrology is the study of celestial bodies.',
+            keywords=['astrology', 'study', 'celestial'],
+            category='Basic'
+        )
+    
+    async def connect(self, session_id='socket-session'):
+        communicator = WebsocketCommunicator(application, f"/ws/chat/?session_id={session_id}")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+    
+    async def ask(self, communicator, message, request_id='1'):
+        await communicator.send_json_to({'message': message, 'request_id': request_id})
+        return await communicator.receive_json_from()
+    
+    def saved_messages(self, session_id='socket-session'):
+        return list(Message.objects.filter(
+            conversation__session_id=session_id
+        ).order_by('timestamp', 'id').values_list('content', flat=True))
+    
+    async def test_answers_and_writes_on_close(self):
+        """Test that answers match /api/chat/ and messages are written when the socket closes."""
+        communicator = await self.connect()
+        response = await self.ask(communicator, 'What is astrology?', request_id='abc')
+        self.assertEqual(response['request_id'], 'abc')
+        self.assertEqual(response['response_type'], 'faq')
+        self.assertEqual(response['ai_response'], self.faq.answer)
+        self.assertEqual(await sync_to_async(self.saved_messages)(), [])
+        
+        await communicator.disconnect()
+        self.assertEqual(
+            await sync_to_async(self.saved_messages)(), ['What is astrology?', self.faq.answer]
+        )
+    
+    @override_settings(CHAT_WS_FLUSH_MESSAGES=4)
+    async def test_writes_in_batches(self):
+        """Test that queued turns are written once the batch is full."""
+        communicator = await self.connect()
+        await self.ask(communicator, 'What is astrology?')
+        self.assertEqual(await sync_to_async(self.saved_messages)(), [])
+        await self.ask(communicator, 'Tell me about astrology study')
+        self.assertEqual(len(await sync_to_async(self.saved_messages)()), 4)
+        await communicator.disconnect()
+    
+    @override_settings(CHAT_WS_FLUSH_SECONDS=0.2)
+    async def test_idle_socket_flushed_by_timer(self):
+        """Test that queued turns are written once due even if no further message arrives."""
+        communicator = await self.connect()
+        before = timezone.now()
+        await self.ask(communicator, 'What is astrology?')
+        self.assertEqual(await sync_to_async(self.saved_messages)(), [])
+        
+        await asyncio.sleep(0.5)
+        self.assertEqual(len(await sync_to_async(self.saved_messages)()), 2)
+        # Stamped when sent, not when written
+        first = await sync_to_async(Message.objects.order_by('timestamp').first)()
+        self.assertLess((first.timestamp - before).total_seconds(), 0.2)
+        await communicator.disconnect()
+    
+    async def test_rest_fallback_replays_socket_answer(self):
+        """Test that a REST retry with the socket message's key does not answer it again."""
+        communicator = await self.connect()
+        await communicator.send_json_to({
+            'message': 'What is astrology?', 'request_id': '1', 'idempotency_key': 'message-1'
+        })
+        answer = await communicator.receive_json_from()
+        await communicator.disconnect()
+        
+        response = await sync_to_async(self.client.post)(
+            reverse('chat'),
+            {'session_id': 'socket-session', 'message': 'What is astrology?', 'language': 'en'},
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY='message-1'
+        )
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(response.json()['ai_response'], answer['ai_response'])
+        self.assertEqual(len(await sync_to_async(self.saved_messages)()), 2)
+    
+    def rest_retry(self, key):
+        return self.client.post(
+            reverse('chat'),
+            {'session_id': 'socket-session', 'message': 'What is astrology?', 'language': 'en'},
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY=key
+        )
+    
+    async def send_with_key(self, communicator, key):
+        await communicator.send_json_to({'message': 'What is astrology?', 'request_id': '1', 'idempotency_key': key})
+        return await communicator.receive_json_from()
+    
+    async def test_key_answered_only_once_written(self):
+        """Test that a REST retry is not told the turn is saved while it is only queued."""
+        communicator = await self.connect()
+        await self.send_with_key(communicator, 'message-1')
+        
+        response = await sync_to_async(self.rest_retry)('message-1')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        
+        await communicator.disconnect()
+        response = await sync_to_async(self.rest_retry)('message-1')
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(await sync_to_async(self.saved_messages)()), 2)
+    
+    @override_settings(CHAT_WS_FLUSH_SECONDS=0.2)
+    async def test_failed_write_retried(self):
+        """Test that turns a flush could not write stay queued and are written by the next one."""
+        save_messages = ChatConsumer.save_messages
+        calls = []
+        
+        def flaky_save(conversation_id, messages):
+            calls.append(len(messages))
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            save_messages(conversation_id, messages)
+        
+        communicator = await self.connect()
+        with mock.patch.object(ChatConsumer, 'save_messages', side_effect=flaky_save):
+            with self.assertLogs('chatbot.consumers', level='ERROR'):
+                await self.send_with_key(communicator, 'message-1')
+                await asyncio.sleep(0.7)
+        
+        self.assertEqual(calls, [2, 2])
+        self.assertEqual(len(await sync_to_async(self.saved_messages)()), 2)
+        response = await sync_to_async(self.rest_retry)('message-1')
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        await communicator.disconnect()
+    
+    async def test_unsaved_turn_releases_key(self):
+        """Test that a turn still unwritten when the socket closes can be retried over REST."""
+        communicator = await self.connect()
+        with mock.patch.object(ChatConsumer, 'save_messages', side_effect=OperationalError('database is locked')):
+            with self.assertLogs('chatbot.consumers', level='ERROR'):
+                await self.send_with_key(communicator, 'message-1')
+                await communicator.disconnect()
+        
+        response = await sync_to_async(self.rest_retry)('message-1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(len(await sync_to_async(self.saved_messages)()), 2)
+    
+    async def test_human_agent_flow(self):
+        """Test that accepting the human agent offer asks for details, from connection state."""
+        communicator = await self.connect()
+        offer = await self.ask(communicator, 'xyzzy plugh')
+        self.assertEqual(offer['response_type'], 'human_handoff_request')
+        # Written before the client can request a human agent
+        self.assertEqual(len(await sync_to_async(self.saved_messages)()), 2)
+        
+        details = await self.ask(communicator, 'yes please')
+        self.assertEqual(details['response_type'], 'collect_human_details')
+        await communicator.disconnect()
+    
+    async def test_invalid_messages(self):
+        """Test that bad input gets an error and leaves the socket open."""
+        communicator = await self.connect()
+        await communicator.send_to(text_data='not json')
+        self.assertEqual((await communicator.receive_json_from())['status'], 400)
+        response = await self.ask(communicator, '   ')
+        self.assertEqual(response['error'], 'Message cannot be empty')
+        self.assertEqual((await self.ask(communicator, 'What is astrology?'))['response_type'], 'faq')
+        await communicator.disconnect()
+    
+    async def test_missing_session_rejected(self):
+        """Test that a socket without a session_id is refused."""
+        communicator = WebsocketCommunicator(application, '/ws/chat/')
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+
+@override_settings(METRICS_AUTH_TOKEN='secret')
+class MetricsTestCase(APITestCase):
+    """Test hot-path metrics and the /metrics endpoint."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        registry.reset()
+        FAQ.objects.create(
+            question="What is your service?",
+            answer="We provide astrology services.",
+            keywords=['service', 'astrology'],
+            category='General'
+        )
+    
+    def scrape(self):
+        return self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+    
+    def test_chat_turn_is_instrumented(self):
+        """Test that a chat turn records stage timings and its response type."""
+        self.client.post(reverse('chat'), {
+            'session_id': 'metrics-session',
+            'message': 'What service do you provide?'
+        }, format='json')
+        
+        response = self.scrape()
+        body = response.content.decode()
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('chat_responses_total{type="faq"} 1.0', body)
+        for stage in ('preprocess', 'candidate_retrieval', 'fuzzy_scoring', 'db_write'):
+            self.assertIn(f'chat_stage_seconds_count{{stage="{stage}"}}', body)
+        self.assertIn('chat_cache_lookups_total{cache="faq_index",result="miss"} 1.0', body)
+    
+    def test_metrics_summed_across_processes(self):
+        """Test that snapshots written by other workers are added in."""
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS_MULTIPROC_DIR=directory):
+                RESPONSES.inc('faq')
+                registry.flush()
+                snapshot = os.path.join(directory, '999999-1.json')
+                with open(snapshot, 'w') as f:
+                    json.dump({'gauges': [], 'values': {
+                        'chat_responses_total': [[['faq'], 2.0], [['clarification'], 1.0]]
+                    }}, f)
+                
+                body = self.scrape().content.decode()
+        
+        self.assertIn('chat_responses_total{type="faq"} 3.0', body)
+        self.assertIn('chat_responses_total{type="clarification"} 1.0', body)
+    
+    def test_metrics_token_required(self):
+        """Test that a configured token protects the endpoint."""
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        
+        response = self.scrape()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    @override_settings(METRICS_AUTH_TOKEN='')
+    def test_metrics_hidden_without_token(self):
+        """Test that without a token the endpoint is only served in DEBUG."""
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        
+        with self.settings(DEBUG=True):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ProfilingMiddlewareTestCase(APITestCase):
+    """Test sampled request profiling."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        FAQ.objects.create(
+            question="What is your service?",
+            answer="We provide astrology services.",
+            keywords=['service', 'astrology'],
+            category='General'
+        )
+    
+    def chat(self, **headers):
+        return self.client.post(reverse('chat'), {
+            'session_id': 'profiling-session',
+            'message': 'What service do you provide?'
+        }, format='json', **headers)
+    
+    def test_disabled_by_default(self):
+        """Test that the middleware does nothing unless enabled."""
+        response = self.chat()
+        self.assertNotIn('Server-Timing', response)
+    
+    def test_server_timing_without_sampling(self):
+        """Test that unsampled requests get timings but no profile."""
+        with override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0.0,
+                               PROFILING_DIR=self.profile_dir.name):
+            response = self.chat()
+        
+        self.assertIn('fuzzy_scoring;dur=', response['Server-Timing'])
+        self.assertIn('queries"', response['Server-Timing'])
+        self.assertEqual(os.listdir(self.profile_dir.name), [])
+    
+    def test_header_triggers_profile_and_query_log(self):
+        """Test that the profiling header writes a profile and SQL log."""
+        with override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0.0,
+                               PROFILING_TOKEN='let-me-profile',
+                               PROFILING_DIR=self.profile_dir.name):
+            self.chat(HTTP_X_PROFILE_REQUEST='wrong-token')
+            self.assertEqual(os.listdir(self.profile_dir.name), [])
+            self.chat(HTTP_X_PROFILE_REQUEST='let-me-profile')
+        
+        files = sorted(os.listdir(self.profile_dir.name))
+        self.assertEqual(len(files), 2)
+        self.assertTrue(files[0].endswith('.prof'))
+        with open(os.path.join(self.profile_dir.name, files[1])) as f:
+            log = json.load(f)
+        self.assertEqual(log['path'], '/api/chat/')
+        self.assertGreater(log['queries']['count'], 0)
+        self.assertEqual(len(log['queries']['statements']), log['queries']['count'])
+    
+    def test_profiles_rotated(self):
+        """Test that only the newest profiles are kept."""
+        with override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0,
+                               PROFILING_MAX_FILES=2, PROFILING_DIR=self.profile_dir.name):
+            for _ in range(3):
+                self.chat()
+        
+        profiles = [name for name in os.listdir(self.profile_dir.name) if name.endswith('.prof')]
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual(len(os.listdir(self.profile_dir.name)), 4)
+
+
+class ClassifyQueriesCommandTestCase(TestCase):
+    """Test the classify_queries management command."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        FAQ.objects.create(
+            question="What is astrology?",
+            answer="Astrology is the study of celestial bodies.",
+            keywords=['astrology', 'study', 'celestial'],
+            category='Basic'
+        )
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.input_path = os.path.join(self.tmpdir.name, 'queries.jsonl')
+        self.output_path = os.path.join(self.tmpdir.name, 'results.jsonl')
+        with open(self.input_path, 'w') as f:
+            for i in range(25):
+                query = 'what is astrology?' if i % 2 == 0 else f'xyzzy {i}'
+                f.write(json.dumps({'query': query}) + '\n')
+            f.write('not json\n')
+    
+    def classify(self, **options):
+        call_command('classify_queries', self.input_path, output=self.output_path,
+                     chunk_size=4, progress_every=0, stderr=io.StringIO(), **options)
+        with open(self.output_path) as f:
+            return [json.loads(line) for line in f]
+    
+    def test_results_in_input_order(self):
+        """Test that pooled workers write every record in input order."""
+        results = self.classify(workers=2)
+        
+        self.assertEqual([r['offset'] for r in results], list(range(26)))
+        self.assertEqual(results[0]['type'], 'faq')
+        self.assertEqual(results[0]['question'], 'What is astrology?')
+        self.assertEqual(results[1]['type'], 'human_handoff_request')
+        self.assertIn('error', results[25])
+        self.assertEqual(results, self.classify(workers=0))
+    
+    def test_resume_after_interrupted_run(self):
+        """Test that --resume drops a cut-off line and continues after it."""
+        full = self.classify(workers=0)
+        with open(self.output_path) as f:
+            lines = f.readlines()
+        with open(self.output_path, 'w') as f:
+            f.writelines(lines[:10])
+            f.write(lines[10][:15])
+        
+        self.assertEqual(self.classify(workers=0, resume=True), full)
+
+
+@skipUnless(hasattr(socket, 'AF_UNIX'), 'needs Unix domain sockets')
+class MatcherServiceTestCase(APITestCase):
+    """Test the out-of-process matcher and FAQMatcher's client mode."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        registry.reset()
+        self.faq = FAQ.objects.create(
+            question="What is astrology?",
+            answer="Astrology is the study of celestial bodies.",
+            keywords=['astrology', 'study', 'celestial'],
+            category='Basic'
+        )
+        FAQ.objects.create(
+            question="How do I get a birth chart reading?",
+            answer="You can book a reading through our website.",
+            keywords=['birth', 'chart', 'reading', 'booking'],
+            category='Services'
+        )
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.socket_path = os.path.join(tmpdir.name, 'matcher.sock')
+        # Handler threads cannot see this test's uncommitted FAQs, so the
+        # index is loaded here once and never refreshed
+        self.server = MatcherServer(self.socket_path, MatcherService(refresh_interval=None))
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+    
+    def test_remote_matches_in_process(self):
+        """Test that the service answers exactly like in-process matching."""
+        remote = FAQMatcher(service_socket=self.socket_path)
+        local = FAQMatcher(service_socket='')
+        
+        for query in ("What is astrology?", "How do I get a birth chart reading?", "Tell me about pizza"):
+            self.assertEqual(remote.get_response(query), local.get_response(query))
+        self.assertEqual(remote.get_response("What is astrology?")['faq_id'], self.faq.id)
+        self.assertEqual(remote.exact_response("what is astrology"), local.exact_response("what is astrology"))
+        self.assertIsNone(remote.exact_response("astrology"))
+        self.assertEqual(registry.snapshot()['matcher_service_calls_total'][('ok',)], 6.0)
+    
+    def test_batch_is_pipelined(self):
+        """Test that distinct queries go out in one call and replies map back in order."""
+        queries = ["What is astrology?", "Tell me about pizza", "What is astrology?"]
+        with mock.patch.object(MatcherClient, 'call', autospec=True,
+                               side_effect=MatcherClient.call) as call:
+            responses = FAQMatcher(service_socket=self.socket_path).get_responses(queries)
+        
+        call.assert_called_once_with(mock.ANY, [('match', queries[0]), ('match', queries[1])])
+        self.assertEqual(responses, FAQMatcher(service_socket='').get_responses(queries))
+        self.assertEqual(registry.snapshot()['matcher_service_calls_total'], {('ok',): 2.0})
+    
+    def test_raw_protocol(self):
+        """Test pipelined requests on a raw connection, including a bad op."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket_path)
+            sock.sendall(pack_frame([7, 'ping', None]) + pack_frame([8, 'bogus', None]))
+            with sock.makefile('rb') as stream:
+                self.assertEqual(read_frame(stream), [7, True, 2])
+                request_id, ok, error = read_frame(stream)
+        
+        self.assertEqual((request_id, ok), (8, False))
+        self.assertIn('bogus', error)
+    
+    @override_settings(MATCHER_SERVICE_RETRY_SECONDS=60)
+    def test_falls_back_when_service_is_down(self):
+        """Test in-process matching while the service is unreachable, and skipping it afterwards."""
+        missing = os.path.join(os.path.dirname(self.socket_path), 'missing.sock')
+        matcher = FAQMatcher(service_socket=missing)
+        
+        self.assertEqual(matcher.get_response("What is astrology?")['type'], 'faq')
+        self.assertEqual(matcher.get_response("What is astrology?")['type'], 'faq')
+        calls = registry.snapshot()['matcher_service_calls_total']
+        self.assertEqual(calls[('error',)], 1.0)
+        self.assertEqual(calls[('down',)], 1.0)
+    
+    def test_reconnects_after_service_restart(self):
+        """Test that a connection closed by a restarted service is reopened once."""
+        matcher = FAQMatcher(service_socket=self.socket_path)
+        matcher.get_response("What is astrology?")
+        self.server.shutdown()
+        self.server.server_close()
+        
+        restarted = MatcherServer(self.socket_path, MatcherService(refresh_interval=None))
+        thread = threading.Thread(target=restarted.serve_forever, daemon=True)
+        thread.start()
+        try:
+            self.assertEqual(matcher.get_response("What is astrology?")['type'], 'faq')
+        finally:
+            restarted.shutdown()
+            restarted.server_close()
+            thread.join()
+        self.assertNotIn(('error',), registry.snapshot()['matcher_service_calls_total'])
+    
+    def test_chat_view_uses_service(self):
+        """Test that /api/chat/ answers through the configured service."""
+        with override_settings(MATCHER_SERVICE_SOCKET=self.socket_path):
+            response = self.client.post(reverse('chat'), {
+                'session_id': 'service-session',
+                'message': 'What is astrology?'
+            }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['response_type'], 'faq')
+        self.assertEqual(Message.objects.get(is_user=False).matched_faq_id, self.faq.id)
+        self.assertEqual(registry.snapshot()['matcher_service_calls_total'][('ok',)], 1.0)
+
+
+class ReplicaRoutingTestCase(APITestCase):
+    """Test read replica routing against a second SQLite file that lags the primary."""
+    
+    def setUp(self):
+        """Replicate a conversation to a second SQLite file, then write past it."""
+        self.addCleanup(caches['default'].clear)
+        self.conversation = Conversation.objects.create(session_id='replica-session')
+        replicated = [Message.objects.create(conversation=self.conversation, content='Hello', is_user=True)]
+        
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        # Read-your-writes marks in a cache every worker would see
+        shared_cache = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(tmpdir.name, 'cache'),
+        }})
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+        connections.settings[REPLICA_ALIAS] = dict(
+            connection.settings_dict, NAME=os.path.join(tmpdir.name, 'replica.sqlite3')
+        )
+        self.addCleanup(self.detach_replica)
+        with connections[REPLICA_ALIAS].schema_editor() as editor:
+            for model in (FAQ, Conversation, Message):
+                editor.create_model(model)
+        self.conversation.save(using=REPLICA_ALIAS, force_insert=True)
+        Message.objects.using(REPLICA_ALIAS).bulk_create(replicated)
+        
+        # Not replicated yet
+        Message.objects.create(conversation=self.conversation, content='Newer', is_user=True)
+    
+    def detach_replica(self):
+        connections[REPLICA_ALIAS].close()
+        del connections[REPLICA_ALIAS]
+        del connections.settings[REPLICA_ALIAS]
+    
+    def history(self):
+        response = self.client.get(reverse('conversation_history'), {'session_id': 'replica-session'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [m['content'] for m in response.data['messages']]
+    
+    def test_router_decisions(self):
+        """Test that only use_replica() blocks read from the replica, and writes never do."""
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Message))
+        with use_replica():
+            self.assertEqual(router.db_for_read(Message), REPLICA_ALIAS)
+            self.assertEqual(router.db_for_write(Message), 'default')
+        self.assertFalse(router.allow_migrate(REPLICA_ALIAS, 'chatbot'))
+        self.assertTrue(router.allow_migrate('default', 'chatbot'))
+    
+    def test_history_reads_from_replica(self):
+        """Test that conversation history is read from the (lagging) replica."""
+        self.assertEqual(self.history(), ['Hello'])
+    
+    def test_history_sticks_to_primary_after_chat_write(self):
+        """Test read-your-writes: a session that just chatted reads from the primary."""
+        self.client.post(reverse('chat'), {'session_id': 'replica-session', 'message': 'Hi'}, format='json')
+        self.assertEqual(self.history()[:3], ['Hello', 'Newer', 'Hi'])
+    
+    def test_history_stays_on_primary_with_local_memory_marks(self):
+        """Test that per-process read-your-writes marks never send a session to the replica."""
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual(self.history(), ['Hello', 'Newer'])
+            with use_replica():
+                self.assertEqual(ReplicaRouter().db_for_read(Message), REPLICA_ALIAS)
+
+
+class SQLiteTuningTestCase(TestCase):
+    """Test SQLite connection tuning and the single writer against a SQLite file."""
+    
+    alias = 'sqlite_tuning'
+    
+    def setUp(self):
+        """Attach an empty SQLite file with the chat tables."""
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        connections.settings[self.alias] = dict(
+            connection.settings_dict, NAME=os.path.join(tmpdir.name, 'chat.sqlite3')
+        )
+        self.addCleanup(self.detach)
+        with connections[self.alias].schema_editor() as editor:
+            for model in (FAQ, Conversation, Message):
+                editor.create_model(model)
+        connections[self.alias].close()
+        self.conversation = Conversation(session_id='sqlite-session')
+        self.conversation.save(using=self.alias)
+    
+    def detach(self):
+        connections[self.alias].close()
+        del connections[self.alias]
+        del connections.settings[self.alias]
+    
+    def pragma(self, name):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+    
+    def test_pragmas_applied_when_enabled(self):
+        """Test that new connections get WAL, busy_timeout and synchronous=NORMAL."""
+        self.assertNotEqual(self.pragma('journal_mode'), 'wal')
+        connections[self.alias].close()
+        with override_settings(SQLITE_TUNING=True, SQLITE_BUSY_TIMEOUT_MS=7000):
+            self.assertEqual(self.pragma('journal_mode'), 'wal')
+            self.assertEqual(self.pragma('busy_timeout'), 7000)
+            self.assertEqual(self.pragma('synchronous'), 1)
+    
+    def test_concurrent_writes_through_single_writer(self):
+        """Test that many threads writing through the single writer never hit a lock error."""
+        threads_count, writes_per_thread = 8, 50
+        errors = []
+        writer = SingleWriter(using=self.alias)
+        self.addCleanup(writer.stop)
+        
+        def write(n):
+            return Message.objects.using(self.alias).create(
+                conversation_id=self.conversation.pk, content=f"message {n}", is_user=True
+            )
+        
+        def client(thread_number):
+            try:
+                for i in range(writes_per_thread):
+                    writer.submit(write, thread_number * writes_per_thread + i)
+            except Exception as e:
+                errors.append(e)
+        
+        with override_settings(SQLITE_TUNING=True):
+            connections[self.alias].close()
+            threads = [threading.Thread(target=client, args=(n,)) for n in range(threads_count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            writer.stop()
+            
+            self.assertEqual(errors, [])
+            self.assertEqual(
+                Message.objects.using(self.alias).count(), threads_count * writes_per_thread
+            )
+    
+    @skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+    def test_writers_in_several_processes(self):
+        """Test that one writer per worker process, each fed by threads, never hits a lock error."""
+        processes, threads_count, writes_per_thread = 4, 4, 25
+        
+        def turn(session_id, n):
+            # Reads, then writes: the lock upgrade a deferred BEGIN cannot wait for
+            conversation, _ = Conversation.objects.using(self.alias).get_or_create(session_id=session_id)
+            Message.objects.using(self.alias).create(conversation=conversation, content=f"message {n}", is_user=True)
+        
+        def worker(process_number):
+            writer = SingleWriter(using=self.alias)
+            failures = []
+            
+            def client(thread_number):
+                for i in range(writes_per_thread):
+                    try:
+                        writer.submit(turn, f'session-{process_number}-{thread_number % 2}', i)
+                    except Exception as e:
+                        failures.append(e)
+            
+            threads = [threading.Thread(target=client, args=(n,)) for n in range(threads_count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            writer.stop()
+            return len(failures)
+        
+        with override_settings(SQLITE_TUNING=True):
+            connections[self.alias].close()
+            children = []
+            for process_number in range(processes):
+                read_end, write_end = os.pipe()
+                pid = os.fork()
+                if pid == 0:
+                    failures = 1
+                    try:
+                        failures = worker(process_number)
+                    finally:
+                        os.write(write_end, str(failures).encode())
+                        os._exit(0)
+                os.close(write_end)
+                children.append((pid, read_end))
+            failures = []
+            for pid, read_end in children:
+                failures.append(int(os.read(read_end, 16) or b'1'))
+                os.close(read_end)
+                os.waitpid(pid, 0)
+        
+        self.assertEqual(failures, [0] * processes)
+        self.assertEqual(
+            Message.objects.using(self.alias).count(), processes * threads_count * writes_per_thread
+        )
+    
+    def test_failed_write_does_not_affect_others(self):
+        """Test that a write that raises only rolls back itself."""
+        writer = SingleWriter(using=self.alias)
+        self.addCleanup(writer.stop)
+        
+        def failing_write():
+            Message.objects.using(self.alias).create(
+                conversation_id=self.conversation.pk, content='rolled back', is_user=True
+            )
+            raise ValueError('boom')
+        
+        with self.assertRaises(ValueError):
+            writer.submit(failing_write)
+        writer.submit(
+            Message.objects.using(self.alias).create,
+            conversation_id=self.conversation.pk, content='kept', is_user=True
+        )
+        writer.stop()
+        self.assertEqual(
+            list(Message.objects.using(self.alias).values_list('content', flat=True)), ['kept']
+        )
+    
+    def test_writes_inline_off_sqlite(self):
+        """Test that SQLITE_SINGLE_WRITER leaves writes to other databases inline."""
+        with override_settings(SQLITE_SINGLE_WRITER=True), mock.patch.object(connection, 'vendor', 'postgresql'):
+            self.assertEqual(run_write(threading.get_ident), threading.get_ident())
+            with self.assertRaises(ValueError):
+                get_writer()
+
+
+class ShardingTestCase(APITestCase):
+    """Test sharding chat data by session over two SQLite files."""
+    
+    shards = ['shard_0', 'shard_1']
+    
+    @classmethod
+    def setUpClass(cls):
+        """Migrate empty shard files once; each test gets copies."""
+        super().setUpClass()
+        cls.template_dir = tempfile.TemporaryDirectory()
+        cls.attach_shards(cls.template_dir.name)
+        with override_settings(DATABASE_SHARDS=cls.shards):
+            for alias in cls.shards:
+                call_command('migrate', database=alias, verbosity=0)
+        cls.detach_shards()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.template_dir.cleanup()
+        super().tearDownClass()
+    
+    @classmethod
+    def attach_shards(cls, directory):
+        for alias in cls.shards:
+            connections.settings[alias] = dict(
+                connection.settings_dict, NAME=os.path.join(directory, f'{alias}.sqlite3')
+            )
+    
+    @classmethod
+    def detach_shards(cls):
+        for alias in cls.shards:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+    
+    def setUp(self):
+        """Attach fresh copies of the migrated shards and turn sharding on."""
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        for alias in self.shards:
+            shutil.copy(os.path.join(self.template_dir.name, f'{alias}.sqlite3'), tmpdir.name)
+        self.attach_shards(tmpdir.name)
+        self.addCleanup(self.detach_shards)
+        sharding = override_settings(DATABASE_SHARDS=self.shards)
+        sharding.enable()
+        self.addCleanup(sharding.disable)
+        self.addCleanup(get_session_cache().clear)
+        
+        self.faq = FAQ.objects.create(
+            question="What services do you offer?",
+            answer="We offer horoscope readings and consultations.",
+            keywords="services, offer",
+            category="general"
+        )
+        self.sessions = {alias: self.session_on(alias) for alias in self.shards}
+    
+    def session_on(self, alias):
+        return next(f"session-{n}" for n in range(1000) if shard_for(f"session-{n}") == alias)
+    
+    def chat(self, session_id, message='What services do you offer?'):
+        response = self.client.post(reverse('chat'), {
+            'session_id': session_id, 'message': message, 'language': 'en'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+    
+    def test_jump_hash_moves_few_sessions(self):
+        """Test that going from 2 to 3 shards only moves sessions onto the new shard."""
+        keys = [int.from_bytes(uuid.uuid4().bytes[:8], 'big') for _ in range(3000)]
+        moved = [key for key in keys if jump_hash(key, 2) != jump_hash(key, 3)]
+        self.assertTrue(all(jump_hash(key, 3) == 2 for key in moved))
+        self.assertAlmostEqual(len(moved) / len(keys), 1 / 3, delta=0.05)
+        self.assertEqual(shard_for('same-session'), shard_for('same-session'))
+    
+    def test_shards_only_hold_chat_tables(self):
+        """Test that migrate creates only the sharded tables on a shard."""
+        tables = set(connections['shard_0'].introspection.table_names())
+        self.assertEqual(tables, {'conversations', 'messages', 'human_handoff_requests', 'django_migrations'})
+    
+    def test_shard_migrations_reference_no_unsharded_table(self):
+        """Test that no migration run on a shard adds a foreign key to a table it does not hold."""
+        from django.db.migrations.loader import MigrationLoader
+        
+        loader = MigrationLoader(connections['shard_0'])
+        for app_label, name in loader.disk_migrations:
+            if app_label != 'chatbot':
+                continue
+            out = io.StringIO()
+            call_command('sqlmigrate', app_label, name, database='shard_0', stdout=out)
+            self.assertNotIn('REFERENCES "faqs"', out.getvalue(), name)
+    
+    def test_chat_turns_written_to_session_shard(self):
+        """Test that each session's conversation and messages live on its own shard."""
+        rollup_buffer.clear()
+        for alias, session_id in self.sessions.items():
+            self.chat(session_id)
+        
+        self.assertFalse(Conversation.objects.using('default').exists())
+        for alias, session_id in self.sessions.items():
+            conversation = Conversation.objects.using(alias).get()
+            self.assertEqual(conversation.session_id, session_id)
+            self.assertEqual(Message.objects.using(alias).filter(conversation=conversation).count(), 2)
+            ai_msg = Message.objects.using(alias).get(is_user=False)
+            self.assertEqual(ai_msg.matched_faq, self.faq)
+        
+        response = self.client.get(reverse('conversation_history'), {'session_id': self.sessions['shard_1']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_messages'], 2)
+        # Rollups stay on default
+        flush_rollups(force=True)
+        self.assertEqual(ResponseRollup.objects.get(period='day').total, 2)
+    
+    @override_settings(SQLITE_SINGLE_WRITER=True)
+    def test_single_writer_writes_to_session_shard(self):
+        """Test that writes handed to the writer thread keep their shard."""
+        self.chat(self.sessions['shard_1'])
+        self.assertEqual(Message.objects.using('shard_1').count(), 2)
+        self.assertFalse(Message.objects.using('shard_0').exists())
+    
+    def test_batch_across_shards(self):
+        """Test that a batch spanning shards writes each session to its shard, in order."""
+        response = self.client.post(reverse('chat_batch'), {'messages': [
+            {'session_id': self.sessions['shard_0'], 'message': 'What services do you offer?'},
+            {'session_id': self.sessions['shard_1'], 'message': 'xyzzy plugh'},
+            {'session_id': self.sessions['shard_0'], 'message': 'What services do you offer?'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([r['session_id'] for r in results], [
+            self.sessions['shard_0'], self.sessions['shard_1'], self.sessions['shard_0']
+        ])
+        self.assertEqual(results[0]['ai_response'], self.faq.answer)
+        self.assertEqual(Message.objects.using('shard_0').count(), 4)
+        self.assertEqual(Message.objects.using('shard_1').count(), 2)
+    
+    def test_handoff_request_on_session_shard(self):
+        """Test that a handoff request is stored next to its conversation."""
+        session_id = self.sessions['shard_1']
+        self.chat(session_id)
+        response = self.client.post(reverse('request_human'), {
+            'session_id': session_id, 'name': 'Test User', 'phone': '+919876543210',
+            'problem_summary': 'Need help'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        handoff = HumanHandoffRequest.objects.using('shard_1').get()
+        self.assertEqual(handoff.conversation.session_id, session_id)
+    
+    def test_rebalance_moves_rows_to_their_shard(self):
+        """Test that rebalance_shards moves default rows to their shard, keeping ids and times."""
+        session_id = self.sessions['shard_1']
+        conversation = Conversation.objects.using('default').create(session_id=session_id)
+        message = Message.objects.using('default').create(conversation=conversation, content='Hello', is_user=True)
+        handoff = HumanHandoffRequest.objects.using('default').create(
+            conversation=conversation, name='Test', phone='123', problem_summary='Help'
+        )
+        
+        out = io.StringIO()
+        call_command('rebalance_shards', '--dry-run', stdout=out)
+        self.assertIn('default -> shard_1: 1 conversations, 1 messages, 1 handoff requests', out.getvalue())
+        self.assertTrue(Conversation.objects.using('default').exists())
+        
+        call_command('rebalance_shards', stdout=io.StringIO())
+        self.assertFalse(Conversation.objects.using('default').exists())
+        self.assertFalse(Message.objects.using('default').exists())
+        moved = Message.objects.using('shard_1').get()
+        self.assertEqual((moved.pk, moved.timestamp), (message.pk, message.timestamp))
+        self.assertEqual(Conversation.objects.using('shard_1').get().pk, conversation.pk)
+        self.assertEqual(HumanHandoffRequest.objects.using('shard_1').get().pk, handoff.pk)
+        
+        # Already on its shard: nothing left to move
+        out = io.StringIO()
+        call_command('rebalance_shards', stdout=out)
+        self.assertIn('Moved 0 conversations', out.getvalue())
+    
+    def test_rebalance_inserts_messages_in_chunks(self):
+        """Test that rebalance_shards copies messages with one insert per chunk."""
+        session_id = self.sessions['shard_1']
+        conversation = Conversation.objects.using('default').create(session_id=session_id)
+        for n in range(5):
+            Message.objects.using('default').create(conversation=conversation, content=f'Hello {n}', is_user=True)
+        
+        with mock.patch('chatbot.management.commands.rebalance_shards.MESSAGE_CHUNK_SIZE', 2), \
+                CaptureQueriesContext(connections['shard_1']) as ctx:
+            call_command('rebalance_shards', stdout=io.StringIO())
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith(f'INSERT INTO "{Message._meta.db_table}"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(Message.objects.using('shard_1').count(), 5)
+    
+    def test_rebalance_merges_into_conversation_on_shard(self):
+        """Test that old messages join the conversation a session already started on its shard."""
+        session_id = self.sessions['shard_0']
+        old = Conversation.objects.using('default').create(session_id=session_id)
+        Message.objects.using('default').create(conversation=old, content='Old', is_user=True)
+        self.chat(session_id)
+        
+        call_command('rebalance_shards', stdout=io.StringIO())
+        conversation = Conversation.objects.using('shard_0').get()
+        self.assertNotEqual(conversation.pk, old.pk)
+        self.assertEqual(
+            sorted(Message.objects.using('shard_0').filter(conversation=conversation).values_list('content', flat=True)),
+            sorted(['Old', 'What services do you offer?', self.faq.answer])
+        )
+    
+    def test_rebuild_rollups_counts_every_shard(self):
+        """Test that rebuilt rollups include the messages of all shards."""
+        for session_id in self.sessions.values():
+            self.chat(session_id)
+        ResponseRollup.objects.all().delete()
+        FAQRollup.objects.all().delete()
+        rebuild_rollups()
+        self.assertEqual(ResponseRollup.objects.get(period='day').faq, 2)
+        self.assertEqual(FAQRollup.objects.get(period='day').count, 2)
+    
+    def test_deleting_faq_unlinks_messages_on_shards(self):
+        """Test that deleting an FAQ clears matched_faq on every shard."""
+        self.chat(self.sessions['shard_0'])
+        self.faq.delete()
+        self.assertIsNone(Message.objects.using('shard_0').get(is_user=False).matched_faq_id)
+    
+    def test_admin_changelist_fans_out(self):
+        """Test that admin lists span all shards and open objects on their shard."""
+        for session_id in self.sessions.values():
+            self.chat(session_id)
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+        
+        url = reverse('admin:chatbot_conversation_changelist')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertEqual(
+            {c.session_id for c in response.context['cl'].result_list}, set(self.sessions.values())
+        )
+        
+        response = self.client.get(url, {'shard': 'shard_1'})
+        self.assertEqual([c.session_id for c in response.context['cl'].result_list], [self.sessions['shard_1']])
+        
+        message = Message.objects.using('shard_1').filter(is_user=False).get()
+        response = self.client.get(reverse('admin:chatbot_message_change', args=[message.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.faq.question)
+    
+    def test_routing_outside_use_shard(self):
+        """Test that chat queries outside use_shard() use default."""
+        with use_shard(self.sessions['shard_1']):
+            Conversation.objects.create(session_id=self.sessions['shard_1'])
+        self.assertFalse(Conversation.objects.exists())
+        with use_shard(self.sessions['shard_1']):
+            self.assertTrue(Conversation.objects.exists())
 
 
 class ConversationModelTestCase(TestCase):
@@ -0,0 +1,181 @@
+"""
+Tanglish and Tamil-script normalization for queries.
+
+Many users type Tamil words in Latin script ("jathagam", "porutham",
+"kalyanam") or in Tamil script. No FAQ question contains those words, so
+the queries miss the exact-match and spelling indexes and fall through to
+full fuzzy scoring. transliterate() rewrites them into the English (or
+established Tamil) words the FAQs use, before the query is preprocessed.
+Preprocessing would tear Tamil script apart at its vowel signs, so Tamil-
+script words with no entry are dropped, as are the Tanglish particles and
+auxiliary verbs in FILLER: left in, they only dilute the fuzzy scores of
+otherwise well-matched queries below the answer threshold.
+
+TANGLISH and TAMIL map FAQ vocabulary to the variants users type. A
+variant ending in ``*`` is a stem and matches the inflected forms Tamil
+builds by appending suffixes ("jathagathula", "ஜாதகத்தை"). A Latin word
+only matches a stem when the rest of it is one of SUFFIXES, so English
+words that merely start with a stem ("tankard", "Kovilpatti") are left
+alone; the bare stem has to be listed as a variant of its own. Tamil-
+script stems match any ending, as only Tamil words start with them.
+
+Latin variants are compiled to a spelling skeleton (lower case, no ``h``
+after a consonant, d/g/b as t/k/p, doubled letters collapsed). That way
+"jathagam", "jadhagam" and "jaathakam" are one entry. A query word is
+looked up by its skeleton, then by the longest stem its skeleton starts
+with that leaves a suffix. Results are cached per query text.
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, Tuple
+
+# FAQ vocabulary -> Tanglish variants
+TANGLISH: Dict[str, Tuple[str, ...]] = {
+    'horoscope': ('jathagam', 'jathakam', 'jaathagam', 'jathaga', 'jathaga*', 'jadhaga*', 'jathaka*'),
+    'porutham': ('porutham', 'poruththam', 'porutha*', 'poruththa*'),
+    'matchmaking': ('kalyanam', 'kalyana', 'kalyana*', 'thirumanam', 'thirumana', 'thirumana*'),
+    'couples': ('jodi', 'jodikku', 'jodigal'),
+    'remedies': ('pariharam', 'parigaram', 'parikaram', 'parihara*', 'parigara*'),
+    'panchangam': ('panchangam', 'panjangam', 'panchanga*', 'panjanga*'),
+    'rasipalan': ('rasipalan', 'raasipalan', 'rasi', 'raasi'),
+    'temple': ('kovil', 'kovil*', 'koil', 'koyil', 'koyil*'),
+    'pooja': ('poojai', 'pujai', 'puja', 'poojai*'),
+    'gemstone': ('rathinam', 'ratnam', 'rathina', 'rathina*'),
+    'gold': ('thangam', 'thanga*'),
+    'payment': ('panam', 'panathai', 'kaasu', 'sambalam', 'sambala*'),
+    'earn': ('sambathi*', 'sampadi*'),
+    'writing': ('ezhuthu', 'ezhuthi', 'ezhuthu*', 'ezhuthi*', 'ezhuda*'),
+    'income': ('varumanam', 'varumana', 'varumana*'),
+    'fee': ('kattanam', 'kattana*'),
+    'registration': ('pathivu', 'pathivu*', 'padhivu*'),
+    'customer': ('vaadikkaiyalar', 'vaadikkaiyalar*', 'vadikkaiyalar*', 'vaadikaiyalar*'),
+    'consultation': ('aalosanai', 'aalosanai*', 'alosanai*'),
+    'astrologer': ('jothidar', 'josiyar', 'jothisar', 'jothidar*', 'josiyar*', 'jothisar*'),
+    'astrology': ('jothidam', 'josiyam', 'jothisham', 'jyothisham'),
+    'how': ('eppadi',),
+    'what': ('enna',),
+    'when': ('eppo', 'eppothu'),
+    # Not 'yen', which is also English
+    'why': ('aen', 'yaen'),
+    'how much': ('evvalavu', 'evlo', 'evlavu'),
+    'can': ('mudiyuma', 'pannalama', 'seiyalama', 'sollalama'),
+    'get': ('kidaikuma', 'kidaikkuma', 'kidaikum', 'kidaikkum', 'kidaika*'),
+    'need': ('venuma', 'vendum', 'thevai'),
+    'separately': ('thani', 'thaniya'),
+    'download': ('download', 'download*'),
+}
+
+# Tanglish words that carry nothing an FAQ question matches on; dropped.
+# Not 'la' or 'le', which are also English
+FILLER: Tuple[str, ...] = (
+    'ku', 'kku', 'naan', 'nan', 'en', 'enga', 'unga', 'sontha',
+    'panna', 'pannu', 'pannu*', 'seiya', 'seiya*', 'vechukalama', 'vachukalama', 'vechikalama', 'irukka', 'irukkuma', 'iruka',
+    'tharuvinga', 'tharuvinga*', 'taruvinga*', 'pidikkala', 'illatha', 'illama',
+    'madhiri', 'mathiri', 'kettal', 'ketta', 'kekka*', 'vanga', 'veliya',
+)
+# Filler dropped only as spelled here: their skeleton is also English ("aka")
+EXACT_FILLER = frozenset({'aaga', 'aga'})
+
+# What Tamil appends to a Latin stem: case endings ("kovilukku",
+# "jathagathula") and the verb endings of the stems above ("sambathikka",
+# "kekkalama")
+SUFFIXES: Tuple[str, ...] = (
+    'm', 'a', 'u', 'e', 'ai', 'um', 'mum', 'me', 'ku', 'kku', 'ukku', 'la', 'le', 'il', 'ile',
+    'oda', 'odu', 'ode', 'thai', 'thula', 'thla', 'thil', 'thile', 'thukku', 'thoda', 'thodu',
+    'r', 'gal', 'kal', 'ngal', 'galukku', 'galai', 'rgal', 'rkal',
+    'ka', 'kka', 'nga', 'ma', 'num', 'lam', 'lama', 'vinga', 'vingala',
+)
+
+# FAQ vocabulary -> Tamil-script variants
+TAMIL: Dict[str, Tuple[str, ...]] = {
+    'horoscope': ('ஜாதக*',),
+    'porutham': ('பொருத்த*',),
+    'matchmaking': ('கல்யாண*', 'திருமண*'),
+    'couples': ('ஜோடி*',),
+    'remedies': ('பரிகார*',),
+    'panchangam': ('பஞ்சாங்க*',),
+    'rasipalan': ('ராசிபலன்*', 'ராசி'),
+    'temple': ('கோவில்*', 'கோயில்*'),
+    'pooja': ('பூஜை*',),
+    'gemstone': ('ரத்தின*',),
+    'gold': ('தங்கம்', 'தங்கத்*'),
+    'payment': ('பணம்', 'பணத்*', 'சம்பள*'),
+    'earn': ('சம்பாதி*',),
+    'writing': ('எழுது*', 'எழுதி*'),
+    'income': ('வருமான*',),
+    'fee': ('கட்டண*',),
+    'registration': ('பதிவு*',),
+    'customer': ('வாடிக்கையாள*',),
+    'consultation': ('ஆலோசனை*',),
+    'astrologer': ('ஜோதிடர்*',),
+    'astrology': ('ஜோதிட*', 'ஜோசிய*'),
+    'how': ('எப்படி',),
+    'what': ('என்ன',),
+    'when': ('எப்போது',),
+    'why': ('ஏன்',),
+    'how much': ('எவ்வளவு',),
+    'separately': ('தனி', 'தனியாக'),
+    'download': ('டவுன்லோட்*', 'பதிவிறக்க*'),
+    'software': ('மென்பொருள்*',),
+    'services': ('சேவை*',),
+}
+
+_ASPIRATED = re.compile(r'(?<=[bcdgjklmnprstvyz])h')
+_VOICED = str.maketrans({'d': 't', 'g': 'k', 'b': 'p'})
+_REPEATS = re.compile(r'(.)\1+')
+_WORD = re.compile(r'[a-z]+|[஀-௿]+')
+_TAMIL_SCRIPT = re.compile(r'[஀-௿]')
+
+
+def skeleton(word: str) -> str:
+    """Spelling skeleton shared by the common romanizations of a Tamil word"""
+    word = _ASPIRATED.sub('', word.lower()).replace('zh', 'l').translate(_VOICED)
+    return _REPEATS.sub(r'\1', word)
+
+
+def compile_table(table: Dict[str, Tuple[str, ...]], key=lambda variant: variant):
+    """{word: canonical} and {stem: canonical} for a variant table"""
+    words, stems = {}, {}
+    for canonical, variants in table.items():
+        for variant in variants:
+            if variant.endswith('*'):
+                stems[key(variant[:-1])] = canonical
+            else:
+                words[key(variant)] = canonical
+    return words, stems
+
+
+_LATIN_WORDS, _LATIN_STEMS = compile_table(dict(TANGLISH, **{'': FILLER}), skeleton)
+_LATIN_SUFFIXES = frozenset(map(skeleton, SUFFIXES))
+_TAMIL_WORDS, _TAMIL_STEMS = compile_table(TAMIL)
+_MIN_STEM = min(len(stem) for stem in (*_LATIN_STEMS, *_TAMIL_STEMS))
+
+
+def _lookup(key: str, words: Dict[str, str], stems: Dict[str, str], suffixes=None):
+    canonical = words.get(key)
+    if canonical is None:
+        for end in range(len(key), _MIN_STEM - 1, -1):
+            if suffixes is not None and key[end:] not in suffixes:
+                continue
+            canonical = stems.get(key[:end])
+            if canonical is not None:
+                break
+    return canonical
+
+
+def _replace(match) -> str:
+    word = match.group()
+    if _TAMIL_SCRIPT.match(word):
+        canonical = _lookup(word, _TAMIL_WORDS, _TAMIL_STEMS) or ''
+    elif word in EXACT_FILLER:
+        canonical = ''
+    else:
+        canonical = _lookup(skeleton(word), _LATIN_WORDS, _LATIN_STEMS, _LATIN_SUFFIXES)
+    return word if canonical is None else canonical
+
+
+@lru_cache(maxsize=4096)
+def transliterate(text: str) -> str:
+    """``text`` lower-cased, with Tanglish and Tamil-script words replaced by FAQ vocabulary"""
+    return _WORD.sub(_replace, text.lower())
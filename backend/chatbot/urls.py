@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import ChatAPIView, RequestHumanAgentView, ConversationHistoryView
+from .views import ChatAPIView, ChatBatchAPIView, RequestHumanAgentView, ConversationHistoryView
 
 urlpatterns = [
     path('chat/', ChatAPIView.as_view(), name='chat'),
+    path('chat/batch/', ChatBatchAPIView.as_view(), name='chat_batch'),
     path('request-human/', RequestHumanAgentView.as_view(), name='request_human'),
     path('conversation-history/', ConversationHistoryView.as_view(), name='conversation_history'),
 ]
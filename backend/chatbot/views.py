@@ -1,22 +1,112 @@
+import logging
+
+import orjson
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, router, transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils import timezone
 
+from astrotamil_api.routers import mark_session_written, use_replica
+from astrotamil_api.sharding import shard_for, use_shard
+
 from .models import Conversation, Message, HumanHandoffRequest
+from .admission import SHED, IPRateThrottle, SessionRateThrottle, get_concurrency_limiter, retry_after_seconds
 from .ai_matcher import FAQMatcher
+from .analytics import record_responses
+from .idempotency import idempotent
+from .metrics import CONTENT_TYPE, RESPONSES, registry, stage_timer
 from .notifications import NotificationService
+from .session_cache import conversation_state, forget_session, known_human_agent_offer, remember_response
+from .sqlite_tuning import run_write
 from .serializers import (
     ChatMessageSerializer, 
     HumanHandoffSerializer,
     ConversationSerializer
 )
 
+logger = logging.getLogger(__name__)
+
+HUMAN_DETAILS_RESPONSE = {
+    'success': False,
+    'response': "Please provide your details so our human agent can contact you:\n\n1. Your Name\n2. Contact Number\n3. Brief summary of your issue",
+    'type': 'collect_human_details'
+}
+
+
+def wants_human_agent(recent_messages, user_message):
+    """
+    Check if the user is accepting the human agent offered by the last AI message.
+    
+    recent_messages are the conversation's latest messages, newest first,
+    including the user message being answered.
+    """
+    if len(recent_messages) > 1:
+        # find the most recent AI message within the recent slice
+        last_ai_msg = next((m for m in recent_messages if not m.is_user), None)
+        if last_ai_msg and 'human agent' in last_ai_msg.content.lower():
+            # User is responding to human agent prompt
+            return accepts_human_agent(user_message)
+    return False
+
+
+def accepts_human_agent(user_message):
+    """Check if the user said yes to a human agent offer."""
+    return any(k in user_message.lower() for k in ('yes', 'ok', 'sure'))
+
+
+def ai_message(conversation_id, ai_response):
+    """Unsaved AI Message for a FAQMatcher response, with its match metadata."""
+    return Message(
+        conversation_id=conversation_id,
+        content=ai_response['response'],
+        is_user=False,
+        matched_faq_id=ai_response.get('faq_id'),
+        response_type=ai_response.get('type', ''),
+        confidence=ai_response.get('confidence')
+    )
+
+
+def chat_response_data(session_id, user_message, ai_response):
+    """Build the API payload for one answered chat message."""
+    response_data = {
+        'session_id': session_id,
+        'user_message': user_message,
+        'ai_response': ai_response['response'],
+        'response_type': ai_response.get('type', 'unknown'),
+        'confidence': ai_response.get('confidence', 0),
+        'timestamp': timezone.now().isoformat()
+    }
+    
+    if ai_response.get('success'):
+        response_data.update({
+            'matched_question': ai_response.get('question'),
+            'category': ai_response.get('category')
+        })
+    
+    return response_data
+
+
+def busy_response():
+    """Fast 503 for a chat request shed while the endpoint is saturated."""
+    return Response({
+        'error': 'The assistant is busy right now. Please try again in a moment.'
+    }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(retry_after_seconds())})
+
+
 class ChatAPIView(APIView):
+    throttle_classes = [SessionRateThrottle, IPRateThrottle]
+    
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.faq_matcher = FAQMatcher()
     
+    @idempotent('chat')
     def post(self, request):
         session_id = request.data.get('session_id')
         user_message = request.data.get('message', '').strip()
@@ -31,125 +121,352 @@ class ChatAPIView(APIView):
                 'error': 'Message cannot be empty'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Get or create conversation
-        conversation, created = Conversation.objects.get_or_create(
-            session_id=session_id,
-            defaults={
-                'language': language,
-                'created_at': timezone.now()
-            }
-        )
+        limiter = get_concurrency_limiter()
+        shed_reason = limiter.acquire()
+        if shed_reason:
+            # Saturated: only answer exact FAQ questions, which need no fuzzy scoring
+            degraded_response = self.faq_matcher.exact_response(user_message)
+            if degraded_response is None:
+                SHED.inc(shed_reason)
+                return busy_response()
+            SHED.inc('degraded')
+            return self.reply(session_id, user_message, language, degraded_response)
         
-        # Update last active time
-        conversation.last_active = timezone.now()
-        conversation.save()
+        try:
+            return self.reply(session_id, user_message, language)
+        finally:
+            limiter.release()
+    
+    def reply(self, session_id, user_message, language, degraded_response=None):
+        """Persist the turn and answer it (from ``degraded_response`` when given)."""
+        with use_shard(session_id):
+            with stage_timer('db_write'):
+                try:
+                    state = run_write(self.save_user_message, session_id, user_message, language)
+                except IntegrityError:
+                    # Conversation was deleted since it was cached by this worker
+                    forget_session(session_id)
+                    state = run_write(self.save_user_message, session_id, user_message, language)
+            
+            # Check if this is a response to human handoff prompt
+            offered_human_agent = known_human_agent_offer(state)
+            if offered_human_agent is None:
+                # Load last few messages and check if last AI message asked for human agent
+                recent_qs = Message.objects.filter(conversation_id=state.conversation_id).order_by('-timestamp')[:5]
+                needs_human_response = wants_human_agent(list(recent_qs), user_message)
+            else:
+                needs_human_response = offered_human_agent and accepts_human_agent(user_message)
+            
+            if needs_human_response:
+                ai_response = dict(HUMAN_DETAILS_RESPONSE)
+            elif degraded_response is not None:
+                ai_response = degraded_response
+            else:
+                # Get AI response
+                ai_response = self.faq_matcher.get_response(user_message)
+            
+            RESPONSES.inc(ai_response.get('type', 'unknown'))
+            
+            # Save AI response
+            with stage_timer('db_write'):
+                run_write(self.save_ai_message, session_id, state, ai_response)
+        mark_session_written(session_id)
+        record_responses([ai_response])
         
-        # Save user message
-        user_msg = Message.objects.create(
-            conversation=conversation,
+        return Response(chat_response_data(session_id, user_message, ai_response))
+    
+    @staticmethod
+    def save_user_message(session_id, user_message, language):
+        """Get or create the conversation (cached per session) and save the user message."""
+        state = conversation_state(session_id, language)
+        Message.objects.create(
+            conversation_id=state.conversation_id,
             content=user_message,
             is_user=True
         )
+        return state
+    
+    @staticmethod
+    def save_ai_message(session_id, state, ai_response):
+        ai_message(state.conversation_id, ai_response).save()
+        remember_response(session_id, state, ai_response)
+
+
+class ChatBatchAPIView(APIView):
+    """
+    Answer several queued chat messages in one request.
+    
+    Accepts {"messages": [{session_id, message, language}, ...]} (or the bare
+    list) and returns {"results": [...]} in the same order. Each result is
+    what /api/chat/ would return for that item, or {"error": ...} for an
+    item that could not be answered; one bad item never fails the others.
+    """
+    throttle_classes = [IPRateThrottle]
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.faq_matcher = FAQMatcher()
+    
+    def post(self, request):
+        items = request.data if isinstance(request.data, list) else request.data.get('messages')
+        
+        if not isinstance(items, list) or not items:
+            return Response({
+                'error': 'messages must be a non-empty list'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        max_items = getattr(settings, 'CHAT_BATCH_MAX_ITEMS', 50)
+        if len(items) > max_items:
+            return Response({
+                'error': f'A batch can contain at most {max_items} messages'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        results = [None] * len(items)
+        turns = []
+        for position, item in enumerate(items):
+            turn = self._validate_item(request, position, item)
+            if 'error' in turn:
+                results[position] = turn
+            else:
+                turns.append(turn)
         
-        # Check if this is a response to human handoff prompt
-        # Load last few messages and check if last AI message asked for human agent
-        recent_qs = Message.objects.filter(conversation=conversation).order_by('-timestamp')[:5]
-        last_messages = list(recent_qs)
-
-        needs_human_response = False
-        if len(last_messages) > 1:
-            # find the most recent AI message within the recent slice
-            last_ai_msg = next((m for m in last_messages if not m.is_user), None)
-            if last_ai_msg and 'human agent' in last_ai_msg.content.lower():
-                # User is responding to human agent prompt
-                if any(k in user_message.lower() for k in ('yes', 'ok', 'sure')):
-                    needs_human_response = True
-        
-        if needs_human_response:
-            ai_response = {
-                'success': False,
-                'response': "Please provide your details so our human agent can contact you:\n\n1. Your Name\n2. Contact Number\n3. Brief summary of your issue",
-                'type': 'collect_human_details'
+        if turns:
+            limiter = get_concurrency_limiter()
+            shed_reason = limiter.acquire()
+            if shed_reason:
+                SHED.inc(shed_reason)
+                return busy_response()
+            try:
+                self._answer_turns(turns, results)
+            finally:
+                limiter.release()
+        
+        return Response({'results': results})
+    
+    def _validate_item(self, request, position, item):
+        if not isinstance(item, dict):
+            return {'error': 'Each message must be an object'}
+        
+        user_message = item.get('message', '')
+        if not isinstance(user_message, str) or not user_message.strip():
+            return {'error': 'Message cannot be empty'}
+        
+        serializer = ChatMessageSerializer(data={
+            'session_id': item.get('session_id') or f"auto_{timezone.now().timestamp()}_{id(request)}_{position}",
+            'message': user_message,
+            'language': item.get('language') or 'en',
+        })
+        if not serializer.is_valid():
+            return {'error': 'Invalid message', 'details': serializer.errors}
+        
+        return dict(serializer.validated_data, position=position)
+    
+    def _answer_turns(self, turns, results):
+        ai_responses = self._score([turn['message'] for turn in turns])
+        
+        # Each shard's sessions are written together (one group without sharding)
+        shard_turns = {}
+        for turn, ai_response in zip(turns, ai_responses):
+            shard_turns.setdefault(shard_for(turn['session_id']), []).append((turn, ai_response))
+        answered = []
+        for scored_turns in shard_turns.values():
+            with use_shard(scored_turns[0][0]['session_id']):
+                answered.extend(self._save_turns(scored_turns, results))
+        record_responses(answered)
+    
+    def _save_turns(self, scored_turns, results):
+        with stage_timer('db_write'):
+            conversations = run_write(self._get_or_create_conversations, [turn for turn, _ in scored_turns])
+        recent = self._recent_messages(conversations.values())
+        
+        # Walk the turns in order so a "yes" can answer a human agent offer
+        # made earlier in the same batch
+        new_messages = []
+        answered = []
+        for turn, ai_response in scored_turns:
+            if ai_response is None:
+                results[turn['position']] = {'error': 'Could not process message'}
+                continue
+            
+            conversation = conversations[turn['session_id']]
+            history = recent.setdefault(conversation.pk, [])
+            user_msg = Message(conversation=conversation, content=turn['message'], is_user=True)
+            history.insert(0, user_msg)
+            
+            if wants_human_agent(history[:5], turn['message']):
+                ai_response = dict(HUMAN_DETAILS_RESPONSE)
+            RESPONSES.inc(ai_response.get('type', 'unknown'))
+            
+            ai_msg = ai_message(conversation.pk, ai_response)
+            history.insert(0, ai_msg)
+            del history[5:]
+            
+            new_messages.extend([user_msg, ai_msg])
+            answered.append(ai_response)
+            results[turn['position']] = chat_response_data(
+                turn['session_id'], turn['message'], ai_response
+            )
+        
+        with stage_timer('db_write'):
+            run_write(Message.objects.bulk_create, new_messages)
+        
+        # Cached human-agent state of these sessions is now out of date
+        for session_id in conversations:
+            forget_session(session_id)
+            mark_session_written(session_id)
+        return answered
+    
+    def _get_or_create_conversations(self, turns):
+        """Map each session_id in the batch to its Conversation, creating missing ones."""
+        languages = {}
+        for turn in turns:
+            languages.setdefault(turn['session_id'], turn['language'])
+        
+        with transaction.atomic(using=router.db_for_write(Conversation)):
+            conversations = {
+                c.session_id: c for c in Conversation.objects.filter(session_id__in=languages)
             }
-        else:
-            # Get AI response
-            ai_response = self.faq_matcher.get_response(user_message)
-        
-        # Save AI response
-        ai_msg = Message.objects.create(
-            conversation=conversation,
-            content=ai_response['response'],
-            is_user=False
-        )
+            missing = [sid for sid in languages if sid not in conversations]
+            if missing:
+                # ignore_conflicts: another request may create the same session meanwhile
+                Conversation.objects.bulk_create(
+                    [Conversation(session_id=sid, language=languages[sid]) for sid in missing],
+                    ignore_conflicts=True
+                )
+                conversations.update({
+                    c.session_id: c for c in Conversation.objects.filter(session_id__in=missing)
+                })
+            
+            Conversation.objects.filter(
+                pk__in=[c.pk for c in conversations.values()]
+            ).update(last_active=timezone.now())
         
-        # Prepare response data
-        response_data = {
-            'session_id': session_id,
-            'user_message': user_message,
-            'ai_response': ai_response['response'],
-            'response_type': ai_response.get('type', 'unknown'),
-            'confidence': ai_response.get('confidence', 0),
-            'timestamp': timezone.now().isoformat()
-        }
+        return conversations
+    
+    def _recent_messages(self, conversations):
+        """The 4 latest messages of each conversation, newest first, in one query."""
+        rows = Message.objects.filter(
+            conversation__in=list(conversations)
+        ).annotate(
+            recent_rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('conversation')],
+                order_by=F('timestamp').desc()
+            )
+        ).filter(recent_rank__lte=4).order_by('conversation', 'recent_rank')
         
-        if ai_response.get('success'):
-            response_data.update({
-                'matched_question': ai_response.get('question'),
-                'category': ai_response.get('category')
-            })
+        recent = {}
+        for msg in rows:
+            recent.setdefault(msg.conversation_id, []).append(msg)
+        return recent
+    
+    def _score(self, messages):
+        """Score all messages together; on failure, retry one by one so errors stay per item."""
+        try:
+            return self.faq_matcher.get_responses(messages)
+        except Exception:
+            logger.exception("Batch scoring failed; scoring messages individually")
         
-        return Response(response_data)
+        responses = []
+        for message in messages:
+            try:
+                responses.append(self.faq_matcher.get_response(message))
+            except Exception:
+                logger.exception("Failed to score chat message")
+                responses.append(None)
+        return responses
 
 class RequestHumanAgentView(APIView):
+    @idempotent('handoff')
     def post(self, request):
         serializer = HumanHandoffSerializer(data=request.data)
         
         if serializer.is_valid():
-            try:
-                conversation = Conversation.objects.get(
-                    session_id=serializer.validated_data['session_id']
-                )
-                
-                # Check if already exists
-                existing_request = HumanHandoffRequest.objects.filter(
-                    conversation=conversation,
-                    status='pending'
-                ).first()
-                
-                if existing_request:
+            with use_shard(serializer.validated_data['session_id']):
+                try:
+                    conversation = Conversation.objects.get(
+                        session_id=serializer.validated_data['session_id']
+                    )
+                except Conversation.DoesNotExist:
                     return Response({
-                        'success': True,
-                        'message': 'Your request is already in queue. An agent will contact you shortly.',
-                        'ticket_id': existing_request.id,
-                        'status': existing_request.status
-                    })
+                        'error': 'Invalid session'
+                    }, status=status.HTTP_400_BAD_REQUEST)
                 
-                # Create new request
-                handoff_request = HumanHandoffRequest.objects.create(
-                    conversation=conversation,
-                    name=serializer.validated_data['name'],
-                    phone=serializer.validated_data['phone'],
-                    problem_summary=serializer.validated_data['problem_summary']
+                handoff_request, created = run_write(
+                    self.open_request, conversation, serializer.validated_data
                 )
-                
-                # Send notification to admin/agent
-                NotificationService.send_agent_notification(handoff_request)
-                
+            
+            if not created:
                 return Response({
                     'success': True,
-                    'message': 'Your request has been submitted. A human agent will contact you within 24 hours.',
+                    'message': 'Your request is already in queue. An agent will contact you shortly.',
                     'ticket_id': handoff_request.id,
-                    'reference_number': str(handoff_request.id)[:8].upper()
+                    'status': handoff_request.status
                 })
-                
-            except Conversation.DoesNotExist:
-                return Response({
-                    'error': 'Invalid session'
-                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            # Send notification to admin/agent
+            NotificationService.send_agent_notification(handoff_request)
+            
+            return Response({
+                'success': True,
+                'message': 'Your request has been submitted. A human agent will contact you within 24 hours.',
+                'ticket_id': handoff_request.id,
+                'reference_number': str(handoff_request.id)[:8].upper()
+            })
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    @staticmethod
+    def open_request(conversation, details):
+        """
+        Open the conversation's handoff request; returns (request, created).
+        
+        A conversation has one request (OneToOneField), so instead of
+        check-then-insert, which lets two concurrent submissions both insert
+        and one fail on the unique constraint, the insert skips on conflict.
+        An existing pending request is returned as it is; a contacted or
+        resolved one is reopened with the new details.
+        """
+        fields = {
+            'name': details['name'],
+            'phone': details['phone'],
+            'problem_summary': details['problem_summary'],
+        }
+        candidate = HumanHandoffRequest(conversation=conversation, **fields)
+        HumanHandoffRequest.objects.bulk_create([candidate], ignore_conflicts=True)
+        handoff_request = HumanHandoffRequest.objects.get(conversation=conversation)
+        if handoff_request.pk == candidate.pk:
+            return handoff_request, True
+        
+        reopened = HumanHandoffRequest.objects.filter(pk=handoff_request.pk).exclude(status='pending').update(
+            status='pending', created_at=timezone.now(), **fields
+        )
+        if reopened:
+            handoff_request.refresh_from_db()
+            return handoff_request, True
+        handoff_request.refresh_from_db(fields=['status'])
+        return handoff_request, False
+
+
+def message_data(msg):
+    return {
+        'id': str(msg.id),
+        'content': msg.content,
+        'is_user': msg.is_user,
+        'timestamp': msg.timestamp.isoformat()
+    }
+
 
 class ConversationHistoryView(APIView):
+    """
+    Messages of a session, oldest first. With ``limit``, returns one page
+    and ``next_after``: pass it back as ``after`` for the next page (keyset
+    pagination on (timestamp, id), so deep pages cost the same as the first).
+    With ``stream=1``, the messages are streamed as they are read instead of
+    being built into one response in memory.
+    """
+    stream_chunk_size = 200
+    
     def get(self, request):
         session_id = request.query_params.get('session_id')
         
@@ -158,29 +475,107 @@ class ConversationHistoryView(APIView):
                 'error': 'session_id is required'
             }, status=status.HTTP_400_BAD_REQUEST)
         
+        after = request.query_params.get('after')
+        limit = request.query_params.get('limit')
+        stream = request.query_params.get('stream') in ('1', 'true')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = 0
+            if limit < 1:
+                return Response({
+                    'error': 'limit must be a positive integer'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if stream:
+                return Response({
+                    'error': 'limit cannot be combined with stream'
+                }, status=status.HTTP_400_BAD_REQUEST)
+        
         try:
-            conversation = Conversation.objects.get(session_id=session_id)
-            messages = Message.objects.filter(
-                conversation=conversation
-            ).order_by('timestamp')
-            
-            messages_data = []
-            for msg in messages:
-                messages_data.append({
-                    'id': str(msg.id),
-                    'content': msg.content,
-                    'is_user': msg.is_user,
-                    'timestamp': msg.timestamp.isoformat()
-                })
+            # Read-only: served by the replica unless this session just wrote
+            with use_shard(session_id), use_replica(session_id=session_id):
+                conversation = Conversation.objects.get(session_id=session_id)
+                messages = Message.objects.filter(
+                    conversation=conversation
+                ).order_by('timestamp', 'id')
+                
+                if after:
+                    try:
+                        cursor = messages.values('timestamp', 'id').get(pk=after)
+                    except (Message.DoesNotExist, ValidationError):
+                        return Response({
+                            'error': 'after must be the id of a message in this conversation'
+                        }, status=status.HTTP_400_BAD_REQUEST)
+                    messages = messages.filter(
+                        Q(timestamp__gt=cursor['timestamp']) |
+                        Q(timestamp=cursor['timestamp'], id__gt=cursor['id'])
+                    )
+                
+                if stream:
+                    return StreamingHttpResponse(
+                        self.stream_history(session_id, conversation, messages),
+                        content_type='application/json'
+                    )
+                
+                if limit:
+                    # One extra row tells whether there is a next page
+                    messages = list(messages[:limit + 1])
+                    has_more = len(messages) > limit
+                    messages = messages[:limit]
+                
+                messages_data = [message_data(msg) for msg in messages]
             
-            return Response({
+            data = {
                 'session_id': session_id,
                 'conversation_id': str(conversation.id),
                 'messages': messages_data,
                 'total_messages': len(messages_data)
-            })
+            }
+            if limit:
+                data['next_after'] = messages_data[-1]['id'] if has_more else None
+            return Response(data)
             
         except Conversation.DoesNotExist:
             return Response({
                 'error': 'Conversation not found'
             }, status=status.HTTP_404_NOT_FOUND)
+    
+    def stream_history(self, session_id, conversation, messages):
+        """The non-streamed response body, yielded stream_chunk_size messages at a time."""
+        chunk_size = self.stream_chunk_size
+        # Runs after get() has returned, so it needs its own routing blocks
+        with use_shard(session_id), use_replica(session_id=session_id):
+            yield (
+                b'{"session_id":' + orjson.dumps(session_id) +
+                b',"conversation_id":' + orjson.dumps(str(conversation.id)) +
+                b',"messages":['
+            )
+            total = 0
+            chunk = []
+            for msg in messages.iterator(chunk_size=chunk_size):
+                chunk.append(orjson.dumps(message_data(msg)))
+                if len(chunk) == chunk_size:
+                    yield (b',' if total else b'') + b','.join(chunk)
+                    total += len(chunk)
+                    chunk = []
+            if chunk:
+                yield (b',' if total else b'') + b','.join(chunk)
+                total += len(chunk)
+            yield b'],"total_messages":' + str(total).encode() + b'}'
+
+
+class MetricsView(APIView):
+    """Prometheus scrape endpoint, summed across gunicorn workers."""
+    authentication_classes = []
+    
+    def get(self, request):
+        token = getattr(settings, 'METRICS_AUTH_TOKEN', '')
+        if not token:
+            # Only development servers may be scraped without a token
+            if not settings.DEBUG:
+                return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        elif request.headers.get('Authorization') != f"Bearer {token}":
+            return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+        
+        return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,36 @@
+"""
+Warm start for preforked workers.
+
+A fresh gunicorn worker imports the views, loads the NLTK stopwords and
+tokenizer, builds the FAQ index and warms up fuzzy scoring on its first
+chat request, so the first user of every worker waits for all of it. With
+preload_app (gunicorn.conf.py) the master calls warm_up() once before
+forking instead, and every worker starts with that state already in its
+(copy-on-write shared) memory.
+"""
+
+import logging
+import time
+
+from django.db import connections
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_QUERY = 'How do I register as an astrologer?'
+
+
+def warm_up(query: str = WARM_UP_QUERY) -> int:
+    """Do a worker's first-request work in this process; returns the FAQ count."""
+    from .ai_matcher import FAQMatcher
+
+    started = time.perf_counter()
+    # Imports every view module, and with them the matcher and its NLTK data
+    get_resolver().url_patterns
+    matcher = FAQMatcher(service_socket='')
+    index = matcher.get_faq_index()
+    matcher.find_top_matches(query, index=index)
+    # A connection opened here must not be shared by the forked workers
+    connections.close_all()
+    logger.info("Warmed up with %d FAQs in %.0f ms", len(index), 1000 * (time.perf_counter() - started))
+    return len(index)
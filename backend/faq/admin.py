@@ -3,15 +3,30 @@ Django admin configuration for FAQ models.
 """
 
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+
+from astrotamil_api.routers import ReplicaChangeListMixin
+
 from .models import FAQ
+from .search import search_faqs
+
+
+class FAQChangeList(ChangeList):
+    """Lists search results by rank unless a column header was clicked"""
+    
+    def get_ordering(self, request, queryset):
+        if self.query.strip() and ORDER_VAR not in self.params:
+            return ['-search_rank', 'pk']
+        return super().get_ordering(request, queryset)
 
 
 @admin.register(FAQ)
-class FAQAdmin(admin.ModelAdmin):
+class FAQAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     """Admin interface for FAQ model."""
     
     list_display = ('question_preview', 'category', 'keyword_count', 'created_at', 'updated_at')
     list_filter = ('category', 'created_at', 'updated_at')
+    # Searched through the FAQ search index, not LIKE scans (get_search_results)
     search_fields = ('question', 'answer', 'keywords', 'category')
     readonly_fields = ('id', 'created_at', 'updated_at')
     
@@ -28,6 +43,15 @@ class FAQAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_search_results(self, request, queryset, search_term):
+        """FAQs matching the search box through faq.search, best match first."""
+        if not search_term.strip():
+            return queryset, False
+        return search_faqs(search_term, queryset), False
+    
+    def get_changelist(self, request, **kwargs):
+        return FAQChangeList
+    
     def question_preview(self, obj):
         """Display question preview."""
         preview = obj.question[:80]
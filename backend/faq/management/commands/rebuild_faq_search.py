@@ -0,0 +1,30 @@
+"""
+Recreate the FAQ search index (faq/search.py) from the FAQ table.
+
+    python manage.py rebuild_faq_search
+    python manage.py rebuild_faq_search --database replica
+
+Run it after a migration that alters the FAQ table: Django rebuilds SQLite
+tables to alter them, which drops the FTS triggers and renumbers rows.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from faq.models import FAQ
+from faq.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Recreate the FAQ search index from the FAQ table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias (default: default)')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        rebuild_search_index(connection)
+        count = FAQ.objects.using(options['database']).count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt the {connection.vendor} FAQ search index over {count} FAQs"
+        ))
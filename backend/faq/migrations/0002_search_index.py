@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:10
+
+from django.db import migrations
+
+from faq.search import create_search_index, drop_search_index
+
+
+def create_index(apps, schema_editor):
+    create_search_index(schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faq', '0001_initial'),
+    ]
+
+    # FTS5 table and triggers on SQLite, pg_trgm and GIN indexes on
+    # Postgres, nothing elsewhere (see faq/search.py)
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
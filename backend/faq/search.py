@@ -0,0 +1,163 @@
+"""
+Indexed FAQ search over question, answer, keywords and category.
+
+A plain ``icontains`` search (the admin default) is a ``LIKE '%...%'``
+scan of every FAQ's text, JSON keywords included. Instead:
+
+* SQLite: an FTS5 table ``faqs_fts`` with the FAQ table as external
+  content, kept in sync by triggers and ranked with bm25, question matches
+  weighing most. Query words match as prefixes, so partly typed words find
+  results.
+* Postgres: pg_trgm GIN indexes on question and answer, and a jsonb GIN
+  index on keywords. FAQs match when the query is word-similar to the
+  question or answer or names one of the keywords. They are ranked by that
+  similarity (question first) plus keyword hits.
+* Other databases: ``icontains`` on question, answer and category.
+
+search_faqs() returns a queryset annotated with ``search_rank`` (higher is
+better) and ordered by it, for the admin changelist and /api/faq/search/.
+
+Django rebuilds a SQLite table to alter it, which drops the triggers. Run
+``manage.py rebuild_faq_search`` after a migration that alters the FAQ
+table, or whenever the index may be out of sync.
+"""
+
+import re
+from typing import List
+
+from django.db import connections
+from django.db.models import Case, ExpressionWrapper, FloatField, Q, QuerySet, Value, When
+
+# Words of the query that are searched for; the rest are ignored
+MAX_QUERY_TERMS = 12
+
+# bm25 weights of the FTS columns: question, answer, keywords, category
+FTS_WEIGHTS = (10.0, 2.0, 5.0, 1.0)
+QUESTION_WEIGHT = 2.0
+KEYWORD_WEIGHT = 0.5
+
+SQLITE_CREATE = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS faqs_fts USING fts5(
+        question, answer, keywords, category,
+        content='faqs', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS faqs_fts_insert AFTER INSERT ON faqs BEGIN
+        INSERT INTO faqs_fts(rowid, question, answer, keywords, category)
+        VALUES (new.rowid, new.question, new.answer, new.keywords, new.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS faqs_fts_delete AFTER DELETE ON faqs BEGIN
+        INSERT INTO faqs_fts(faqs_fts, rowid, question, answer, keywords, category)
+        VALUES ('delete', old.rowid, old.question, old.answer, old.keywords, old.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS faqs_fts_update AFTER UPDATE ON faqs BEGIN
+        INSERT INTO faqs_fts(faqs_fts, rowid, question, answer, keywords, category)
+        VALUES ('delete', old.rowid, old.question, old.answer, old.keywords, old.category);
+        INSERT INTO faqs_fts(rowid, question, answer, keywords, category)
+        VALUES (new.rowid, new.question, new.answer, new.keywords, new.category);
+    END""",
+    "INSERT INTO faqs_fts(faqs_fts) VALUES ('rebuild')",
+)
+SQLITE_DROP = (
+    'DROP TRIGGER IF EXISTS faqs_fts_insert',
+    'DROP TRIGGER IF EXISTS faqs_fts_delete',
+    'DROP TRIGGER IF EXISTS faqs_fts_update',
+    'DROP TABLE IF EXISTS faqs_fts',
+)
+
+# The pg_trgm extension is left in place when the indexes are dropped
+POSTGRES_CREATE = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS faqs_question_trgm ON faqs USING gin (question gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS faqs_answer_trgm ON faqs USING gin (answer gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS faqs_keywords_gin ON faqs USING gin (keywords jsonb_path_ops)',
+)
+POSTGRES_DROP = (
+    'DROP INDEX IF EXISTS faqs_question_trgm',
+    'DROP INDEX IF EXISTS faqs_answer_trgm',
+    'DROP INDEX IF EXISTS faqs_keywords_gin',
+)
+
+_STATEMENTS = {
+    'sqlite': (SQLITE_CREATE, SQLITE_DROP),
+    'postgresql': (POSTGRES_CREATE, POSTGRES_DROP),
+}
+
+
+def create_search_index(connection):
+    """Create (or complete) the search index for this database, if it has one."""
+    create, _ = _STATEMENTS.get(connection.vendor, ((), ()))
+    with connection.cursor() as cursor:
+        for statement in create:
+            cursor.execute(statement)
+
+
+def drop_search_index(connection):
+    _, drop = _STATEMENTS.get(connection.vendor, ((), ()))
+    with connection.cursor() as cursor:
+        for statement in drop:
+            cursor.execute(statement)
+
+
+def rebuild_search_index(connection):
+    """Recreate the index from the FAQ table."""
+    drop_search_index(connection)
+    create_search_index(connection)
+
+
+def query_terms(query: str) -> List[str]:
+    """Lower-cased words of a search query, at most MAX_QUERY_TERMS, in order."""
+    terms = []
+    for term in re.findall(r'\w+', query.lower()):
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def fts_match(terms: List[str]) -> str:
+    """FTS5 query matching any of the terms as a word prefix"""
+    return ' OR '.join(f'"{term}"*' for term in terms)
+
+
+def search_faqs(query: str, queryset: QuerySet) -> QuerySet:
+    """FAQs in ``queryset`` matching ``query``, best first, annotated with ``search_rank``."""
+    terms = query_terms(query)
+    if not terms:
+        return queryset.none()
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        # One FTS scan ranks and filters at once; joined on the rowid the
+        # index shares with the FAQ table (no ORM expression can join it)
+        table = queryset.model._meta.db_table
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        return queryset.extra(
+            tables=['faqs_fts'],
+            where=[f'faqs_fts.rowid = {table}.rowid', 'faqs_fts MATCH %s'],
+            params=[fts_match(terms)],
+            select={'search_rank': f'-bm25(faqs_fts, {weights})'},
+        ).order_by('-search_rank', 'pk')
+
+    if vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramWordSimilarity
+
+        text = ' '.join(terms)
+        keyword_hits = [Q(keywords__contains=[term]) for term in terms]
+        matches = Q(question__trigram_word_similar=text) | Q(answer__trigram_word_similar=text)
+        for hit in keyword_hits:
+            matches |= hit
+        rank = (
+            QUESTION_WEIGHT * TrigramWordSimilarity(text, 'question')
+            + TrigramWordSimilarity(text, 'answer')
+        )
+        for hit in keyword_hits:
+            rank = rank + Case(When(hit, then=Value(KEYWORD_WEIGHT)), default=Value(0.0))
+        return queryset.filter(matches).annotate(
+            search_rank=ExpressionWrapper(rank, output_field=FloatField())
+        ).order_by('-search_rank', 'pk')
+
+    matches = Q()
+    for term in terms:
+        matches |= Q(question__icontains=term) | Q(answer__icontains=term) | Q(category__icontains=term)
+    return queryset.filter(matches).annotate(
+        search_rank=Value(0.0, output_field=FloatField())
+    ).order_by('question', 'pk')
@@ -1,5 +1,7 @@
 from django.urls import path
 
+from .views import FAQSearchView
+
 urlpatterns = [
-    # Add FAQ endpoints here (list/retrieve) later
+    path('search/', FAQSearchView.as_view(), name='faq_search'),
 ]
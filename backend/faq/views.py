@@ -0,0 +1,61 @@
+"""
+Public FAQ endpoints.
+"""
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from astrotamil_api.routers import use_replica
+
+from .models import FAQ
+from .search import search_faqs
+
+
+class FAQSearchPagination(PageNumberPagination):
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'FAQ_SEARCH_PAGE_SIZE', 20)
+        self.max_page_size = getattr(settings, 'FAQ_SEARCH_MAX_PAGE_SIZE', 100)
+
+
+def search_result_data(faq):
+    return {
+        'id': str(faq.id),
+        'question': faq.question,
+        'answer': faq.answer,
+        'category': faq.category,
+        'keywords': faq.keywords,
+        'rank': round(faq.search_rank, 4),
+    }
+
+
+class FAQSearchView(APIView):
+    """
+    FAQs matching ``q`` over question, answer, keywords and category, best
+    first, ``page_size`` (default FAQ_SEARCH_PAGE_SIZE) per ``page``.
+    """
+    max_query_length = 200
+    
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({
+                'error': 'q is required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if len(query) > self.max_query_length:
+            return Response({
+                'error': f'q must be at most {self.max_query_length} characters'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        paginator = FAQSearchPagination()
+        # FAQ edits are rare, so search may read a lagging replica
+        with use_replica():
+            page = paginator.paginate_queryset(search_faqs(query, FAQ.objects.all()), request, view=self)
+            results = [search_result_data(faq) for faq in page]
+        response = paginator.get_paginated_response(results)
+        response.data['query'] = query
+        return response
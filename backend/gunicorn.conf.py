@@ -0,0 +1,48 @@
+"""
+Gunicorn configuration, picked up automatically when gunicorn is started
+from backend/:
+
+    gunicorn astrotamil_api.wsgi:application --bind 0.0.0.0:$PORT --workers 4
+
+With GUNICORN_PRELOAD=True (the default) the master loads the app and
+runs chatbot.warmup.warm_up() before forking any worker, so workers answer
+their first request without loading NLTK data or building the FAQ index.
+gc.freeze() then moves every object that exists at that point out of the
+garbage collector's reach: otherwise the first collection in each worker
+writes to all of their headers and un-shares the copy-on-write pages
+holding them. Workers restarted later (--max-requests) fork from the same
+warmed master.
+
+With preloading, `kill -HUP` restarts workers from the master's copy of
+the code; deploy new code with a full restart. Set GUNICORN_PRELOAD=False
+to have each worker load the app itself.
+"""
+
+import gc
+import os
+
+# As in wsgi.py; the hooks below use settings even when the master never loads the app
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'astrotamil_api.settings')
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True') == 'True'
+
+
+def when_ready(server):
+    # Runs in the master, after the preloaded app and before the first fork
+    if not preload_app:
+        return
+    from chatbot.warmup import warm_up
+
+    try:
+        count = warm_up()
+    except Exception:
+        server.log.exception("Warm-up failed; workers will load on their first request")
+        return
+    gc.freeze()
+    server.log.info("Warmed up %d FAQs; %d objects frozen for sharing", count, gc.get_freeze_count())
+
+
+def child_exit(server, worker):
+    from chatbot.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
@@ -0,0 +1,86 @@
+"""
+Benchmark FAQMatcher upper-bound pruning.
+Replays the user messages stored in the database (our real query log)
+through the matcher with and without pruning, checks that both pick the
+same FAQ, and reports how many full fuzzy scorings were avoided.
+"""
+
+import argparse
+import os
+import sys
+import time
+import django
+
+# Setup Django
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'astrotamil_api.settings')
+django.setup()
+
+from chatbot.ai_matcher import FAQMatcher
+from chatbot.models import Message
+
+
+def load_queries(path=None):
+    """Read one query per line from a file, or the user messages from the DB."""
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    return list(
+        Message.objects.filter(is_user=True)
+        .order_by('timestamp')
+        .values_list('content', flat=True)
+    )
+
+
+def replay(matcher, queries):
+    """Run every query through find_best_match and collect results and stats."""
+    results = []
+    candidates = scored = 0
+    started = time.perf_counter()
+    for query in queries:
+        match = matcher.find_best_match(query)
+        results.append((match['faq'].pk, match['score']) if match else None)
+        candidates += matcher.last_match_stats['candidates']
+        scored += matcher.last_match_stats['scored']
+    elapsed = time.perf_counter() - started
+    return results, candidates, scored, elapsed
+
+
+def benchmark_pruning(path=None):
+    queries = load_queries(path)
+    if not queries:
+        print("No queries to replay. Import FAQs and chat first, or pass --queries.")
+        return False
+
+    matcher = FAQMatcher()
+    matcher.get_faq_index()  # build the index outside the timed runs
+
+    matcher.use_upper_bounds = False
+    baseline, candidates, baseline_scored, baseline_time = replay(matcher, queries)
+
+    matcher.use_upper_bounds = True
+    pruned, _, pruned_scored, pruned_time = replay(matcher, queries)
+
+    mismatches = sum(1 for a, b in zip(baseline, pruned) if a != b)
+    avoided = baseline_scored - pruned_scored
+
+    print("=" * 60)
+    print("FAQMatcher Upper-Bound Pruning Benchmark")
+    print("=" * 60)
+    print(f"Queries replayed:      {len(queries)}")
+    print(f"FAQ candidates:        {candidates}")
+    print(f"Full scorings (off):   {baseline_scored}")
+    print(f"Full scorings (on):    {pruned_scored}")
+    print(f"Scorings avoided:      {avoided} ({100 * avoided / max(baseline_scored, 1):.1f}%)")
+    print(f"Time without pruning:  {baseline_time * 1000:.1f} ms")
+    print(f"Time with pruning:     {pruned_time * 1000:.1f} ms")
+    print(f"Speedup:               {baseline_time / max(pruned_time, 1e-9):.2f}x")
+    print(f"Result mismatches:     {mismatches}")
+    return mismatches == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--queries', help='File with one query per line (default: user messages in the DB)')
+    args = parser.parse_args()
+    sys.exit(0 if benchmark_pruning(args.queries) else 1)